@@ -1,19 +1,55 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import copy
+import functools
+import hashlib
+import re
+import sqlite3
+import time
+import uuid
 from decouple import config
 import os
 import json
 import boto3
 from botocore.exceptions import ClientError
+from contextvars import ContextVar
 from crewai import Agent, Task, Crew, Process
-from main import PDFReaderTool
+from main import PDFReaderTool, extract_pdf_page_texts, pdf_metadata, resolve_pages, text_hash
+from PyPDF2 import PdfReader
 from summarizer_agent import SummarizerAgent
 from test_generator_agent import TestGeneratorAgent
+from document_index import select_relevant_chunks
+from text_store import file_hash, get_text_store
+from result_store import RESULT_KINDS, StoredResult, get_result_store
+from search_index import SEARCH_MAX_RESULTS, get_search_index
+from html_renderer import get_rendered_html
+from summary_fragments import SUMMARY_FRAGMENT_CONCURRENCY, fragment_key, group_pages, stitch_fragments
+from text_normalizer import normalize_pages, normalize_text
+from test_sharding import TEST_MAX_QUESTIONS, TestShard, merge_tests, plan_shards
+from ui_tree import (
+    UI_TREE_DEFAULT_DEPTH, UI_TREE_MAX_DEPTH, UI_TREE_MAX_PAGE_SIZE, UI_TREE_PAGE_SIZE, get_tree_index
+)
+from tree_diff import diff_trees, stabilize_ids
+from wire_format import accepts_msgpack, encode_msgpack, msgpack_media_type, wire_tables
+from single_flight import LeaderCancelledError, SingleFlight
+from compression import CompressionMiddleware, choose_encoding, encoding_etag, etag_matches
+from llm_governor import get_http_client, install_litellm_client
+from llm_budget import LLMBudgetMiddleware, allow_fanout, install_agent_attribution
+from cancellation import CancelOnDisconnectMiddleware, register_cleanup, run_cancellable
+from deadline import DEADLINE_MAX_SECONDS, PartialResults, add_partial, current_partial, keep_in_background, wait_for_deadline
+from request_logging import RequestLoggingMiddleware, setup_queue_logging
+from profiling import (
+    PROFILING_DEFAULT_INTERVAL, PROFILING_MAX_SECONDS, PROFILING_TOKEN_HEADER, ProfilerBusy,
+    RequestProfilingMiddleware, check_token, get_request_profile, memory_tracer, profile_cpu, profiling_enabled
+)
+import metrics
+from metrics import CrewTaskTimer, instrument_endpoint, track_stage
 from openai import OpenAI
 import logging
-import time
 
 # Настройка логирования
 logging.basicConfig(
@@ -22,31 +58,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-class RequestLoggingMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        # Логируем информацию о запросе
-        logger.info(f"Request: {request.method} {request.url.path}")
-        logger.info(f"Headers: {dict(request.headers)}")
-        
-        # Получаем тело запроса
-        body = await request.body()
-        try:
-            # Пытаемся декодировать JSON
-            body_json = json.loads(body)
-            logger.info(f"Request body: {json.dumps(body_json, indent=2)}")
-        except json.JSONDecodeError:
-            # Если не JSON, логируем как есть
-            logger.info(f"Request body: {body.decode()}")
-        
-        # Замеряем время выполнения
-        start_time = time.time()
-        response = await call_next(request)
-        process_time = time.time() - start_time
-        
-        # Логируем время выполнения
-        logger.info(f"Request processed in {process_time:.2f} seconds")
-        
-        return response
+# Логи запросов пишутся через очередь в отдельном потоке
+setup_queue_logging()
+
+# Подробный вывод crewai в консоль. Консольный вывод crewai не потокобезопасен:
+# при нескольких crew, выполняющихся одновременно (параллельные запросы,
+# сводка и тест в /process-lecture/, фрагменты сводки), процесс падает с
+# segmentation fault. Включать только для отладки одиночных запросов.
+CREW_VERBOSE = config('CREW_VERBOSE', default=False, cast=bool)
 
 class S3FileLocation(BaseModel):
     """
@@ -54,6 +73,21 @@ class S3FileLocation(BaseModel):
     """
     file_key: str
     folder_path: str = ""  # Опциональный путь к папке в bucket
+    # Опциональный выбор части документа: диапазон страниц (с 1, включительно)
+    # или заголовок раздела из оглавления PDF
+    page_start: Optional[int] = Field(default=None, ge=1)
+    page_end: Optional[int] = Field(default=None, ge=1)
+    section: Optional[str] = None
+
+    def selection_key(self) -> str:
+        """
+        Часть ключа кэша, описывающая выбранную часть документа ("" — весь документ)
+        """
+        if self.section:
+            return "section-" + hashlib.sha256(self.section.strip().casefold().encode('utf-8')).hexdigest()[:16]
+        if self.page_start is not None or self.page_end is not None:
+            return f"pages-{self.page_start or 1}-{self.page_end or 'end'}"
+        return ""
 
 class S3Response(BaseModel):
     """
@@ -78,7 +112,7 @@ class JSONProcessorAgent:
         self.agent = Agent(
             role='JSON Processor',
             goal='Process and transform JSON data according to specific requirements',
-            verbose=True,
+            verbose=CREW_VERBOSE,
             memory=True,
             backstory="""You are an expert in processing and transforming JSON data.
             Your task is to analyze incoming JSON and generate test from it according to the requirements.""",
@@ -91,175 +125,8 @@ class JSONProcessRequest(BaseModel):
 class JSONProcessResponse(BaseModel):
     processed_json: dict
 
-app = FastAPI(
-    title="PDF Summarizer API",
-    description="API для обработки PDF файлов и генерации структурированного JSON",
-    version="1.0.0"
-)
-
-# Добавляем middleware для логирования
-app.add_middleware(RequestLoggingMiddleware)
-
-# Настройка CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Разрешаем все источники
-    allow_credentials=True,  # Разрешаем куки
-    allow_methods=["*"],  # Разрешаем все методы
-    allow_headers=["*"],  # Разрешаем все заголовки
-    expose_headers=["*"],  # Разрешаем доступ ко всем заголовкам ответа
-    max_age=600,  # Кэширование CORS на 10 минут
-)
-
-# Конфигурация OpenAI API
-OPENAI_API_KEY = config('OPENAI_API_KEY')
-if not OPENAI_API_KEY:
-    raise ValueError("Please set OPENAI_API_KEY in .env file")
-
-# Устанавливаем API ключ для OpenAI
-os.environ["OPENAI_API_KEY"] = OPENAI_API_KEY
-client = OpenAI(api_key=OPENAI_API_KEY)
-
-# Конфигурация AWS
-AWS_BUCKET_NAME = 'qysqa'
-
-# Инициализация S3 клиента
-s3_client = boto3.client('s3')
-
-async def download_file_from_s3(bucket: str, file_location: S3FileLocation, local_path: str):
-    """
-    Загружает файл из S3 bucket
-    """
-    try:
-        # Формируем полный путь к файлу в S3
-        s3_path = os.path.join(file_location.folder_path, file_location.file_key).replace('\\', '/')
-        s3_path = s3_path.lstrip('/')  # Убираем начальный слеш, если есть
-        
-        s3_client.download_file(bucket, s3_path, local_path)
-        return True
-    except ClientError as e:
-        print(f"Error downloading file from S3: {str(e)}")
-        return False
-
-async def upload_json_to_s3(bucket: str, json_data: dict, folder_name: str, file_name: str) -> dict:
-    """
-    Загружает JSON в S3 bucket в папку summaries
-    
-    Args:
-        bucket (str): Имя S3 bucket
-        json_data (dict): JSON данные для загрузки
-        folder_name (str): Имя папки в bucket
-        file_name (str): Имя файла
-        
-    Returns:
-        dict: Информация о загруженном файле
-    """
-    try:
-        # Формируем путь для сохранения в папке summaries
-        s3_path = f"{folder_name}/{file_name}.json"
-        
-        # Создаем временный файл для загрузки
-        temp_json_path = f"temp_{file_name}.json"
-        with open(temp_json_path, 'w', encoding='utf-8') as f:
-            json.dump(json_data, f, ensure_ascii=False, indent=2)
-        
-        # Загружаем файл в S3
-        s3_client.upload_file(temp_json_path, bucket, s3_path)
-        
-        # Удаляем временный файл
-        if os.path.exists(temp_json_path):
-            os.remove(temp_json_path)
-        
-        # Получаем URL для доступа к файлу
-        url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': bucket, 'Key': s3_path},
-            ExpiresIn=3600  # URL действителен 1 час
-        )
-        
-        return {
-            "bucket": bucket,
-            "file_path": s3_path,
-            "url": url
-        }
-        
-    except ClientError as e:
-        print(f"Error uploading JSON to S3: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to upload result to S3")
-
-@app.post("/process-pdf/")
-async def process_pdf(file_location: S3FileLocation):
-    """
-    Принимает информацию о расположении PDF файла в S3 bucket,
-    обрабатывает его и возвращает информацию о расположении результата UI JSON
-    
-    Args:
-        file_location (S3FileLocation): Информация о расположении файла в S3
-    """
-    try:
-        # Проверяем расширение файла
-        if not file_location.file_key.endswith('.pdf'):
-            raise HTTPException(status_code=400, detail="Файл должен быть в формате PDF")
-
-        # Создаем временный путь для файла
-        temp_path = f"temp_{os.path.basename(file_location.file_key)}"
-        print(f"Created temporary path: {temp_path}")
-
-        # Загружаем файл из S3
-        print(f"Downloading file from S3: {file_location.folder_path}/{file_location.file_key}")
-        success = await download_file_from_s3(AWS_BUCKET_NAME, file_location, temp_path)
-        if not success:
-            raise HTTPException(
-                status_code=404, 
-                detail=f"Файл не найден в S3 bucket по пути: {os.path.join(file_location.folder_path, file_location.file_key)}"
-            )
-        print(f"File downloaded successfully to: {temp_path}")
-        print(f"File exists: {os.path.exists(temp_path)}")
-        print(f"File size: {os.path.getsize(temp_path)} bytes")
-
-        try:
-            # Инициализируем инструменты и агентов
-            print("Initializing PDFReaderTool...")
-            pdf_reader_tool = PDFReaderTool()
-            print("PDFReaderTool initialized successfully")
-            
-            print("Creating Reader Agent...")
-            reader_agent = Agent(
-                role='Reader',
-                goal='Extract text from PDF documents and prepare it for processing.',
-                verbose=True,
-                memory=True,
-                backstory="""You are an expert in extracting and structuring text from PDF documents.
-                Your task is to extract text and organize it into clear sections.""",
-                tools=[pdf_reader_tool],
-                allow_delegation=True
-            )
-            print("Reader Agent created successfully")
-
-            # Создаем UI Summarizer агента
-            print("Creating Summarizer Agent...")
-            summarizer = SummarizerAgent()
-            summarizer_agent = summarizer.agent
-            print("Summarizer Agent created successfully")
-
-            # Определяем задачи
-            print("Creating tasks...")
-            read_pdf_task = Task(
-                description=f"""Read the content of the PDF document located at {temp_path}.
-                Extract the text and organize it into clear sections with titles and bullet points.""",
-                expected_output="Structured text extracted from the PDF document, organized into sections.",
-                tools=[pdf_reader_tool],
-                agent=reader_agent
-            )
-            print(f"PDF reading task created with ID: {read_pdf_task.id}")
-
-            summarize_text_task = Task(
-                description=f"""Using the content extracted by the Reader agent, generate a UI JSON representation.
-                The content you need to process is: {{result_{read_pdf_task.id}}}
-                
-                Follow the defined structure to create a properly formatted UI JSON.
-                Include appropriate node types, styling, and hierarchy as specified in the format guide.""",
-                expected_output='''{
+# Ожидаемый формат ответа агентов (общий для всех эндпоинтов)
+UI_JSON_EXPECTED_OUTPUT = '''{
   "nodeType": "STACK", // This defines the layout type, a stack container
   "id": "c8b4c8e2-f851-435f-bbaf-82b28cbdbbc0", // Unique identifier for this node
   "background": "DEFAULT", // Background style applied to this stack
@@ -389,116 +256,654 @@ async def process_pdf(file_location: S3FileLocation):
     }
   ],
   "vertical": true // The top-level stack arranges its children vertically
-}''',
-                agent=summarizer_agent
-            )
-            print(f"Summarize task created with ID: {summarize_text_task.id}")
+}'''
 
-            # Создаем и выполняем crew
-            print("Creating Crew...")
-            crew = Crew(
-                agents=[reader_agent, summarizer_agent],
-                tasks=[read_pdf_task, summarize_text_task],
-                process=Process.sequential,
-                verbose=True
-            )
-            
-            # Запуск crew
-            print("Starting Crew execution...")
-            result = crew.kickoff(inputs={'pdf_path': temp_path})
-            print("Crew execution completed")
-            
-            try:
-                # Преобразуем результат в строку для обработки
-                result_str = str(result)
-                print(f"Results received, total length: {len(result_str)}")
-                
-                # Удаляем маркеры форматирования Markdown
-                clean_result = result_str.replace("```json", "").replace("```", "")
-                
-                # Находим JSON в результате
-                json_start = clean_result.find('{')
-                if json_start == -1:
-                    raise ValueError("No JSON object found in result")
-                
-                # Ищем соответствующую закрывающую скобку
-                open_braces = 0
-                json_end = -1
-                
-                for i, char in enumerate(clean_result[json_start:]):
-                    if char == '{':
-                        open_braces += 1
-                    elif char == '}':
-                        open_braces -= 1
-                        if open_braces == 0:
-                            json_end = json_start + i + 1
-                            break
-                
-                if json_end == -1:
-                    raise ValueError("Could not find closing brace for JSON object")
-                
-                # Извлекаем JSON строку
-                json_str = clean_result[json_start:json_end]
-                
-                # Парсим JSON
-                try:
-                    ui_json = json.loads(json_str)
-                    print(f"Successfully parsed UI JSON, length: {len(json_str)}")
-                except json.JSONDecodeError as e:
-                    print(f"Error parsing JSON: {str(e)}")
-                    ui_json = {"error": "Failed to parse UI JSON", "raw_text": json_str[:1000]}
-                
-                # Получаем имя файла без расширения для сохранения результатов
-                # result_file_name = os.path.splitext(file_location.file_key)[0]
-                
-                # # Сохраняем результат в S3
-                # ui_s3_info = await upload_json_to_s3(
-                #     bucket=AWS_BUCKET_NAME,
-                #     json_data=ui_json,
-                #     folder_name="summaries",
-                #     file_name=result_file_name
-                # )
-                
-                # # Удаляем временный файл PDF
-                # if os.path.exists(temp_path):
-                #     os.remove(temp_path)
+TEST_JSON_EXPECTED_OUTPUT = """{
+  "title": "History of Kazakhstan - Introductory Test", // The title of the test
+  "description": "This test covers the basic topics of the history of Kazakhstan", // A brief description of the test
+  "showQuestions": true, // Determines whether the questions should be displayed
+  "language": "KAZ", // Language of the test content (KAZ is for Kazakh)
+  "questionCreateRequests": [ // Array containing question creation requests
+    {
+      "questionCreate": {
+        "question": "When did the rebellion of Kenesary Kasymov occur?", // The question being asked
+        "level": "MEDIUM", // The difficulty level of the question
+        "durationInSeconds": 90, // Time limit for answering the question in seconds
+        "variants": [ // Possible answer choices
+          {
+            "text": "1837-1847 years", // Answer choice text
+            "correct": true // Indicates that this is the correct answer
+          },
+          {
+            "text": "1916 year", // Incorrect answer choice
+            "correct": false // Indicates that this is not the correct answer
+          }
+        ]
+      }
+    },
+    {
+      "questionCreate": {
+        "question": "When did the rebellion of Kenesary Kasymov occur?", // The question being asked (repeated for another question)
+        "level": "MEDIUM", // The difficulty level of the question
+        "durationInSeconds": 90, // Time limit for answering the question in seconds
+        "variants": [ // Possible answer choices
+          {
+            "text": "1837-1847 years", // Correct answer choice
+            "correct": true // This is the correct answer
+          },
+          {
+            "text": "1916 year", // Incorrect answer choice
+            "correct": false // This is an incorrect answer
+          }
+        ]
+      }
+    }
+  ]
+}"""
 
-                return (ui_json)
+app = FastAPI(
+    title="PDF Summarizer API",
+    description="API для обработки PDF файлов и генерации структурированного JSON",
+    version="1.0.0"
+)
 
-            except Exception as e:
-                print(f"Error processing results: {str(e)}")
-                print(f"Error type: {type(e)}")
-                import traceback
-                print(f"Error traceback: {traceback.format_exc()}")
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"Error processing results: {str(e)}"
-                )
+# Отмена обработки и освобождение ресурсов запроса при отключении клиента
+app.add_middleware(CancelOnDisconnectMiddleware)
 
-        except Exception as e:
-            print(f"Error processing PDF: {str(e)}")
-            print(f"Error type: {type(e)}")
-            import traceback
-            print(f"Error traceback: {traceback.format_exc()}")
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error processing PDF: {str(e)}"
-            )
+# Учет и лимиты обращений к LLM в рамках запроса (заголовки X-LLM-Usage, X-LLM-Agents)
+app.add_middleware(LLMBudgetMiddleware)
 
-    except Exception as e:
-        # Если временный файл существует, удаляем его
-        if 'temp_path' in locals() and os.path.exists(temp_path):
-            os.remove(temp_path)
-        raise HTTPException(status_code=500, detail=str(e))
+# Профиль CPU отдельного запроса (X-Profile: cpu); без PROFILING_TOKEN не подключается
+if profiling_enabled():
+    app.add_middleware(RequestProfilingMiddleware)
+
+# Сжатие больших JSON ответов (gzip, brotli при наличии пакета)
+app.add_middleware(CompressionMiddleware)
+
+# Добавляем middleware для логирования
+app.add_middleware(RequestLoggingMiddleware)
+
+# Настройка CORS
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],  # Разрешаем все источники
+    allow_credentials=True,  # Разрешаем куки
+    allow_methods=["*"],  # Разрешаем все методы
+    allow_headers=["*"],  # Разрешаем все заголовки
+    expose_headers=["*"],  # Разрешаем доступ ко всем заголовкам ответа
+    max_age=600,  # Кэширование CORS на 10 минут
+)
+
+# Конфигурация OpenAI API
+OPENAI_API_KEY = config('OPENAI_API_KEY')
+if not OPENAI_API_KEY:
+    raise ValueError("Please set OPENAI_API_KEY in .env file")
+
+# Устанавливаем API ключ для OpenAI
+os.environ["OPENAI_API_KEY"] = OPENAI_API_KEY
+# Все обращения к OpenAI (этот клиент, эмбеддинги и crew через litellm)
+# проходят через общий регулятор: адаптивный параллелизм, темп и повторы
+client = OpenAI(api_key=OPENAI_API_KEY, http_client=get_http_client(), max_retries=0)
+install_litellm_client()
+install_agent_attribution()
+
+# Конфигурация AWS
+AWS_BUCKET_NAME = 'qysqa'
+
+# Инициализация S3 клиента
+s3_client = boto3.client('s3')
+
+# Объединение одинаковых одновременных запросов (см. coalesce_requests)
+single_flight = SingleFlight()
+# (S3 ключ, ETag) документа, уже полученный coalesce_requests в этом запросе:
+# load_document_pages не повторяет HEAD
+current_document_version: ContextVar[Optional[Tuple[str, str]]] = ContextVar("document_version", default=None)
+
+async def download_file_from_s3(bucket: str, file_location: S3FileLocation, local_path: str):
+    """
+    Загружает файл из S3 bucket
+    """
+    try:
+        with track_stage("download"):
+            # Формируем полный путь к файлу в S3
+            s3_path = s3_object_key(file_location)
+
+            s3_client.download_file(bucket, s3_path, local_path)
+        return True
+    except ClientError as e:
+        print(f"Error downloading file from S3: {str(e)}")
+        return False
+
+async def upload_json_to_s3(bucket: str, json_data: dict, folder_name: str, file_name: str) -> dict:
+    """
+    Загружает JSON в S3 bucket в папку summaries
+    
+    Args:
+        bucket (str): Имя S3 bucket
+        json_data (dict): JSON данные для загрузки
+        folder_name (str): Имя папки в bucket
+        file_name (str): Имя файла
+        
+    Returns:
+        dict: Информация о загруженном файле
+    """
+    try:
+        with track_stage("upload"):
+            # Формируем путь для сохранения в папке summaries
+            s3_path = f"{folder_name}/{file_name}.json"
+
+            # Создаем временный файл для загрузки
+            temp_json_path = f"temp_{file_name}.json"
+            with open(temp_json_path, 'w', encoding='utf-8') as f:
+                json.dump(json_data, f, ensure_ascii=False, indent=2)
+
+            # Загружаем файл в S3
+            s3_client.upload_file(temp_json_path, bucket, s3_path)
+
+            # Удаляем временный файл
+            if os.path.exists(temp_json_path):
+                os.remove(temp_json_path)
+
+            # Получаем URL для доступа к файлу
+            url = s3_client.generate_presigned_url(
+                'get_object',
+                Params={'Bucket': bucket, 'Key': s3_path},
+                ExpiresIn=3600  # URL действителен 1 час
+            )
+
+        return {
+            "bucket": bucket,
+            "file_path": s3_path,
+            "url": url
+        }
+        
+    except ClientError as e:
+        print(f"Error uploading JSON to S3: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to upload result to S3")
+
+def extract_json_object(result_str: str) -> str:
+    """
+    Находит первый JSON объект в ответе crew (с учетом вложенных скобок)
+    
+    Args:
+        result_str (str): Строковый результат crew
+        
+    Returns:
+        str: Строка с JSON объектом
+    """
+    with track_stage("json_extract"):
+        # Удаляем маркеры форматирования Markdown
+        clean_result = result_str.replace("```json", "").replace("```", "")
+        
+        # Находим JSON в результате
+        json_start = clean_result.find('{')
+        if json_start == -1:
+            raise ValueError("No JSON object found in result")
+        
+        # Ищем соответствующую закрывающую скобку
+        open_braces = 0
+        json_end = -1
+        
+        for i, char in enumerate(clean_result[json_start:]):
+            if char == '{':
+                open_braces += 1
+            elif char == '}':
+                open_braces -= 1
+                if open_braces == 0:
+                    json_end = json_start + i + 1
+                    break
+        
+        if json_end == -1:
+            raise ValueError("Could not find closing brace for JSON object")
+        
+        return clean_result[json_start:json_end]
+
+def read_task_description(temp_path: str, document_text: Optional[str]) -> str:
+    """
+    Описание задачи агента Reader: прочитать PDF инструментом или, если текст
+    уже есть в хранилище, только структурировать его. Текст подставляется
+    crewai из inputs (переменная document_text).
+    """
+    if document_text is None:
+        return f"""Read the content of the PDF document located at {temp_path}.
+                Extract the text and organize it into clear sections with titles and bullet points."""
+    return """Organize the following text extracted from a PDF document into clear sections
+                with titles and bullet points:
+
+                {document_text}"""
+
+def s3_object_key(file_location: S3FileLocation) -> str:
+    """
+    Полный ключ объекта в S3 по папке и имени файла
+    """
+    s3_path = os.path.join(file_location.folder_path, file_location.file_key).replace('\\', '/')
+    return s3_path.lstrip('/')  # Убираем начальный слеш, если есть
+
+def remove_temp_file(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+def make_temp_path(file_location: S3FileLocation) -> str:
+    """
+    Уникальный временный путь для скачиваемого PDF: одновременные запросы
+    к одному файлу не должны перезаписывать файлы друг друга.
+    Файл удаляется и при отмене запроса (см. cancellation.py).
+    """
+    path = f"temp_{uuid.uuid4().hex[:8]}_{os.path.basename(file_location.file_key)}"
+    register_cleanup(functools.partial(remove_temp_file, path))
+    return path
+
+def document_version(file_location: S3FileLocation) -> str:
+    """
+    ETag объекта в S3 (хэш содержимого) или пустая строка, если объект недоступен
+    """
+    try:
+        return s3_client.head_object(Bucket=AWS_BUCKET_NAME, Key=s3_object_key(file_location))["ETag"].strip('"')
+    except ClientError:
+        return ""
+
+async def get_document_version(file_location: S3FileLocation) -> str:
+    """
+    ETag документа: полученный ранее в этом запросе или новый HEAD в потоке
+    (boto3 синхронный и не должен блокировать цикл событий)
+    """
+    known = current_document_version.get()
+    if known is not None and known[0] == s3_object_key(file_location):
+        return known[1]
+    return await asyncio.to_thread(document_version, file_location)
+
+def coalesce_requests(endpoint: str):
+    """
+    Декоратор эндпоинта с параметром file_location: одинаковые одновременные
+    запросы (тот же документ по ETag, та же выборка страниц и параметры)
+    выполняются один раз, остальные ждут результат первого.
+    Потоковые ответы (stream=true) не объединяются.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(file_location: S3FileLocation, **kwargs):
+            if kwargs.get("stream"):
+                return await func(file_location=file_location, **kwargs)
+            version = await get_document_version(file_location)
+            current_document_version.set((s3_object_key(file_location), version))
+            key = (
+                endpoint,
+                s3_object_key(file_location),
+                version,
+                file_location.selection_key(),
+                tuple(sorted(kwargs.items())),
+            )
+
+            def on_join(is_leader: bool):
+                role = "leader" if is_leader else "follower"
+                metrics.SINGLE_FLIGHT_TOTAL.inc((endpoint, role))
+                if not is_leader:
+                    print(f"Joining in-flight {endpoint} request for {key[1]}")
+
+            try:
+                # Общая работа отменяется отдельно от запроса-лидера (см. SingleFlight)
+                return await single_flight.run(
+                    key, lambda: run_cancellable(lambda: func(file_location=file_location, **kwargs)),
+                    on_join=on_join
+                )
+            except LeaderCancelledError as e:
+                raise HTTPException(status_code=503, detail=str(e))
+        return wrapper
+    return decorator
+
+async def finish_result_job(job_id: str, task: asyncio.Future):
+    """
+    Дожидается полного результата, вычисляемого в фоне, и отмечает задание готовым
+    """
+    result_id = error = None
+    try:
+        response = await task
+        result_id = response.headers.get("X-Result-Id")
+        if result_id is None:
+            data = json.loads(response.body)
+            error = (data.get("error") if isinstance(data, dict) else None) or "Result was not stored"
+    except HTTPException as e:
+        error = str(e.detail)
+    except asyncio.CancelledError:
+        error = "Cancelled"
+    except Exception as e:
+        error = str(e)
+    print(f"Background job {job_id} finished: {result_id or error}")
+    try:
+        await asyncio.to_thread(get_result_store().finish_job, job_id, result_id, error)
+    except sqlite3.Error as e:
+        print(f"Error storing job {job_id}: {str(e)}")
+
+def respond_by_deadline(kind: str, fallback):
+    """
+    Декоратор эндпоинта с параметром deadline (секунды). Если полный результат
+    не готов к сроку, клиент получает 202 с упрощенным результатом
+    fallback(file_location, parts, **kwargs), где parts — готовые к сроку части
+    (см. deadline.add_partial). Полный результат продолжает вычисляться в фоне;
+    его статус — по адресу из заголовка Location (GET /jobs/{job_id}).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(file_location: S3FileLocation, deadline: Optional[float] = None, **kwargs):
+            # Срок обрабатывается здесь: вложенные обработчики (и ключ объединения запросов) его не видят
+            if not deadline:
+                return await func(file_location=file_location, deadline=None, **kwargs)
+
+            partial = PartialResults()
+            token = current_partial.set(partial)
+            try:
+                # Своя область отмены: временные файлы работы не удаляются вместе с запросом
+                task = asyncio.ensure_future(
+                    run_cancellable(lambda: func(file_location=file_location, deadline=None, **kwargs))
+                )
+            finally:
+                current_partial.reset(token)
+            endpoint = metrics.current_endpoint.get()
+            if await wait_for_deadline(task, deadline):
+                metrics.DEADLINE_RESULTS_TOTAL.inc((endpoint, "full"))
+                return task.result()
+
+            print(f"Deadline of {deadline}s exceeded, building degraded {kind}")
+            with track_stage("fallback"):
+                data = await fallback(file_location, partial.snapshot(), **kwargs)
+            if task.done() and not task.cancelled() and task.exception() is None:
+                metrics.DEADLINE_RESULTS_TOTAL.inc((endpoint, "full"))
+                return task.result()
+
+            job = await asyncio.to_thread(get_result_store().create_job, kind)
+            keep_in_background(asyncio.ensure_future(finish_result_job(job.job_id, task)))
+            metrics.DEADLINE_RESULTS_TOTAL.inc((endpoint, "degraded"))
+            return JSONResponse(status_code=202, content=data, headers={
+                "Location": job.location, "X-Result-Status": "degraded", "Retry-After": "5"
+            })
+        return wrapper
+    return decorator
+
+async def outline_fallback(file_location: S3FileLocation, parts: list, **kwargs) -> dict:
+    """
+    Упрощенная сводка без LLM: структура документа, собранная
+    SummarizerAgent.generate_ui_json из очищенного текста страниц
+    """
+    temp_path = make_temp_path(file_location)
+    pages, page_texts = await load_document_pages(file_location, temp_path)
+    if page_texts is None:
+        with track_stage("extract"):
+            page_texts = await asyncio.to_thread(extract_pdf_page_texts, temp_path, pages)
+    remove_temp_file(temp_path)
+    with track_stage("normalize"):
+        text = normalize_text(page_texts)
+    return SummarizerAgent(verbose=False).generate_ui_json(text)
+
+async def partial_test_fallback(file_location: S3FileLocation, parts: list,
+                                num_questions: Optional[int] = None, **kwargs) -> dict:
+    """
+    Упрощенный тест: вопросы шардов, готовых к сроку (num_questions задан),
+    иначе тест без вопросов
+    """
+    if not parts:
+        return {"questionCreateRequests": []}
+    tests, shards = zip(*parts)
+    with track_stage("merge_test"):
+        return merge_tests(list(tests), list(shards), num_questions or sum(shard.quota for shard in shards))
+
+def result_source(file_location: S3FileLocation) -> str:
+    """
+    Источник результата для цепочки версий: документ в S3 и выборка страниц
+    """
+    return f"{s3_object_key(file_location)}#{file_location.selection_key()}"
+
+def put_result_version(kind: str, data, source: Optional[str]) -> StoredResult:
+    """
+    Сохраняет новую версию результата. Узлы, совпавшие с предыдущей версией того же
+    источника, получают ее id — тогда patch между версиями содержит только изменения.
+    """
+    store = get_result_store()
+    previous_id = store.latest_version(source, kind) if source else None
+    if previous_id is not None:
+        found = store.get(kind, previous_id)
+        if found is not None:
+            stabilize_ids(json.loads(found[0].body), data)
+    stored = store.put(kind, data)
+    if source:
+        store.set_latest_version(source, kind, stored.result_id)
+    if previous_id is not None and previous_id != stored.result_id:
+        stored = stored._replace(previous_id=previous_id)
+    if kind == "summary":
+        with track_stage("html_render"):
+            get_rendered_html(stored.result_id, data)
+    # Сбой индекса не должен терять сохраненный результат
+    try:
+        with track_stage("search_index"):
+            get_search_index().index_result(kind, stored.result_id, source or "", data)
+    except sqlite3.Error as e:
+        print(f"Error indexing {kind} result: {str(e)}")
+    return stored
+
+async def store_result(kind: str, data, source: Optional[str] = None) -> Optional[StoredResult]:
+    """
+    Сохраняет результат для GET /results/{kind}/{result_id}.
+    Ответы с ошибкой разбора JSON и сбои хранилища не сохраняются и не ломают запрос.
+    """
+    if isinstance(data, dict) and "error" in data:
+        return None
+    try:
+        with track_stage("store_result"):
+            return await asyncio.to_thread(put_result_version, kind, data, source)
+    except sqlite3.Error as e:
+        print(f"Error storing {kind} result: {str(e)}")
+        return None
+
+def result_headers(stored: StoredResult) -> dict:
+    headers = {"ETag": stored.etag, "Content-Location": stored.location, "X-Result-Id": stored.result_id}
+    if stored.previous_id:
+        # Клиент с предыдущей версией может загрузить только изменения
+        headers["X-Previous-Result-Id"] = stored.previous_id
+        headers["Link"] = f'<{stored.location}/patch?from={stored.previous_id}>; rel="patch"'
+    if stored.kind == "summary":
+        # Готовый HTML для первой отрисовки без разбора дерева на клиенте
+        html_link = f'<{stored.location}/html>; rel="alternate"; type="text/html"'
+        headers["Link"] = f'{headers["Link"]}, {html_link}' if "Link" in headers else html_link
+    return headers
+
+async def stored_result_response(kind: str, data, source: Optional[str] = None) -> Response:
+    """
+    JSON ответ с результатом; если он сохранен — с ETag и адресом для повторной загрузки
+    """
+    stored = await store_result(kind, data, source)
+    if stored is None:
+        return JSONResponse(content=data)
+    # Тело уже сериализовано при сохранении, повторно не сериализуем
+    return Response(content=stored.body, media_type="application/json", headers=result_headers(stored))
+
+def resolve_selected_pages(metadata: dict, file_location: S3FileLocation) -> Optional[List[int]]:
+    """
+    Определяет страницы PDF, выбранные в запросе (None — весь документ)
+    """
+    if not file_location.selection_key():
+        return None
+    try:
+        pages = resolve_pages(
+            metadata["page_count"],
+            metadata["outline"],
+            page_start=file_location.page_start,
+            page_end=file_location.page_end,
+            section=file_location.section,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    print(f"Selected pages: {pages[0] + 1}-{pages[-1] + 1}")
+    return pages
+
+async def load_document_pages(file_location: S3FileLocation,
+                              temp_path: str) -> Tuple[Optional[List[int]], Optional[Dict[int, str]]]:
+    """
+    Готовит документ к обработке: ищет уже извлеченный текст в хранилище
+    по S3 ключу и ETag, а если его нет — скачивает PDF во временный файл.
 
-@app.post("/generate-test/")
-async def generate_test(file_location: S3FileLocation):
-    """
-    Принимает информацию о расположении PDF файла в S3 bucket,
-    обрабатывает его и возвращает информацию о расположении результата теста
-    
     Args:
         file_location (S3FileLocation): Информация о расположении файла в S3
+        temp_path (str): Путь для скачиваемого файла
+
+    Returns:
+        Tuple[Optional[List[int]], Optional[Dict[int, str]]]: Выбранные страницы и текст
+        страниц из хранилища (None, если файл скачан и текст нужно извлечь)
+    """
+    store = get_text_store()
+    s3_path = s3_object_key(file_location)
+    with track_stage("text_lookup"):
+        etag = await get_document_version(file_location)
+        # Без ETag (объект недоступен) документ не сопоставить с хранилищем
+        alias = f"s3://{AWS_BUCKET_NAME}/{s3_path}#{etag}" if etag else None
+        try:
+            content_hash = store.resolve_alias(alias) if alias else None
+            metadata = store.get_metadata(content_hash) if content_hash else None
+            if metadata is not None:
+                pages = resolve_selected_pages(metadata, file_location)
+                page_numbers = pages if pages is not None else range(metadata["page_count"])
+                cached = store.get_pages(content_hash, page_numbers)
+                if cached is not None:
+                    print(f"Text store hit for {s3_path}: {len(cached)} pages, download skipped")
+                    return pages, {i: cached[i] for i in page_numbers}
+        except sqlite3.Error as e:
+            print(f"Text store lookup failed: {str(e)}")
+
+    # Загружаем файл из S3
+    print(f"Downloading file from S3: {file_location.folder_path}/{file_location.file_key}")
+    success = await download_file_from_s3(AWS_BUCKET_NAME, file_location, temp_path)
+    if not success:
+        raise HTTPException(
+            status_code=404, 
+            detail=f"Файл не найден в S3 bucket по пути: {os.path.join(file_location.folder_path, file_location.file_key)}"
+        )
+    print(f"File downloaded successfully to: {temp_path}")
+    print(f"File exists: {os.path.exists(temp_path)}")
+    print(f"File size: {os.path.getsize(temp_path)} bytes")
+
+    content_hash = file_hash(temp_path)
+    metadata = None
+    try:
+        if alias:
+            store.add_alias(alias, content_hash)
+        metadata = store.get_metadata(content_hash)
+    except sqlite3.Error as e:
+        print(f"Error updating text store: {str(e)}")
+    if metadata is None and file_location.selection_key():
+        metadata = pdf_metadata(PdfReader(temp_path))
+    return resolve_selected_pages(metadata, file_location), None
+
+async def load_document(file_location: S3FileLocation, temp_path: str) -> Tuple[Optional[List[int]], Optional[str]]:
+    """
+    То же, что load_document_pages, но текст из хранилища — одной строкой,
+    очищенный так же, как вывод PDFReaderTool
+    """
+    pages, cached = await load_document_pages(file_location, temp_path)
+    if cached is None:
+        return pages, None
+    with track_stage("normalize"):
+        return pages, normalize_text(cached)
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Метрики по этапам обработки в текстовом формате Prometheus
+    """
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+def check_profiling_access(request: Request):
+    """
+    Эндпоинты /debug/* доступны только с токеном PROFILING_TOKEN в заголовке
+    X-Profiling-Token; без настроенного токена их как будто нет
+    """
+    if not profiling_enabled():
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not check_token(request.headers.get(PROFILING_TOKEN_HEADER)):
+        raise HTTPException(status_code=403, detail="Неверный токен профилирования")
+
+@app.post("/debug/memory")
+async def toggle_memory_tracing(request: Request, enabled: bool = True):
+    """
+    Включает или выключает tracemalloc (пока включен, выделения памяти
+    замедляются; при выключении снимки сбрасываются)
+
+    Args:
+        enabled (bool): Включить (true) или выключить (false)
+    """
+    check_profiling_access(request)
+    if enabled:
+        memory_tracer.start()
+    else:
+        memory_tracer.stop()
+    return {"tracing": memory_tracer.tracing}
+
+@app.get("/debug/memory/snapshot")
+async def get_memory_snapshot(request: Request,
+                              limit: int = Query(20, ge=1, le=200),
+                              group_by: str = Query("lineno", pattern="^(lineno|filename|traceback)$")):
+    """
+    Снимок tracemalloc: крупнейшие места выделения памяти, а начиная со
+    второго снимка — их рост с предыдущего (size_diff_kb, count_diff)
+
+    Args:
+        limit (int): Сколько мест выделения вернуть
+        group_by (str): Группировка: lineno, filename или traceback
+    """
+    check_profiling_access(request)
+    if not memory_tracer.tracing:
+        raise HTTPException(status_code=409, detail="tracemalloc выключен: POST /debug/memory?enabled=true")
+    return await asyncio.to_thread(memory_tracer.snapshot, limit, group_by)
+
+@app.get("/debug/cpu-profile")
+async def get_cpu_profile(request: Request,
+                          seconds: float = Query(10, gt=0, le=PROFILING_MAX_SECONDS),
+                          interval: float = Query(PROFILING_DEFAULT_INTERVAL, ge=0.001, le=1)):
+    """
+    Выборочный профиль CPU всех потоков процесса за seconds секунд в формате
+    collapsed stacks (flamegraph.pl, speedscope)
+
+    Args:
+        seconds (float): Длительность профиля
+        interval (float): Интервал между выборками, секунд
+    """
+    check_profiling_access(request)
+    try:
+        collapsed = await asyncio.to_thread(profile_cpu, seconds, interval)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    filename = f"cpu-{time.strftime('%Y%m%d-%H%M%S')}.folded"
+    return Response(content=collapsed, media_type="text/plain; charset=utf-8",
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.get("/debug/profiles/{profile_id}")
+async def get_request_cpu_profile(profile_id: str, request: Request):
+    """
+    Профиль CPU запроса, выполненного с заголовком X-Profile: cpu (адрес — в X-Profile-Location)
+
+    Args:
+        profile_id (str): Идентификатор профиля
+    """
+    check_profiling_access(request)
+    collapsed = get_request_profile(profile_id)
+    if collapsed is None:
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    return Response(content=collapsed, media_type="text/plain; charset=utf-8",
+                    headers={"Content-Disposition": f'attachment; filename="request-{profile_id}.folded"'})
+
+@app.post("/process-pdf/")
+@instrument_endpoint("process_pdf")
+@respond_by_deadline("summary", outline_fallback)
+@coalesce_requests("process_pdf")
+async def process_pdf(file_location: S3FileLocation, incremental: bool = False,
+                      deadline: Optional[float] = Query(None, gt=0, le=DEADLINE_MAX_SECONDS)):
+    """
+    Принимает информацию о расположении PDF файла в S3 bucket,
+    обрабатывает его и возвращает информацию о расположении результата UI JSON
+    
+    Args:
+        file_location (S3FileLocation): Информация о расположении файла в S3
+        incremental (bool): Собирать сводку из фрагментов групп страниц, переиспользуя
+            фрагменты уже обработанных страниц этого и других документов
+        deadline (float): Срок ответа в секундах; не успевшая сводка заменяется
+            структурой документа без LLM (см. respond_by_deadline)
     """
     try:
         # Проверяем расширение файла
@@ -506,153 +911,284 @@ async def generate_test(file_location: S3FileLocation):
             raise HTTPException(status_code=400, detail="Файл должен быть в формате PDF")
 
         # Создаем временный путь для файла
-        temp_path = f"temp_{os.path.basename(file_location.file_key)}"
+        temp_path = make_temp_path(file_location)
         print(f"Created temporary path: {temp_path}")
 
-        # Загружаем файл из S3
-        print(f"Downloading file from S3: {file_location.folder_path}/{file_location.file_key}")
-        success = await download_file_from_s3(AWS_BUCKET_NAME, file_location, temp_path)
-        if not success:
+        if incremental:
+            ui_json, reused, total = await summarize_incrementally(file_location, temp_path)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            response = await stored_result_response("summary", ui_json, result_source(file_location))
+            response.headers["X-Summary-Fragments"] = f"reused={reused}; total={total}"
+            return response
+
+        # Текст из хранилища или скачанный из S3 файл
+        pages, document_text = await load_document(file_location, temp_path)
+
+        try:
+            # Инициализируем инструменты и агентов
+            print("Initializing PDFReaderTool...")
+            pdf_reader_tool = PDFReaderTool(endpoint="process_pdf", pages=pages)
+            print("PDFReaderTool initialized successfully")
+            
+            print("Creating Reader Agent...")
+            reader_agent = Agent(
+                role='Reader',
+                goal='Extract text from PDF documents and prepare it for processing.',
+                verbose=CREW_VERBOSE,
+                memory=True,
+                backstory="""You are an expert in extracting and structuring text from PDF documents.
+                Your task is to extract text and organize it into clear sections.""",
+                # Если текст уже извлечен, инструмент чтения PDF не нужен
+                tools=[pdf_reader_tool] if document_text is None else [],
+                allow_delegation=True
+            )
+            print("Reader Agent created successfully")
+
+            # Создаем UI Summarizer агента
+            print("Creating Summarizer Agent...")
+            summarizer = SummarizerAgent(verbose=CREW_VERBOSE)
+            summarizer_agent = summarizer.agent
+            print("Summarizer Agent created successfully")
+
+            # Определяем задачи
+            print("Creating tasks...")
+            task_timer = CrewTaskTimer()
+            read_pdf_task = Task(
+                description=read_task_description(temp_path, document_text),
+                expected_output="Structured text extracted from the PDF document, organized into sections.",
+                tools=[pdf_reader_tool] if document_text is None else [],
+                agent=reader_agent,
+                callback=task_timer.callback("crew_read_pdf")
+            )
+            print(f"PDF reading task created with ID: {read_pdf_task.id}")
+
+            summarize_text_task = Task(
+                description=f"""Using the content extracted by the Reader agent, generate a UI JSON representation.
+                The content you need to process is: {{result_{read_pdf_task.id}}}
+                
+                Follow the defined structure to create a properly formatted UI JSON.
+                Include appropriate node types, styling, and hierarchy as specified in the format guide.""",
+                expected_output=UI_JSON_EXPECTED_OUTPUT,
+                agent=summarizer_agent,
+                callback=task_timer.callback("crew_summarize")
+            )
+            print(f"Summarize task created with ID: {summarize_text_task.id}")
+
+            # Создаем и выполняем crew
+            print("Creating Crew...")
+            crew = Crew(
+                agents=[reader_agent, summarizer_agent],
+                tasks=[read_pdf_task, summarize_text_task],
+                process=Process.sequential,
+                verbose=CREW_VERBOSE
+            )
+            
+            # Запуск crew
+            print("Starting Crew execution...")
+            task_timer.start()
+            with track_stage("crew"):
+                # crew выполняется синхронно: в отдельном потоке, чтобы не блокировать цикл событий
+                result = await asyncio.to_thread(
+                    crew.kickoff, inputs={'pdf_path': temp_path, 'document_text': document_text or ""}
+                )
+            print("Crew execution completed")
+            
+            try:
+                # Преобразуем результат в строку для обработки
+                result_str = str(result)
+                print(f"Results received, total length: {len(result_str)}")
+
+                # Извлекаем JSON строку
+                json_str = extract_json_object(result_str)
+                
+                # Парсим JSON
+                try:
+                    with track_stage("json_parse"):
+                        ui_json = json.loads(json_str)
+                    print(f"Successfully parsed UI JSON, length: {len(json_str)}")
+                except json.JSONDecodeError as e:
+                    print(f"Error parsing JSON: {str(e)}")
+                    ui_json = {"error": "Failed to parse UI JSON", "raw_text": json_str[:1000]}
+                
+                # Получаем имя файла без расширения для сохранения результатов
+                # result_file_name = os.path.splitext(file_location.file_key)[0]
+                
+                # # Сохраняем результат в S3
+                # ui_s3_info = await upload_json_to_s3(
+                #     bucket=AWS_BUCKET_NAME,
+                #     json_data=ui_json,
+                #     folder_name="summaries",
+                #     file_name=result_file_name
+                # )
+                
+                # Удаляем временный файл PDF
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+                return await stored_result_response("summary", ui_json, result_source(file_location))
+
+            except Exception as e:
+                print(f"Error processing results: {str(e)}")
+                print(f"Error type: {type(e)}")
+                import traceback
+                print(f"Error traceback: {traceback.format_exc()}")
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Error processing results: {str(e)}"
+                )
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Error processing PDF: {str(e)}")
+            print(f"Error type: {type(e)}")
+            import traceback
+            print(f"Error traceback: {traceback.format_exc()}")
             raise HTTPException(
-                status_code=404, 
-                detail=f"Файл не найден в S3 bucket по пути: {os.path.join(file_location.folder_path, file_location.file_key)}"
+                status_code=500,
+                detail=f"Error processing PDF: {str(e)}"
             )
-        print(f"File downloaded successfully to: {temp_path}")
-        print(f"File exists: {os.path.exists(temp_path)}")
-        print(f"File size: {os.path.getsize(temp_path)} bytes")
+
+    except Exception as e:
+        # Если временный файл существует, удаляем его
+        if 'temp_path' in locals() and os.path.exists(temp_path):
+            os.remove(temp_path)
+        # Ошибки клиента (неверный формат, файл не найден) возвращаем с исходным кодом
+        if isinstance(e, HTTPException):
+            raise
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/generate-test/")
+@instrument_endpoint("generate_test")
+@respond_by_deadline("test", partial_test_fallback)
+@coalesce_requests("generate_test")
+async def generate_test(file_location: S3FileLocation,
+                        num_questions: Optional[int] = Query(None, ge=1, le=TEST_MAX_QUESTIONS),
+                        deadline: Optional[float] = Query(None, gt=0, le=DEADLINE_MAX_SECONDS)):
+    """
+    Принимает информацию о расположении PDF файла в S3 bucket,
+    обрабатывает его и возвращает информацию о расположении результата теста
+    
+    Args:
+        file_location (S3FileLocation): Информация о расположении файла в S3
+        num_questions (int): Точное число вопросов; большие тесты генерируются
+            параллельно по разделам документа (см. test_sharding.py)
+        deadline (float): Срок ответа в секундах; к сроку отдаются вопросы уже
+            готовых шардов (см. respond_by_deadline)
+    """
+    try:
+        # Проверяем расширение файла
+        if not file_location.file_key.endswith('.pdf'):
+            raise HTTPException(status_code=400, detail="Файл должен быть в формате PDF")
+
+        # Создаем временный путь для файла
+        temp_path = make_temp_path(file_location)
+        print(f"Created temporary path: {temp_path}")
+
+        # Текст из хранилища или скачанный из S3 файл
+        pages, document_text = await load_document(file_location, temp_path)
 
         try:
             # Инициализируем инструменты и агентов
             print("Initializing PDFReaderTool...")
-            pdf_reader_tool = PDFReaderTool()
+            pdf_reader_tool = PDFReaderTool(endpoint="generate_test", pages=pages)
             print("PDFReaderTool initialized successfully")
             
             print("Creating Reader Agent...")
             reader_agent = Agent(
                 role='Reader',
                 goal='Extract text from PDF documents and prepare it for processing.',
-                verbose=True,
+                verbose=CREW_VERBOSE,
                 memory=True,
                 backstory="""You are an expert in extracting and structuring text from PDF documents.
                 Your task is to extract text and organize it into clear sections.""",
-                tools=[pdf_reader_tool],
+                # Если текст уже извлечен, инструмент чтения PDF не нужен
+                tools=[pdf_reader_tool] if document_text is None else [],
                 allow_delegation=True
             )
             print("Reader Agent created successfully")
 
             # Создаем Test Generator агента
             print("Creating Test Generator Agent...")
-            test_generator = TestGeneratorAgent()
+            test_generator = TestGeneratorAgent(verbose=CREW_VERBOSE)
             test_generator_agent = test_generator.agent
             print("Test Generator Agent created successfully")
 
             # Определяем задачи
             print("Creating tasks...")
+            task_timer = CrewTaskTimer()
             read_pdf_task = Task(
-                description=f"""Read the content of the PDF document located at {temp_path}.
-                Extract the text and organize it into clear sections with titles and bullet points.""",
+                description=read_task_description(temp_path, document_text),
                 expected_output="Structured text extracted from the PDF document, organized into sections.",
-                tools=[pdf_reader_tool],
-                agent=reader_agent
+                tools=[pdf_reader_tool] if document_text is None else [],
+                agent=reader_agent,
+                callback=task_timer.callback("crew_read_pdf")
             )
             print(f"PDF reading task created with ID: {read_pdf_task.id}")
 
             generate_test_task = Task(
-                description=f"""Using the content extracted by the Reader agent, generate a test with multiple-choice questions.""",
-                expected_output="""{
-  "title": "History of Kazakhstan - Introductory Test", // The title of the test
-  "description": "This test covers the basic topics of the history of Kazakhstan", // A brief description of the test
-  "showQuestions": true, // Determines whether the questions should be displayed
-  "language": "KAZ", // Language of the test content (KAZ is for Kazakh)
-  "questionCreateRequests": [ // Array containing question creation requests
-    {
-      "questionCreate": {
-        "question": "When did the rebellion of Kenesary Kasymov occur?", // The question being asked
-        "level": "MEDIUM", // The difficulty level of the question
-        "durationInSeconds": 90, // Time limit for answering the question in seconds
-        "variants": [ // Possible answer choices
-          {
-            "text": "1837-1847 years", // Answer choice text
-            "correct": true // Indicates that this is the correct answer
-          },
-          {
-            "text": "1916 year", // Incorrect answer choice
-            "correct": false // Indicates that this is not the correct answer
-          }
-        ]
-      }
-    },
-    {
-      "questionCreate": {
-        "question": "When did the rebellion of Kenesary Kasymov occur?", // The question being asked (repeated for another question)
-        "level": "MEDIUM", // The difficulty level of the question
-        "durationInSeconds": 90, // Time limit for answering the question in seconds
-        "variants": [ // Possible answer choices
-          {
-            "text": "1837-1847 years", // Correct answer choice
-            "correct": true // This is the correct answer
-          },
-          {
-            "text": "1916 year", // Incorrect answer choice
-            "correct": false // This is an incorrect answer
-          }
-        ]
-      }
-    }
-  ]
-}""",
-                agent=test_generator_agent
+                description="""Generate a test with multiple-choice questions based on the following fragments
+                of the document extracted by the Reader agent:
+
+                {document_context}""",
+                expected_output=TEST_JSON_EXPECTED_OUTPUT,
+                agent=test_generator_agent,
+                callback=task_timer.callback("crew_generate_test")
             )
             print(f"Test generation task created with ID: {generate_test_task.id}")
 
-            # Создаем и выполняем crew
-            print("Creating Crew...")
-            crew = Crew(
-                agents=[reader_agent, test_generator_agent],
-                tasks=[read_pdf_task, generate_test_task],
+            # Crew разделен на два запуска: между чтением и генерацией теста
+            # из извлеченного текста выбираются только релевантные фрагменты
+            print("Creating Crews...")
+            reader_crew = Crew(
+                agents=[reader_agent],
+                tasks=[read_pdf_task],
                 process=Process.sequential,
-                verbose=True
+                verbose=CREW_VERBOSE
+            )
+            test_crew = Crew(
+                agents=[test_generator_agent],
+                tasks=[generate_test_task],
+                process=Process.sequential,
+                verbose=CREW_VERBOSE
             )
             
             # Запуск crew
             print("Starting Crew execution...")
-            result = crew.kickoff(inputs={'pdf_path': temp_path})
+            task_timer.start()
+            with track_stage("crew"):
+                # crew выполняется синхронно: в отдельном потоке, чтобы не блокировать цикл событий
+                extracted_text = str(await asyncio.to_thread(
+                    reader_crew.kickoff, inputs={'pdf_path': temp_path, 'document_text': document_text or ""}
+                ))
+                print(f"Text extracted, total length: {len(extracted_text)}")
+
+                if num_questions:
+                    test_json = await generate_sharded_test(extracted_text, num_questions)
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+                    return await stored_result_response("test", test_json, result_source(file_location))
+
+                with track_stage("retrieve"):
+                    document_context = await asyncio.to_thread(select_relevant_chunks, extracted_text)
+                print(f"Selected context length: {len(document_context)}")
+
+                task_timer.start()
+                result = await asyncio.to_thread(test_crew.kickoff, inputs={'document_context': document_context})
             print("Crew execution completed")
             
             try:
                 # Преобразуем результат в строку для обработки
                 result_str = str(result)
                 print(f"Results received, total length: {len(result_str)}")
-                
-                # Удаляем маркеры форматирования Markdown
-                clean_result = result_str.replace("```json", "").replace("```", "")
-                
-                # Находим JSON в результате
-                json_start = clean_result.find('{')
-                if json_start == -1:
-                    raise ValueError("No JSON object found in result")
-                
-                # Ищем соответствующую закрывающую скобку
-                open_braces = 0
-                json_end = -1
-                
-                for i, char in enumerate(clean_result[json_start:]):
-                    if char == '{':
-                        open_braces += 1
-                    elif char == '}':
-                        open_braces -= 1
-                        if open_braces == 0:
-                            json_end = json_start + i + 1
-                            break
-                
-                if json_end == -1:
-                    raise ValueError("Could not find closing brace for JSON object")
-                
+
                 # Извлекаем JSON строку
-                json_str = clean_result[json_start:json_end]
+                json_str = extract_json_object(result_str)
                 
                 try:
-                    test_json = json.loads(json_str)
+                    with track_stage("json_parse"):
+                        test_json = json.loads(json_str)
                     print(f"Successfully parsed test JSON, length: {len(json_str)}")
                 except json.JSONDecodeError as e:
                     print(f"Error parsing JSON: {str(e)}")
@@ -670,10 +1206,10 @@ async def generate_test(file_location: S3FileLocation):
                 # )
                 
                 # Удаляем временный файл PDF
-                # if os.path.exists(temp_path):
-                #     os.remove(temp_path)
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
 
-                return (test_json)
+                return await stored_result_response("test", test_json, result_source(file_location))
 
             except Exception as e:
                 print(f"Error processing results: {str(e)}")
@@ -685,6 +1221,8 @@ async def generate_test(file_location: S3FileLocation):
                     detail=f"Error processing results: {str(e)}"
                 )
 
+        except HTTPException:
+            raise
         except Exception as e:
             print(f"Error processing PDF: {str(e)}")
             print(f"Error type: {type(e)}")
@@ -699,9 +1237,576 @@ async def generate_test(file_location: S3FileLocation):
         # Если временный файл существует, удаляем его
         if 'temp_path' in locals() and os.path.exists(temp_path):
             os.remove(temp_path)
+        # Ошибки клиента (неверный формат, файл не найден) возвращаем с исходным кодом
+        if isinstance(e, HTTPException):
+            raise
         raise HTTPException(status_code=500, detail=str(e))
 
+def create_reader_agent(tools: list) -> Agent:
+    """
+    Агент Reader, извлекающий и структурирующий текст PDF
+    """
+    return Agent(
+        role='Reader',
+        goal='Extract text from PDF documents and prepare it for processing.',
+        verbose=CREW_VERBOSE,
+        memory=True,
+        backstory="""You are an expert in extracting and structuring text from PDF documents.
+        Your task is to extract text and organize it into clear sections.""",
+        tools=tools,
+        allow_delegation=True
+    )
+
+def parse_crew_json(result, kind: str) -> dict:
+    """
+    Извлекает и разбирает JSON из ответа crew; при ошибке разбора
+    возвращает объект с описанием ошибки, как эндпоинты выше
+    """
+    result_str = str(result)
+    print(f"{kind} results received, total length: {len(result_str)}")
+    json_str = extract_json_object(result_str)
+    try:
+        with track_stage("json_parse"):
+            return json.loads(json_str)
+    except json.JSONDecodeError as e:
+        print(f"Error parsing {kind} JSON: {str(e)}")
+        return {"error": f"Failed to parse {kind} JSON", "raw_text": json_str[:1000]}
+
+def run_reader_crew(temp_path: str, pages: Optional[List[int]], document_text: Optional[str],
+                    endpoint: str) -> str:
+    """
+    Один проход агента Reader: возвращает структурированный текст документа
+    """
+    pdf_reader_tool = PDFReaderTool(endpoint=endpoint, pages=pages)
+    tools = [pdf_reader_tool] if document_text is None else []
+    reader_agent = create_reader_agent(tools)
+    task_timer = CrewTaskTimer()
+    read_pdf_task = Task(
+        description=read_task_description(temp_path, document_text),
+        expected_output="Structured text extracted from the PDF document, organized into sections.",
+        tools=tools,
+        agent=reader_agent,
+        callback=task_timer.callback("crew_read_pdf")
+    )
+    crew = Crew(agents=[reader_agent], tasks=[read_pdf_task], process=Process.sequential, verbose=CREW_VERBOSE)
+    task_timer.start()
+    with track_stage("crew"):
+        result = crew.kickoff(inputs={'pdf_path': temp_path, 'document_text': document_text or ""})
+    return str(result)
+
+def run_summary_crew(extracted_text: str) -> dict:
+    """
+    Генерация UI JSON по уже извлеченному тексту
+    """
+    summarizer = SummarizerAgent(verbose=CREW_VERBOSE)
+    task_timer = CrewTaskTimer()
+    summarize_text_task = Task(
+        description="""Using the content extracted by the Reader agent, generate a UI JSON representation.
+        The content you need to process is: {extracted_text}
+
+        Follow the defined structure to create a properly formatted UI JSON.
+        Include appropriate node types, styling, and hierarchy as specified in the format guide.""",
+        expected_output=UI_JSON_EXPECTED_OUTPUT,
+        agent=summarizer.agent,
+        callback=task_timer.callback("crew_summarize")
+    )
+    crew = Crew(agents=[summarizer.agent], tasks=[summarize_text_task], process=Process.sequential, verbose=CREW_VERBOSE)
+    task_timer.start()
+    result = crew.kickoff(inputs={'extracted_text': extracted_text})
+    return parse_crew_json(result, "UI")
+
+async def summarize_incrementally(file_location: S3FileLocation, temp_path: str) -> Tuple[dict, int, int]:
+    """
+    Сводка из фрагментов групп страниц (см. summary_fragments.py).
+
+    Фрагменты ищутся в хранилище результатов по хэшу текста страниц группы:
+    LLM получает только группы с измененными или еще не встречавшимися
+    страницами, остальные фрагменты берутся готовыми.
+
+    Returns:
+        Tuple[dict, int, int]: UI JSON, число переиспользованных фрагментов и общее число фрагментов
+    """
+    pages, page_texts = await load_document_pages(file_location, temp_path)
+    if page_texts is None:
+        with track_stage("extract"):
+            page_texts = await asyncio.to_thread(extract_pdf_page_texts, temp_path, pages)
+    # Без колонтитулов с номером страницы текст страницы не зависит от ее позиции
+    with track_stage("normalize"):
+        page_texts = normalize_pages(page_texts)
+    texts = list(page_texts.values())
+    page_keys = [text_hash(text) for text in texts]
+    groups = group_pages(page_keys)
+    keys = [fragment_key([page_keys[i] for i in group]) for group in groups]
+    group_texts = ["".join(texts[i] for i in group) for group in groups]
+
+    store = get_result_store()
+    try:
+        cached = await asyncio.to_thread(store.get_fragments, keys)
+    except sqlite3.Error as e:
+        print(f"Error reading summary fragments: {str(e)}")
+        cached = {}
+
+    reused = sum(1 for key in keys if key in cached)
+    # Группы из пустых страниц в сводку не попадают; повторяющиеся группы генерируются один раз
+    missing, planned = [], set()
+    for n, key in enumerate(keys):
+        if key not in cached and key not in planned and group_texts[n].strip():
+            missing.append(n)
+            planned.add(key)
+    print(f"Summary fragments: {reused}/{len(keys)} reused, {len(missing)} to generate")
+    allow_fanout(len(missing), SUMMARY_FRAGMENT_CONCURRENCY)
+    semaphore = asyncio.Semaphore(SUMMARY_FRAGMENT_CONCURRENCY)
+
+    async def generate_fragment(n: int) -> dict:
+        async with semaphore:
+            return await asyncio.to_thread(run_summary_crew, group_texts[n])
+
+    with track_stage("crew"):
+        generated = await asyncio.gather(*(generate_fragment(n) for n in missing))
+    for n, fragment in zip(missing, generated):
+        if "error" in fragment:
+            # Без одного фрагмента сводка неполная: возвращаем ошибку, как и обычный путь
+            return fragment, 0, len(keys)
+        try:
+            await asyncio.to_thread(store.put_fragment, keys[n], fragment)
+        except sqlite3.Error as e:
+            print(f"Error storing summary fragment: {str(e)}")
+        cached[keys[n]] = fragment
+
+    metrics.SUMMARY_FRAGMENTS_TOTAL.inc(("reused",), reused)
+    metrics.SUMMARY_FRAGMENTS_TOTAL.inc(("generated",), len(missing))
+    # Копии: stitch_fragments переименовывает id на месте, а фрагмент может повторяться
+    fragments = [copy.deepcopy(cached[key]) for key in keys if key in cached]
+    return stitch_fragments(fragments), reused, len(keys)
+
+def run_test_shard_crew(shard: TestShard) -> dict:
+    """
+    Генерация вопросов одного шарда теста по его разделам документа. Из текста
+    шарда, как и в обычном пути, выбираются только релевантные фрагменты:
+    шард из одного раздела — это весь документ.
+    """
+    with track_stage("retrieve"):
+        document_context = select_relevant_chunks(shard.text)
+    print(f"Shard context length: {len(document_context)} of {len(shard.text)}")
+    test_generator = TestGeneratorAgent(verbose=CREW_VERBOSE)
+    task_timer = CrewTaskTimer()
+    generate_test_task = Task(
+        description="""Generate a test with exactly {question_count} multiple-choice questions based only on
+        the following section of the document extracted by the Reader agent.
+        Number of questions by difficulty level: {levels}.
+        Every question must ask about something different.
+
+        {document_context}""",
+        expected_output=TEST_JSON_EXPECTED_OUTPUT,
+        agent=test_generator.agent,
+        callback=task_timer.callback("crew_generate_test")
+    )
+    crew = Crew(agents=[test_generator.agent], tasks=[generate_test_task], process=Process.sequential, verbose=CREW_VERBOSE)
+    task_timer.start()
+    result = crew.kickoff(inputs={
+        'document_context': document_context,
+        'question_count': shard.requested,
+        'levels': ", ".join(f"{level}: {count}" for level, count in shard.levels.items()),
+    })
+    return parse_crew_json(result, "test")
+
+async def generate_sharded_test(extracted_text: str, num_questions: int) -> dict:
+    """
+    Тест из num_questions вопросов: шарды по разделам документа генерируются
+    параллельно (см. test_sharding.py), затем объединяются без повторов
+    """
+    shards = plan_shards(extracted_text, num_questions)
+    print(f"Generating {num_questions} questions in {len(shards)} shards: {[shard.quota for shard in shards]}")
+
+    async def generate_shard(shard: TestShard) -> dict:
+        test = await asyncio.to_thread(run_test_shard_crew, shard)
+        if "error" not in test:
+            # Готовые шарды отдаются, если весь тест не успевает к сроку запроса
+            add_partial((test, shard))
+        return test
+
+    results = await asyncio.gather(*(generate_shard(shard) for shard in shards))
+    succeeded = [(test, shard) for test, shard in zip(results, shards) if "error" not in test]
+    if not succeeded:
+        return results[0]
+    with track_stage("merge_test"):
+        return merge_tests([test for test, _ in succeeded], [shard for _, shard in succeeded], num_questions)
+
+def run_test_crew(extracted_text: str) -> dict:
+    """
+    Генерация теста по релевантным фрагментам уже извлеченного текста
+    """
+    with track_stage("retrieve"):
+        document_context = select_relevant_chunks(extracted_text)
+    test_generator = TestGeneratorAgent(verbose=CREW_VERBOSE)
+    task_timer = CrewTaskTimer()
+    generate_test_task = Task(
+        description="""Generate a test with multiple-choice questions based on the following fragments
+        of the document extracted by the Reader agent:
+
+        {document_context}""",
+        expected_output=TEST_JSON_EXPECTED_OUTPUT,
+        agent=test_generator.agent,
+        callback=task_timer.callback("crew_generate_test")
+    )
+    crew = Crew(agents=[test_generator.agent], tasks=[generate_test_task], process=Process.sequential, verbose=CREW_VERBOSE)
+    task_timer.start()
+    result = crew.kickoff(inputs={'document_context': document_context})
+    return parse_crew_json(result, "test")
+
+@app.post("/process-lecture/")
+@instrument_endpoint("process_lecture")
+@coalesce_requests("process_lecture")
+async def process_lecture(file_location: S3FileLocation, stream: bool = False,
+                          num_questions: Optional[int] = Query(None, ge=1, le=TEST_MAX_QUESTIONS)):
+    """
+    Сводка (UI JSON) и тест по одному PDF за один запрос.
+
+    Скачивание, извлечение текста и проход агента Reader выполняются один раз,
+    после чего генерация сводки и теста идут параллельно в отдельных потоках.
+    При stream=true ответ — NDJSON: строка {"kind": "summary" | "test", "result": ...,
+    "location": ...} отправляется, как только готов соответствующий результат.
+    Сохраненные результаты доступны по GET /results/{kind}/{result_id}; без stream
+    их адреса передаются в заголовке Link.
+
+    Args:
+        file_location (S3FileLocation): Информация о расположении файла в S3
+        stream (bool): Отдавать результаты по мере готовности
+        num_questions (int): Точное число вопросов теста (генерация по шардам)
+    """
+    if not file_location.file_key.endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Файл должен быть в формате PDF")
+
+    temp_path = make_temp_path(file_location)
+    try:
+        pages, document_text = await load_document(file_location, temp_path)
+        extracted_text = await asyncio.to_thread(
+            run_reader_crew, temp_path, pages, document_text, "process_lecture"
+        )
+        print(f"Text extracted, total length: {len(extracted_text)}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error processing PDF: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    # Потоки запускаются сразу: to_thread копирует контекст с меткой эндпоинта для метрик
+    jobs = {
+        "summary": asyncio.ensure_future(asyncio.to_thread(run_summary_crew, extracted_text)),
+        "test": asyncio.ensure_future(
+            generate_sharded_test(extracted_text, num_questions) if num_questions
+            else asyncio.to_thread(run_test_crew, extracted_text)
+        ),
+    }
+
+    if stream:
+        ready = asyncio.Queue()
+
+        async def results():
+            for kind, job in jobs.items():
+                job.add_done_callback(lambda _, kind=kind: ready.put_nowait(kind))
+            for _ in range(len(jobs)):
+                kind = await ready.get()
+                try:
+                    line = {"kind": kind, "result": jobs[kind].result()}
+                except Exception as e:
+                    print(f"Error generating {kind}: {str(e)}")
+                    line = {"kind": kind, "error": str(e)}
+                else:
+                    stored = await store_result(kind, line["result"], result_source(file_location))
+                    if stored is not None:
+                        line["location"] = stored.location
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+
+        return StreamingResponse(results(), media_type="application/x-ndjson")
+
+    try:
+        ui_json, test_json = await asyncio.gather(jobs["summary"], jobs["test"])
+    except Exception as e:
+        print(f"Error processing results: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error processing results: {str(e)}")
+    links = []
+    for kind, data in (("summary", ui_json), ("test", test_json)):
+        stored = await store_result(kind, data, result_source(file_location))
+        if stored is not None:
+            links.append(f'<{stored.location}>; rel="{kind}"')
+            if stored.previous_id:
+                links.append(f'<{stored.location}/patch?from={stored.previous_id}>; rel="{kind}-patch"')
+    headers = {"Link": ", ".join(links)} if links else None
+    return JSONResponse(content={"ui_summary": ui_json, "test": test_json}, headers=headers)
+
+# Идентификатор результата — первые 32 hex-символа SHA-256 тела
+RESULT_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+# Тело по идентификатору не меняется, поэтому кэшировать можно сколь угодно долго
+RESULT_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+@app.get("/results/{kind}/{result_id}")
+@instrument_endpoint("get_result")
+async def get_result(kind: str, result_id: str, request: Request):
+    """
+    Повторная загрузка сохраненной сводки (kind=summary) или теста (kind=test).
+
+    Ответ отдается в заранее сжатом виде по Accept-Encoding. При совпадении
+    If-None-Match возвращается 304 без тела. Клиент, предпочитающий в Accept
+    application/vnd.qysqa+msgpack, получает компактный MessagePack (см. wire_format.py).
+
+    Args:
+        kind (str): summary или test
+        result_id (str): Идентификатор из X-Result-Id / Content-Location ответа POST
+    """
+    if kind not in RESULT_KINDS or not RESULT_ID_PATTERN.match(result_id):
+        raise HTTPException(status_code=404, detail="Результат не найден")
+
+    store = get_result_store()
+    as_msgpack = accepts_msgpack(request.headers.get("accept"))
+    etag = f'"{result_id}.msgpack"' if as_msgpack else f'"{result_id}"'
+    headers = {"Cache-Control": RESULT_CACHE_CONTROL, "Vary": "Accept, Accept-Encoding"}
+    encoding = choose_encoding(request.headers.get("accept-encoding", ""))
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        if await asyncio.to_thread(store.exists, kind, result_id):
+            current_etag = encoding_etag(etag, encoding) if encoding else etag
+            return Response(status_code=304, headers=dict(headers, ETag=current_etag))
+
+    # Для MessagePack нужен несжатый JSON; сжимает ответ CompressionMiddleware
+    found = await asyncio.to_thread(store.get, kind, result_id, None if as_msgpack else encoding)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Результат не найден")
+    stored, encoded = found
+    if as_msgpack:
+        with track_stage("msgpack_encode"):
+            body = encode_msgpack(json.loads(stored.body))
+        headers["ETag"] = etag
+        return Response(content=body, media_type=msgpack_media_type(), headers=headers)
+    if encoded is not None:
+        headers.update({"Content-Encoding": encoding, "ETag": encoding_etag(etag, encoding)})
+        return Response(content=encoded, media_type="application/json", headers=headers)
+    headers["ETag"] = etag
+    return Response(content=stored.body, media_type="application/json", headers=headers)
+
+@functools.lru_cache(maxsize=64)
+def compute_patch(kind: str, from_id: str, to_id: str) -> bytes:
+    """
+    Сериализованный JSON Patch между двумя сохраненными версиями (версии неизменны,
+    поэтому результат можно кэшировать). Если версии нет, бросается LookupError:
+    lru_cache не запоминает исключения, и версия, сохраненная позже, будет найдена.
+    """
+    store = get_result_store()
+    old, new = store.get(kind, from_id), store.get(kind, to_id)
+    if old is None or new is None:
+        raise LookupError(f"{kind} result {from_id if old is None else to_id} not found")
+    with track_stage("tree_diff"):
+        ops = diff_trees(json.loads(old[0].body), json.loads(new[0].body))
+    return json.dumps(ops, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+@app.get("/results/{kind}/{result_id}/patch")
+@instrument_endpoint("get_result_patch")
+async def get_result_patch(kind: str, result_id: str, request: Request,
+                           from_id: str = Query(..., alias="from")):
+    """
+    JSON Patch (RFC 6902), превращающий сохраненную версию from в версию result_id.
+
+    Клиент, у которого уже есть предыдущая версия (X-Previous-Result-Id в ответе
+    POST), загружает и применяет только изменения.
+
+    Args:
+        kind (str): summary или test
+        result_id (str): Новая версия
+        from_id (str): Версия, которая есть у клиента (параметр from)
+    """
+    if kind not in RESULT_KINDS or not RESULT_ID_PATTERN.match(result_id) or not RESULT_ID_PATTERN.match(from_id):
+        raise HTTPException(status_code=404, detail="Результат не найден")
+
+    etag = f'"{from_id}-{result_id}"'
+    headers = {"Cache-Control": RESULT_CACHE_CONTROL, "Vary": "Accept-Encoding", "ETag": etag}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        patch = await asyncio.to_thread(compute_patch, kind, from_id, result_id)
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Результат не найден")
+    return Response(content=patch, media_type="application/json-patch+json", headers=headers)
+
+@app.get("/search")
+@instrument_endpoint("search")
+async def search(q: str = Query(..., min_length=1, max_length=200),
+                 kind: Optional[str] = None,
+                 limit: int = Query(20, ge=1, le=SEARCH_MAX_RESULTS)):
+    """
+    Полнотекстовый поиск по сохраненным сводкам и тестам (заголовки разделов,
+    тексты, вопросы и варианты ответов) на казахском, русском и английском.
+
+    Каждое слово запроса ищется по началу слова, без учета регистра; документ
+    должен содержать все слова в одном узле. Для каждого документа
+    возвращаются совпавшие узлы: id узла UI JSON (для теста — JSON Pointer
+    вопроса) и фрагмент текста с совпадениями в <mark>.
+
+    Args:
+        q (str): Поисковый запрос
+        kind (Optional[str]): summary или test; по умолчанию — оба
+        limit (int): Максимальное число документов
+    """
+    if kind is not None and kind not in RESULT_KINDS:
+        raise HTTPException(status_code=400, detail=f"kind должен быть одним из: {', '.join(RESULT_KINDS)}")
+    with track_stage("search"):
+        results = await asyncio.to_thread(get_search_index().search, q, kind, limit)
+    return {
+        "query": q,
+        "results": [
+            {
+                "kind": result.kind,
+                "result_id": result.result_id,
+                "source": result.source,
+                "location": result.location,
+                "matches": [match._asdict() for match in result.matches],
+            }
+            for result in results
+        ],
+    }
+
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+@app.get("/jobs/{job_id}")
+@instrument_endpoint("get_job")
+async def get_job(job_id: str):
+    """
+    Статус полного результата, который вычисляется в фоне после ответа по сроку
+    (параметр deadline). Пока вычисление идет — 202, готовый результат — 303
+    на /results/{kind}/{result_id}, при ошибке вычисления — 500 с ее описанием.
+
+    Args:
+        job_id (str): Идентификатор из заголовка Location ответа 202
+    """
+    if not JOB_ID_PATTERN.match(job_id):
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    job = await asyncio.to_thread(get_result_store().get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    if job.finished is None:
+        return JSONResponse(status_code=202, content={"status": "running"}, headers={"Retry-After": "5"})
+    if job.result_id is None:
+        raise HTTPException(status_code=500, detail=job.error or "Result was not computed")
+    location = f"/results/{job.kind}/{job.result_id}"
+    return JSONResponse(status_code=303, content={"status": "done", "location": location},
+                        headers={"Location": location})
+
+@app.get("/wire-format")
+async def get_wire_format():
+    """
+    Таблицы ключей и значений перечислений для декодирования MessagePack ответов
+    """
+    return wire_tables()
+
+@app.get("/results/summary/{result_id}/tree")
+@instrument_endpoint("get_tree_node")
+async def get_tree_root(
+    result_id: str,
+    request: Request,
+    depth: int = Query(UI_TREE_DEFAULT_DEPTH, ge=0, le=UI_TREE_MAX_DEPTH),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(UI_TREE_PAGE_SIZE, ge=1, le=UI_TREE_MAX_PAGE_SIZE),
+):
+    """
+    Корень сохраненной сводки с потомками до глубины depth; более глубокие
+    разделы заменены заглушками и загружаются через /nodes/{node_id}.
+    Размер ответа не зависит от длины лекции.
+    """
+    return await tree_node_response(result_id, None, request, depth, offset, limit)
+
+@app.get("/results/summary/{result_id}/html")
+@instrument_endpoint("get_summary_html")
+async def get_summary_html(result_id: str, request: Request):
+    """
+    Сохраненная сводка, отрисованная на сервере в статический HTML фрагмент
+    (узлы и стили parser.tsx). Отрисовка кэшируется по хэшу дерева и отдается
+    в заранее сжатом виде по Accept-Encoding.
+
+    Args:
+        result_id (str): Идентификатор сводки (X-Result-Id ответа /process-pdf/)
+    """
+    if not RESULT_ID_PATTERN.match(result_id):
+        raise HTTPException(status_code=404, detail="Результат не найден")
+
+    etag = f'"{result_id}-html"'
+    headers = {"Cache-Control": RESULT_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+    encoding = choose_encoding(request.headers.get("accept-encoding", ""))
+    current_etag = encoding_etag(etag, encoding) if encoding else etag
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=dict(headers, ETag=current_etag))
+
+    rendered = await asyncio.to_thread(get_rendered_html, result_id)
+    if rendered is None:
+        raise HTTPException(status_code=404, detail="Результат не найден")
+    headers["ETag"] = current_etag
+    if encoding in rendered.encoded:
+        headers["Content-Encoding"] = encoding
+        return Response(content=rendered.encoded[encoding], media_type="text/html; charset=utf-8", headers=headers)
+    return Response(content=rendered.body, media_type="text/html; charset=utf-8", headers=headers)
+
+@app.get("/results/summary/{result_id}/nodes/{node_id}")
+@instrument_endpoint("get_tree_node")
+async def get_tree_node(
+    result_id: str,
+    node_id: str,
+    request: Request,
+    depth: int = Query(UI_TREE_DEFAULT_DEPTH, ge=0, le=UI_TREE_MAX_DEPTH),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(UI_TREE_PAGE_SIZE, ge=1, le=UI_TREE_MAX_PAGE_SIZE),
+):
+    """
+    Поддерево узла сводки по его id с ограничением глубины и страницей детей
+
+    Args:
+        result_id (str): Идентификатор сводки (X-Result-Id ответа /process-pdf/)
+        node_id (str): id узла из заглушки {"truncated": true}
+        depth (int): Сколько уровней потомков раскрыть
+        offset (int): С какого элемента отдавать списки детей узла
+        limit (int): Сколько элементов списка детей отдавать
+    """
+    return await tree_node_response(result_id, node_id, request, depth, offset, limit)
+
+async def tree_node_response(result_id: str, node_id: Optional[str], request: Request,
+                             depth: int, offset: int, limit: int) -> Response:
+    if not RESULT_ID_PATTERN.match(result_id):
+        raise HTTPException(status_code=404, detail="Результат не найден")
+
+    # Сводка не меняется, поэтому ответ полностью определяется параметрами и форматом
+    as_msgpack = accepts_msgpack(request.headers.get("accept"))
+    params = json.dumps([node_id, depth, offset, limit, as_msgpack])
+    etag = f'"{result_id}-{hashlib.sha256(params.encode("utf-8")).hexdigest()[:16]}"'
+    headers = {"Cache-Control": RESULT_CACHE_CONTROL, "Vary": "Accept, Accept-Encoding", "ETag": etag}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    index = await asyncio.to_thread(get_tree_index, result_id)
+    if index is None:
+        raise HTTPException(status_code=404, detail="Результат не найден")
+    node = index.root if node_id is None else index.nodes.get(node_id)
+    if node is None:
+        raise HTTPException(status_code=404, detail="Узел не найден")
+
+    with track_stage("tree_view"):
+        body = {
+            "resultId": result_id,
+            "path": index.path(node["id"]) if index.addressable(node) else [],
+            "offset": offset,
+            "limit": limit,
+            "node": index.view(node, depth, offset, limit),
+        }
+    if as_msgpack:
+        with track_stage("msgpack_encode"):
+            return Response(content=encode_msgpack(body), media_type=msgpack_media_type(), headers=headers)
+    return JSONResponse(content=body, headers=headers)
+
 @app.post("/process-json/", response_model=JSONProcessResponse)
+@instrument_endpoint("process_json")
 async def process_json(request: JSONProcessRequest):
     """
     Принимает JSON данные, обрабатывает их через агента и возвращает результат
@@ -773,20 +1878,24 @@ async def process_json(request: JSONProcessRequest):
         crew = Crew(
             agents=[json_processor.agent],
             tasks=[process_json_task],
-            verbose=True
+            verbose=CREW_VERBOSE
         )
         
         # Запускаем crew с входными данными
-        result = crew.kickoff(inputs={'json_data': request.json_data})
+        with track_stage("crew"):
+            result = await asyncio.to_thread(crew.kickoff, inputs={'json_data': request.json_data})
         
         # Парсим JSON из результата
         try:
-            processed_data = json.loads(result)
+            with track_stage("json_parse"):
+                processed_data = json.loads(result)
         except json.JSONDecodeError as e:
             raise HTTPException(status_code=500, detail=f"Ошибка при парсинге JSON: {str(e)}")
         
         return JSONProcessResponse(processed_json=processed_data)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
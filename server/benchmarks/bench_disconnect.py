@@ -0,0 +1,111 @@
+"""
+Проверка отмены обработки при отключении клиента (cancellation.py) на stub-сервере.
+
+Приложение вызывается напрямую по ASGI: после тела запроса receive через
+--disconnect-after секунд возвращает http.disconnect, как при закрытии вкладки.
+Для каждого эндпоинта измеряется, через сколько после отключения освобождается
+обработчик, сколько вызовов LLM завершилось после отключения (stub считает
+вызов по окончании ответа с задержкой --latency, поэтому вызов, выполнявшийся
+в момент отключения, тоже учитывается) и остались ли временные файлы запроса.
+Без отмены отключение до приложения не доходит: freed_after_disconnect_s — null,
+обработчик выполняется до конца.
+
+Запуск из каталога server:
+    python -m benchmarks.bench_disconnect --latency 0.5 --disconnect-after 1.0
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.local_s3 import LocalS3Client
+from benchmarks.pdfgen import generate_pdf
+from benchmarks.run_suite import configure_environment
+from benchmarks.stub_openai import SERVER_DIR, StubOpenAIServer
+
+ENDPOINTS = ("/process-pdf/", "/generate-test/", "/process-lecture/")
+
+
+async def disconnecting_request(app, path: str, body: bytes, disconnect_after: float,
+                                on_disconnect=None) -> dict:
+    """
+    Запрос, клиент которого отключается через disconnect_after секунд
+    """
+    body_sent = False
+    disconnected_at = None
+    status = None
+
+    async def receive():
+        nonlocal body_sent, disconnected_at
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await asyncio.sleep(disconnect_after)
+        disconnected_at = time.perf_counter()
+        if on_disconnect is not None:
+            on_disconnect()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "root_path": "", "headers": [(b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 50000), "server": ("test", 80),
+    }
+    started = time.perf_counter()
+    await app(scope, receive, send)
+    finished = time.perf_counter()
+    return {
+        "status": status,
+        "handler_s": round(finished - started, 3),
+        "freed_after_disconnect_s": round(finished - disconnected_at, 3) if disconnected_at else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.5, help="задержка stub на вызов, сек")
+    parser.add_argument("--disconnect-after", type=float, default=1.0)
+    args = parser.parse_args()
+
+    report = {}
+    with StubOpenAIServer(latency=args.latency) as stub, tempfile.TemporaryDirectory() as workdir:
+        configure_environment(stub, workdir)
+        import api
+        api.s3_client = LocalS3Client(os.path.join(workdir, "s3"))
+        pdf_path = generate_pdf(os.path.join(workdir, "lecture.pdf"), args.pages)
+
+        for n, path in enumerate(ENDPOINTS):
+            # Разные документы: иначе результаты берутся из кэшей предыдущего запроса
+            key = f"disconnect-{n}.pdf"
+            api.s3_client.put_file(api.AWS_BUCKET_NAME, f"bench/{key}", pdf_path)
+            body = json.dumps({"file_key": key, "folder_path": "bench"}).encode()
+            temp_pattern = os.path.join(SERVER_DIR, f"temp_*_{key}")
+
+            def llm_calls() -> int:
+                return stub.behaviour.counts["chat"] + stub.behaviour.counts["embeddings"]
+
+            calls_at_disconnect = []
+            result = asyncio.run(disconnecting_request(api.app, path, body, args.disconnect_after,
+                                                       lambda: calls_at_disconnect.append(llm_calls())))
+            result["temp_files_left"] = len(glob.glob(temp_pattern))
+            # Вызовы, уже отправленные к моменту отключения, завершаются; новых быть не должно
+            time.sleep(args.latency * 4 + 1)
+            if calls_at_disconnect:
+                result["llm_calls_after_disconnect"] = llm_calls() - calls_at_disconnect[0]
+            report[path] = result
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
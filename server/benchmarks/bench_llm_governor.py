@@ -0,0 +1,77 @@
+"""
+Бенчмарк регулятора нагрузки LLM (llm_governor.py) на stub-сервере с 429.
+
+Stub отклоняет запросы сверх --max-concurrency одновременных и случайную долю
+--rate-limit запросов, отвечая 429 с Retry-After. Сравниваются клиент OpenAI
+со встроенными повторами SDK и клиент, работающий через общий регулятор:
+число успешных и неудачных вызовов, количество полученных 429, время и
+итоговый адаптивный лимит параллелизма.
+
+Запуск из каталога server:
+    python -m benchmarks.bench_llm_governor --calls 200 --threads 32 --max-concurrency 4
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stub_openai import StubOpenAIServer
+
+
+def run_calls(client, calls: int, threads: int) -> dict:
+    def one(index: int) -> bool:
+        try:
+            client.embeddings.create(model="text-embedding-ada-002", input=[f"query {index}"])
+            return True
+        except Exception:
+            return False
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(one, range(calls)))
+    return {
+        "succeeded": sum(results),
+        "failed": len(results) - sum(results),
+        "wall_s": round(time.perf_counter() - started, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка stub на вызов, сек")
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    parser.add_argument("--rate-limit", type=float, default=0.05)
+    parser.add_argument("--retry-after", type=float, default=0.2)
+    parser.add_argument("--governor-rate", type=float, default=50.0, help="LLM_REQUESTS_PER_SECOND регулятора")
+    args = parser.parse_args()
+    # Настройки регулятора читаются при импорте llm_governor
+    os.environ.setdefault("LLM_REQUESTS_PER_SECOND", str(args.governor_rate))
+    os.environ.setdefault("LLM_BURST", str(int(args.governor_rate)))
+
+    from openai import OpenAI
+
+    report = {}
+    for variant in ("sdk_retries", "governor"):
+        with StubOpenAIServer(latency=args.latency, rate_limit=args.rate_limit,
+                              max_concurrency=args.max_concurrency, retry_after=args.retry_after) as stub:
+            os.environ["OPENAI_API_KEY"] = "sk-offline-benchmark"
+            if variant == "governor":
+                import llm_governor
+                client = OpenAI(base_url=stub.base_url, http_client=llm_governor.get_http_client(), max_retries=0)
+            else:
+                client = OpenAI(base_url=stub.base_url)
+            result = run_calls(client, args.calls, args.threads)
+            result["rate_limited"] = stub.behaviour.counts["rate_limited"]
+            result["peak_concurrency"] = stub.behaviour.counts["peak_concurrency"]
+            if variant == "governor":
+                result["final_limit"] = round(llm_governor.get_governor().limiter.limit, 2)
+            report[variant] = result
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
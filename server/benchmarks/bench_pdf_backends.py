@@ -0,0 +1,95 @@
+"""
+Бенчмарк библиотек извлечения текста PDF (pdf_backends.py): скорость
+в страницах в секунду и качество текста.
+
+По умолчанию используются сгенерированные лекции (benchmarks/pdfgen.py), для
+которых известен точный текст: качество — доля совпавших слов с эталоном
+(difflib по последовательности слов страницы). Для своих PDF (--pdf) эталона
+нет, поэтому качество считается относительно текста pdfminer, а также
+выводится доля нераспознанных символов.
+
+Запуск из каталога server:
+    python -m benchmarks.bench_pdf_backends --iterations 3
+    python -m benchmarks.bench_pdf_backends --pdf "lectures/*.pdf"
+"""
+import argparse
+import difflib
+import glob
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from PyPDF2 import PdfReader
+
+from benchmarks.pdfgen import generate_pdf, lecture_lines
+from pdf_backends import BACKENDS, garbage_ratio
+
+
+def word_similarity(expected: str, actual: str) -> float:
+    return difflib.SequenceMatcher(None, expected.split(), actual.split(), autojunk=False).ratio()
+
+
+def measure(backend, path: str, pages: list, iterations: int, reference=None) -> dict:
+    samples = []
+    texts = None
+    for _ in range(iterations):
+        started = time.perf_counter()
+        texts = backend.extract(path, pages)
+        samples.append(time.perf_counter() - started)
+    median = statistics.median(samples)
+    stats = {
+        "pages_per_s": round(len(pages) / median, 1),
+        "median_ms": round(median * 1000, 2),
+        "chars": sum(len(text) for text in texts.values()),
+        "garbage_ratio": round(garbage_ratio("".join(texts.values())), 4),
+    }
+    if reference is not None:
+        stats["word_similarity"] = round(statistics.mean(
+            word_similarity(reference[i], texts[i]) for i in pages
+        ), 4)
+    return stats, texts
+
+
+def bench_document(path: str, iterations: int, reference=None) -> dict:
+    pages = list(range(len(PdfReader(path).pages)))
+    results = {}
+    backend_texts = {}
+    for name, backend in BACKENDS.items():
+        if not backend.available():
+            results[name] = {"available": False}
+            continue
+        try:
+            results[name], backend_texts[name] = measure(backend, path, pages, iterations, reference)
+        except Exception as e:
+            results[name] = {"error": str(e)}
+    if reference is None and "pdfminer" in backend_texts:
+        for name, texts in backend_texts.items():
+            results[name]["similarity_to_pdfminer"] = round(statistics.mean(
+                word_similarity(backend_texts["pdfminer"][i], texts[i]) for i in pages
+            ), 4)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--sizes", default="5,50", help="Размеры сгенерированных лекций в страницах")
+    parser.add_argument("--pdf", action="append", default=[], help="Свои PDF (glob), можно несколько раз")
+    args = parser.parse_args()
+
+    report = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for size in (int(value) for value in args.sizes.split(",") if value):
+            path = generate_pdf(os.path.join(directory, f"lecture_{size}p.pdf"), size)
+            reference = {i: "\n".join(lines) for i, lines in enumerate(lecture_lines(size))}
+            report[f"generated_{size}p"] = bench_document(path, args.iterations, reference)
+    for pattern in args.pdf:
+        for path in sorted(glob.glob(pattern)):
+            report[os.path.basename(path)] = bench_document(path, args.iterations)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
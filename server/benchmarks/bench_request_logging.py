@@ -0,0 +1,133 @@
+"""
+Бенчмарк накладных расходов middleware логирования запросов.
+
+Сравнивает приложение без middleware, прежний RequestLoggingMiddleware
+(чтение всего тела, json.dumps с indent=2, все заголовки, синхронный вывод)
+и новый middleware из request_logging.py под конкурентной нагрузкой.
+
+Запуск из каталога server:
+    python -m benchmarks.bench_request_logging --requests 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import time
+
+import httpx
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+import request_logging
+from request_logging import RequestLoggingMiddleware, setup_queue_logging
+
+legacy_logger = logging.getLogger("bench.legacy_request_log")
+
+
+class LegacyRequestLoggingMiddleware(BaseHTTPMiddleware):
+    """
+    Копия прежней реализации из api.py для сравнения
+    """
+    async def dispatch(self, request: Request, call_next):
+        legacy_logger.info(f"Request: {request.method} {request.url.path}")
+        legacy_logger.info(f"Headers: {dict(request.headers)}")
+        body = await request.body()
+        try:
+            body_json = json.loads(body)
+            legacy_logger.info(f"Request body: {json.dumps(body_json, indent=2)}")
+        except json.JSONDecodeError:
+            legacy_logger.info(f"Request body: {body.decode()}")
+        start_time = time.time()
+        response = await call_next(request)
+        process_time = time.time() - start_time
+        legacy_logger.info(f"Request processed in {process_time:.2f} seconds")
+        return response
+
+
+async def echo(request: Request):
+    payload = await request.json()
+    return JSONResponse({"received": len(payload.get("items", []))})
+
+
+def build_app(variant: str, sample_rate: float):
+    app = Starlette(routes=[Route("/process-pdf/", echo, methods=["POST"])])
+    if variant == "legacy":
+        app.add_middleware(LegacyRequestLoggingMiddleware)
+    elif variant == "queued":
+        app.add_middleware(RequestLoggingMiddleware, sample_rate=sample_rate)
+    return app
+
+
+async def run_load(app, total: int, concurrency: int, payload: bytes):
+    transport = httpx.ASGITransport(app=app)
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    headers = {
+        "content-type": "application/json",
+        "user-agent": "bench",
+        "authorization": "Bearer secret",
+        "cookie": "session=" + "x" * 256,
+    }
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/process-pdf/", content=payload, headers=headers)
+                latencies.append(time.perf_counter() - started)
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "throughput_rps": round(total / wall, 1),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 3),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--body-items", type=int, default=200, help="размер JSON тела запроса")
+    parser.add_argument("--sample-rate", type=float, default=1.0)
+    args = parser.parse_args()
+
+    # Оба варианта пишут в /dev/null, чтобы измерять только накладные расходы
+    devnull = open(os.devnull, "w")
+    legacy_logger.addHandler(logging.StreamHandler(devnull))
+    legacy_logger.setLevel(logging.INFO)
+    legacy_logger.propagate = False
+    setup_queue_logging([logging.StreamHandler(devnull)])
+
+    payload = json.dumps({
+        "file_key": "lecture.pdf",
+        "items": [{"id": i, "text": "пример текста"} for i in range(args.body_items)],
+    }).encode()
+
+    results = {}
+    for variant in ("none", "legacy", "queued"):
+        app = build_app(variant, args.sample_rate)
+        # Прогрев
+        asyncio.run(run_load(app, min(200, args.requests), args.concurrency, payload))
+        results[variant] = asyncio.run(run_load(app, args.requests, args.concurrency, payload))
+
+    baseline = results["none"]["mean_ms"]
+    for variant, stats in results.items():
+        stats["overhead_ms"] = round(stats["mean_ms"] - baseline, 3)
+    request_logging.shutdown_queue_logging()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Бенчмарк форматов результатов: JSON (текущий ответ), обычный MessagePack
+и MessagePack с таблицами ключей и перечислений (wire_format.py).
+
+Данные — примеры UI деревьев и тестов из репозитория, а также одно большое
+дерево, собранное из всех примеров (длинная лекция). Для каждого формата
+выводятся размер без сжатия и после gzip, время кодирования и декодирования.
+
+Запуск из каталога server:
+    python -m benchmarks.bench_wire_format --iterations 200
+"""
+import argparse
+import gzip
+import json
+import statistics
+import time
+
+import msgpack
+
+from benchmarks.stub_openai import load_samples
+from result_store import serialize_result
+from wire_format import decode_msgpack, encode_msgpack
+
+FORMATS = {
+    "json": (serialize_result, json.loads),
+    "msgpack": (lambda data: msgpack.packb(data, use_bin_type=True), lambda payload: msgpack.unpackb(payload, raw=False)),
+    "msgpack_interned": (encode_msgpack, decode_msgpack),
+}
+
+
+def median_ms(func, iterations: int) -> float:
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return round(statistics.median(samples) * 1000, 4)
+
+
+def measure(data, iterations: int) -> dict:
+    results = {}
+    for name, (encode, decode) in FORMATS.items():
+        payload = encode(data)
+        assert decode(payload) == data, f"{name} round trip changed the data"
+        results[name] = {
+            "bytes": len(payload),
+            "gzip_bytes": len(gzip.compress(payload, compresslevel=6, mtime=0)),
+            "encode_ms": median_ms(lambda: encode(data), iterations),
+            "decode_ms": median_ms(lambda: decode(payload), iterations),
+        }
+    base = results["json"]
+    for name, stats in results.items():
+        stats["size_vs_json"] = round(stats["bytes"] / base["bytes"], 3)
+        stats["gzip_vs_json_gzip"] = round(stats["gzip_bytes"] / base["gzip_bytes"], 3)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    ui_trees, tests = load_samples()
+    datasets = {
+        "ui_tree_median": sorted(ui_trees, key=lambda tree: len(json.dumps(tree)))[len(ui_trees) // 2],
+        "ui_tree_long_lecture": {"nodeType": "STACK", "id": "lecture", "children": ui_trees * 10},
+        "tests_all": tests,
+    }
+    report = {name: measure(data, args.iterations) for name, data in datasets.items()}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
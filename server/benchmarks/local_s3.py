@@ -0,0 +1,50 @@
+"""
+Локальная замена boto3 S3 клиента для офлайн-бенчмарков.
+
+Реализует только те методы, которые использует api.py: объекты хранятся
+в каталоге root/<bucket>/<key>.
+"""
+import hashlib
+import os
+import shutil
+
+from botocore.exceptions import ClientError
+
+
+class LocalS3Client:
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def _not_found(self, operation: str, key: str):
+        return ClientError({"Error": {"Code": "404", "Message": f"Not Found: {key}"}}, operation)
+
+    def put_file(self, bucket: str, key: str, source_path: str):
+        """
+        Кладет локальный файл в «bucket» (подготовка корпуса)
+        """
+        target = self._path(bucket, key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(source_path, target)
+
+    def download_file(self, bucket: str, key: str, filename: str):
+        source = self._path(bucket, key)
+        if not os.path.exists(source):
+            raise self._not_found("HeadObject", key)
+        shutil.copyfile(source, filename)
+
+    def upload_file(self, filename: str, bucket: str, key: str):
+        self.put_file(bucket, key, filename)
+
+    def head_object(self, Bucket: str, Key: str):
+        source = self._path(Bucket, Key)
+        if not os.path.exists(source):
+            raise self._not_found("HeadObject", Key)
+        with open(source, 'rb') as f:
+            etag = hashlib.md5(f.read()).hexdigest()
+        return {"ETag": f'"{etag}"', "ContentLength": os.path.getsize(source)}
+
+    def generate_presigned_url(self, operation: str, Params: dict, ExpiresIn: int = 3600) -> str:
+        return "file://" + self._path(Params["Bucket"], Params["Key"])
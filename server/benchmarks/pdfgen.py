@@ -0,0 +1,91 @@
+"""
+Генератор PDF-лекций заданного размера без внешних зависимостей.
+
+Страницы содержат заголовок, колонтитулы и абзацы текста, похожие на
+слайды лекций, чтобы извлечение текста выполняло реальную работу.
+"""
+import os
+import random
+
+WORDS = (
+    "algorithm structure union find connectivity quick graph node edge tree "
+    "array element complexity analysis model object component path root weight "
+    "compression dynamic query command operation linear logarithmic amortized"
+).split()
+
+
+def _escape(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def _page_lines(page_number: int, total_pages: int, rng: random.Random, lines_per_page: int):
+    lines = [f"Lecture {page_number // 10 + 1}. Topic {page_number}: {' '.join(rng.sample(WORDS, 3)).title()}"]
+    for _ in range(lines_per_page):
+        lines.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 14))) + ".")
+    lines.append(f"Algorithms II - Spring course          {page_number} / {total_pages}")
+    return lines
+
+
+def lecture_lines(pages: int, lines_per_page: int = 30, seed: int = 0):
+    """
+    Строки каждой страницы лекции — эталон для оценки качества извлечения текста
+    """
+    rng = random.Random(seed + pages)
+    return [_page_lines(number, pages, rng, lines_per_page) for number in range(1, pages + 1)]
+
+
+def generate_pdf(path: str, pages: int, lines_per_page: int = 30, seed: int = 0) -> str:
+    """
+    Записывает PDF с pages страницами текста и возвращает путь к нему
+    """
+    objects = []
+
+    def add(obj: bytes) -> int:
+        objects.append(obj)
+        return len(objects)
+
+    catalog_id = add(b"")  # заполняется ниже
+    pages_id = add(b"")
+    font_id = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    page_ids = []
+    for lines in lecture_lines(pages, lines_per_page, seed):
+        commands = ["BT", "/F1 11 Tf", "14 TL", "50 790 Td"]
+        for line in lines:
+            commands.append(f"({_escape(line)}) Tj T*")
+        commands.append("ET")
+        stream = "\n".join(commands).encode('latin-1')
+        content_id = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_id, font_id, content_id)
+        ))
+
+    objects[catalog_id - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[pages_id - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + obj + b"\nendobj\n"
+    xref_offset = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, catalog_id, xref_offset
+    )
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(output)
+    return path
+
+
+def generate_corpus(directory: str, sizes=(1, 5, 20, 50)):
+    """
+    Создает набор PDF разного размера: {количество страниц: путь}
+    """
+    return {size: generate_pdf(os.path.join(directory, f"lecture_{size}p.pdf"), size) for size in sizes}
@@ -0,0 +1,295 @@
+"""
+Офлайн-бенчмарк api.py, PDFReaderTool и SummarizerAgent.
+
+Все обращения к OpenAI уходят на локальный stub-сервер (benchmarks/stub_openai.py),
+S3 заменяется каталогом на диске (benchmarks/local_s3.py), а PDF генерируются
+заданного размера (benchmarks/pdfgen.py). Отчет — JSON с пропускной
+способностью, p50/p95/p99 и пиковой памятью по эндпоинтам и этапам.
+
+Запуск из каталога server:
+    python -m benchmarks.run_suite --sizes 1 5 20 --iterations 5 --output bench.json
+    python -m benchmarks.run_suite --compare bench.json --output bench_new.json
+
+Код сервера написан под crewai 0.x / langchain 0.3 (импорт langchain.text_splitter,
+синхронный crew.kickoff внутри async эндпоинтов); проверенные версии
+перечислены в benchmarks/requirements.txt:
+    python -m venv .venv-bench && .venv-bench/bin/pip install -r benchmarks/requirements.txt
+
+OpenAIEmbeddings токенизирует текст через tiktoken. Если TIKTOKEN_CACHE_DIR
+не задан, используется кэш кодировок, поставляемый вместе с litellm
+(зависимость crewai), чтобы не скачивать их из сети.
+"""
+import argparse
+import asyncio
+import glob
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import traceback
+import tracemalloc
+from collections import defaultdict
+
+from benchmarks.local_s3 import LocalS3Client
+from benchmarks.pdfgen import generate_corpus
+from benchmarks.stub_openai import SERVER_DIR, StubOpenAIServer
+
+BUCKET = "qysqa"
+
+
+def percentile(samples, fraction: float) -> float:
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(samples, wall_seconds: float = None) -> dict:
+    """
+    Сводка по замерам (в миллисекундах)
+    """
+    if not samples:
+        return {"count": 0}
+    stats = {
+        "count": len(samples),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+        "p50_ms": round(percentile(samples, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 3),
+    }
+    if wall_seconds:
+        stats["throughput_per_s"] = round(len(samples) / wall_seconds, 3)
+    return stats
+
+
+def measure_peak_memory(func) -> float:
+    """
+    Пиковая память Python-аллокаций при одном вызове func, в МБ
+    """
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / (1024 * 1024), 3)
+
+
+def configure_environment(stub: StubOpenAIServer, workdir: str):
+    """
+    Направляет все OpenAI клиенты на stub-сервер. Вызывается до импорта модулей сервера.
+    """
+    os.environ["OPENAI_API_KEY"] = "sk-offline-benchmark"
+    os.environ["OPENAI_BASE_URL"] = stub.base_url
+    os.environ["OPENAI_API_BASE"] = stub.base_url
+    os.environ.setdefault("OPENAI_MODEL_NAME", "gpt-4o-mini")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ.setdefault("CREWAI_DISABLE_TELEMETRY", "true")
+    os.environ.setdefault("OTEL_SDK_DISABLED", "true")
+    # Отдельное хранилище crewai (память, логи задач), чтобы не смешивать с рабочим
+    os.environ.setdefault("CREWAI_STORAGE_DIR", os.path.join(workdir, "crewai"))
+    # Кэши сервера (хранилища текста и результатов, индексы документов) — во временном каталоге
+    os.environ.setdefault("TEXT_STORE_PATH", os.path.join(workdir, "text_store.sqlite3"))
+    os.environ.setdefault("RESULT_STORE_PATH", os.path.join(workdir, "result_store.sqlite3"))
+    os.environ.setdefault("SEARCH_INDEX_PATH", os.path.join(workdir, "search_index.sqlite3"))
+    os.environ.setdefault("DOCUMENT_INDEX_DIR", os.path.join(workdir, "document_indexes"))
+    if "TIKTOKEN_CACHE_DIR" not in os.environ:
+        litellm_spec = importlib.util.find_spec("litellm")
+        if litellm_spec and litellm_spec.origin:
+            tokenizers_dir = os.path.join(os.path.dirname(litellm_spec.origin),
+                                          "litellm_core_utils", "tokenizers")
+            if os.path.isdir(tokenizers_dir):
+                os.environ["TIKTOKEN_CACHE_DIR"] = tokenizers_dir
+    if SERVER_DIR not in sys.path:
+        sys.path.insert(0, SERVER_DIR)
+    # Модули сервера открывают json_format.md и временные файлы относительно cwd
+    os.chdir(SERVER_DIR)
+
+
+def bench_pdf_reader(corpus: dict, iterations: int) -> dict:
+    from main import PDFReaderTool
+
+    tool = PDFReaderTool()
+    results = {}
+    for pages, path in corpus.items():
+        samples = []
+        started = time.perf_counter()
+        for _ in range(iterations):
+            call_started = time.perf_counter()
+            tool._run(path)
+            samples.append(time.perf_counter() - call_started)
+        wall = time.perf_counter() - started
+        stats = summarize(samples, wall)
+        stats["pages_per_s"] = round(pages * iterations / wall, 1)
+        stats["peak_memory_mb"] = measure_peak_memory(lambda: tool._run(path))
+        results[f"{pages}p"] = stats
+    return results
+
+
+def bench_summarizer(corpus: dict, iterations: int) -> dict:
+    from main import PDFReaderTool
+    from summarizer_agent import SummarizerAgent
+
+    results = {}
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        SummarizerAgent()
+        samples.append(time.perf_counter() - started)
+    results["construct"] = summarize(samples)
+    results["construct"]["peak_memory_mb"] = measure_peak_memory(SummarizerAgent)
+
+    summarizer = SummarizerAgent()
+    tool = PDFReaderTool()
+    for pages, path in corpus.items():
+        text = tool._run(path)
+        for name, func in (("generate_ui_json", summarizer.generate_ui_json),
+                           ("process_content_with_rag", summarizer.process_content_with_rag)):
+            samples = []
+            for _ in range(iterations):
+                started = time.perf_counter()
+                func(text)
+                samples.append(time.perf_counter() - started)
+            stats = summarize(samples)
+            stats["peak_memory_mb"] = measure_peak_memory(lambda: func(text))
+            results[f"{name}_{pages}p"] = stats
+    return results
+
+
+def bench_endpoints(corpus: dict, iterations: int, concurrency: int, storage_dir: str) -> tuple:
+    import httpx
+    import api
+    import metrics
+
+    s3 = LocalS3Client(storage_dir)
+    for pages, path in corpus.items():
+        s3.put_file(BUCKET, f"bench/{os.path.basename(path)}", path)
+    api.s3_client = s3
+
+    stage_samples = defaultdict(list)
+
+    def on_stage(endpoint, stage, outcome, seconds):
+        stage_samples[f"{endpoint}.{stage}.{outcome}"].append(seconds)
+
+    metrics.add_stage_listener(on_stage)
+
+    async def load(route: str, payload: dict, total: int):
+        transport = httpx.ASGITransport(app=api.app)
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies, statuses = [], defaultdict(int)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            async def one():
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await client.post(route, json=payload)
+                    latencies.append(time.perf_counter() - started)
+                    statuses[response.status_code] += 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(one() for _ in range(total)))
+            return latencies, time.perf_counter() - started, dict(statuses)
+
+    results = {}
+    try:
+        for route in ("/process-pdf/", "/generate-test/"):
+            for pages, path in corpus.items():
+                payload = {"file_key": os.path.basename(path), "folder_path": "bench"}
+                latencies, wall, statuses = asyncio.run(load(route, payload, iterations))
+                stats = summarize(latencies, wall)
+                stats["statuses"] = statuses
+                stats["peak_memory_mb"] = measure_peak_memory(lambda: asyncio.run(load(route, payload, 1)))
+                results[f"{route.strip('/')}_{pages}p"] = stats
+    finally:
+        metrics.remove_stage_listener(on_stage)
+        # Скачанный PDF (temp_<id>_<имя>) может остаться в рабочем каталоге после ошибки
+        for path in corpus.values():
+            for temp_path in glob.glob(f"temp_*_{os.path.basename(path)}"):
+                os.remove(temp_path)
+
+    stages = {name: summarize(samples) for name, samples in sorted(stage_samples.items())}
+    return results, stages
+
+
+def compare(current: dict, baseline: dict) -> dict:
+    """
+    Относительное изменение p50/p95/p99 и памяти по сравнению с прошлым прогоном
+    """
+    deltas = {}
+    for section, entries in current.items():
+        if not isinstance(entries, dict) or section == "meta":
+            continue
+        for name, stats in entries.items():
+            base = baseline.get(section, {}).get(name)
+            if not isinstance(stats, dict) or not isinstance(base, dict):
+                continue
+            for key in ("p50_ms", "p95_ms", "p99_ms", "peak_memory_mb", "throughput_per_s"):
+                if base.get(key) and key in stats:
+                    deltas[f"{section}.{name}.{key}"] = round((stats[key] - base[key]) / base[key] * 100, 1)
+    return deltas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 5, 20, 50], help="размеры PDF в страницах")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка stub LLM на вызов, сек")
+    parser.add_argument("--sections", nargs="+", default=["pdf_reader", "summarizer", "endpoints"])
+    parser.add_argument("--output", help="путь для JSON отчета (по умолчанию stdout)")
+    parser.add_argument("--compare", help="JSON отчет прошлого прогона для сравнения")
+    args = parser.parse_args()
+    # configure_environment меняет cwd, поэтому пути берем абсолютные
+    output_path = os.path.abspath(args.output) if args.output else None
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sizes": args.sizes,
+            "iterations": args.iterations,
+            "concurrency": args.concurrency,
+            "stub_latency_s": args.latency,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "errors": {},
+    }
+
+    with StubOpenAIServer(latency=args.latency) as stub, tempfile.TemporaryDirectory() as workdir:
+        configure_environment(stub, workdir)
+        corpus = generate_corpus(os.path.join(workdir, "corpus"), args.sizes)
+
+        sections = {
+            "pdf_reader": lambda: bench_pdf_reader(corpus, args.iterations),
+            "summarizer": lambda: bench_summarizer(corpus, args.iterations),
+            "endpoints": lambda: bench_endpoints(corpus, args.iterations, args.concurrency,
+                                                 os.path.join(workdir, "s3")),
+        }
+        for name in args.sections:
+            try:
+                result = sections[name]()
+                if name == "endpoints":
+                    report["endpoints"], report["stages"] = result
+                else:
+                    report[name] = result
+            except Exception as e:
+                report["errors"][name] = f"{type(e).__name__}: {e}"
+                traceback.print_exc()
+        report["meta"]["llm_calls"] = dict(stub.behaviour.counts)
+
+    if compare_path:
+        with open(compare_path, 'r', encoding='utf-8') as f:
+            report["delta_percent"] = compare(report, json.load(f))
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""
+Детерминированный OpenAI-совместимый stub-сервер для офлайн-бенчмарков.
+
+Отвечает на /v1/chat/completions заранее подготовленными ответами из
+примеров репозитория (response_output*.json, qasqyr*.json, example.json) и на
+/v1/embeddings псевдослучайными векторами, зависящими только от текста.
+Агенты crewai, OpenAIEmbeddings и клиент OpenAI направляются на него через
+переменные окружения OPENAI_BASE_URL / OPENAI_API_BASE.
+
+Для проверки регулятора нагрузки (llm_governor.py) stub умеет отвечать 429:
+с заданной вероятностью (--rate-limit) и при превышении числа одновременных
+запросов (--max-concurrency), с заголовком Retry-After (--retry-after).
+
+Запуск отдельно:
+    python -m benchmarks.stub_openai --port 8765 --latency 0.05
+    python -m benchmarks.stub_openai --max-concurrency 4 --rate-limit 0.1 --retry-after 0.5
+"""
+import argparse
+import base64
+import glob
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EMBEDDING_DIMENSIONS = 1536
+
+PDF_PATH_PATTERN = re.compile(r"([^\s'\"`]+\.pdf)")
+TOOL_NAME_PATTERN = re.compile(r"Tool Name: ([^\n]+)")
+
+
+def load_samples(directory: str = SERVER_DIR):
+    """
+    Загружает примеры ответов из репозитория и делит их на UI деревья и тесты
+    """
+    ui_trees, tests = [], []
+    patterns = ["response_output*.json", "qasqyr*.json", "example.json"]
+    for pattern in patterns:
+        for path in sorted(glob.glob(os.path.join(directory, pattern))):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                continue
+            if "nodeType" in data:
+                # extract_json_object в api.py считает скобки без учета строк:
+                # примеры с несбалансированными скобками внутри текста дали бы 500
+                serialized = json.dumps(data, ensure_ascii=False)
+                if serialized.count('{') != serialized.count('}'):
+                    continue
+                ui_trees.append(data)
+            elif "questionCreateRequests" in data:
+                tests.append(data)
+    return ui_trees, tests
+
+
+def _message_text(message) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        return "\n".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class StubBehaviour:
+    """
+    Выбор ответа по содержимому запроса. Один и тот же запрос всегда
+    получает один и тот же ответ.
+    """
+    def __init__(self, ui_trees, tests, latency: float = 0.0, rate_limit: float = 0.0,
+                 max_concurrency: int = 0, retry_after: float = None, seed: int = 0):
+        self.ui_trees = ui_trees
+        self.tests = tests
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.max_concurrency = max_concurrency
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.counts = {"chat": 0, "embeddings": 0, "rate_limited": 0, "peak_concurrency": 0}
+
+    def enter(self) -> bool:
+        """
+        Регистрирует входящий запрос; False — запрос нужно отклонить с 429
+        """
+        with self.lock:
+            overloaded = bool(self.max_concurrency) and self.in_flight >= self.max_concurrency
+            if overloaded or (self.rate_limit and self.random.random() < self.rate_limit):
+                self.counts["rate_limited"] += 1
+                return False
+            self.in_flight += 1
+            self.counts["peak_concurrency"] = max(self.counts["peak_concurrency"], self.in_flight)
+            return True
+
+    def leave(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def _pick(self, samples, prompt: str):
+        digest = hashlib.sha256(prompt.encode('utf-8')).digest()
+        return samples[digest[0] % len(samples)]
+
+    def chat_completion(self, body: dict) -> dict:
+        messages = body.get("messages", [])
+        prompt = "\n".join(_message_text(m) for m in messages)
+        # Системный промпт crewai сам описывает формат "Observation:", поэтому
+        # результат инструмента ищем только в остальных сообщениях
+        has_tool_result = any(
+            m.get("role") == "tool" or (m.get("role") != "system" and "Observation:" in _message_text(m))
+            for m in messages
+        )
+        react_format = "Final Answer:" in prompt
+        pdf_match = PDF_PATH_PATTERN.search(prompt)
+        tool_match = TOOL_NAME_PATTERN.search(prompt)
+
+        message = {"role": "assistant", "content": None}
+        finish_reason = "stop"
+
+        if pdf_match and not has_tool_result and body.get("tools"):
+            # Нативный вызов инструмента чтения PDF
+            tool = body["tools"][0]["function"]["name"]
+            for candidate in body["tools"]:
+                if "pdf" in candidate["function"]["name"].lower():
+                    tool = candidate["function"]["name"]
+            message["tool_calls"] = [{
+                "id": "call_" + hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:12],
+                "type": "function",
+                "function": {"name": tool, "arguments": json.dumps({"pdf_path": pdf_match.group(1)})},
+            }]
+            finish_reason = "tool_calls"
+        elif pdf_match and not has_tool_result and react_format and tool_match:
+            # ReAct-формат crewai: инструмент объявлен в промпте строкой "Tool Name: ..."
+            message["content"] = (
+                "Thought: I need to read the PDF document first.\n"
+                f"Action: {tool_match.group(1).strip()}\n"
+                f"Action Input: {json.dumps({'pdf_path': pdf_match.group(1)})}"
+            )
+        else:
+            answer = self._answer(prompt)
+            message["content"] = f"Thought: I now know the final answer\nFinal Answer: {answer}" if react_format else answer
+
+        content = message["content"] or ""
+        return {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": {
+                "prompt_tokens": _estimate_tokens(prompt),
+                "completion_tokens": _estimate_tokens(content),
+                "total_tokens": _estimate_tokens(prompt) + _estimate_tokens(content),
+            },
+        }
+
+    def _answer(self, prompt: str) -> str:
+        lowered = prompt.lower()
+        if ("multiple-choice" in lowered or "questioncreaterequests" in lowered) and self.tests:
+            return json.dumps(self._pick(self.tests, prompt), ensure_ascii=False)
+        if ("ui json" in lowered or "nodetype" in lowered) and self.ui_trees:
+            return json.dumps(self._pick(self.ui_trees, prompt), ensure_ascii=False)
+        # Ответ агента-читателя: структурированный текст из последнего сообщения
+        tail = prompt[-4000:]
+        return "Lecture\n\nMain topics:\n\n" + "\n\n".join(
+            line.strip() for line in tail.splitlines() if len(line.strip()) > 20
+        )[:3000]
+
+    def embeddings(self, body: dict) -> dict:
+        inputs = body.get("input", [])
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        data = []
+        for index, item in enumerate(inputs):
+            seed_text = item if isinstance(item, str) else ",".join(map(str, item))
+            rng = random.Random(hashlib.sha256(seed_text.encode('utf-8')).digest())
+            vector = [rng.gauss(0.0, 1.0) for _ in range(EMBEDDING_DIMENSIONS)]
+            norm = sum(v * v for v in vector) ** 0.5
+            vector = [v / norm for v in vector]
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(array('f', vector).tobytes()).decode('ascii')
+            else:
+                embedding = vector
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        tokens = sum(_estimate_tokens(i if isinstance(i, str) else " " * len(i)) for i in inputs)
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "stub"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+
+def make_handler(behaviour: StubBehaviour):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status: int, payload: dict, headers: dict = None):
+            data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_stream(self, payload: dict):
+            # Минимальный SSE-ответ: один чанк с полным сообщением
+            choice = payload["choices"][0]
+            chunk = dict(payload, object="chat.completion.chunk", choices=[{
+                "index": 0, "delta": choice["message"], "finish_reason": choice["finish_reason"],
+            }])
+            data = f"data: {json.dumps(chunk, ensure_ascii=False)}\n\ndata: [DONE]\n\n".encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not behaviour.enter():
+                headers = {}
+                if behaviour.retry_after is not None:
+                    headers["Retry-After"] = str(behaviour.retry_after)
+                self._send_json(429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                                "code": "rate_limit_exceeded"}}, headers)
+                return
+            try:
+                self._handle(body)
+            finally:
+                behaviour.leave()
+
+        def _handle(self, body: dict):
+            if behaviour.latency:
+                time.sleep(behaviour.latency)
+            if self.path.endswith("/chat/completions"):
+                with behaviour.lock:
+                    behaviour.counts["chat"] += 1
+                payload = behaviour.chat_completion(body)
+                if body.get("stream"):
+                    self._send_stream(payload)
+                else:
+                    self._send_json(200, payload)
+            elif self.path.endswith("/embeddings"):
+                with behaviour.lock:
+                    behaviour.counts["embeddings"] += 1
+                self._send_json(200, behaviour.embeddings(body))
+            else:
+                self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    return Handler
+
+
+class StubOpenAIServer:
+    """
+    Stub-сервер в фоновом потоке; base_url подходит для OPENAI_BASE_URL
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, **behaviour_options):
+        ui_trees, tests = load_samples()
+        self.behaviour = StubBehaviour(ui_trees, tests, latency=latency, **behaviour_options)
+        self.httpd = ThreadingHTTPServer((host, port), make_handler(self.behaviour))
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка каждого ответа в секундах")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="доля запросов, получающих 429")
+    parser.add_argument("--max-concurrency", type=int, default=0,
+                        help="429 при большем числе одновременных запросов (0 — без ограничения)")
+    parser.add_argument("--retry-after", type=float, help="значение заголовка Retry-After в ответах 429")
+    args = parser.parse_args()
+
+    server = StubOpenAIServer(args.host, args.port, latency=args.latency, rate_limit=args.rate_limit,
+                              max_concurrency=args.max_concurrency, retry_after=args.retry_after)
+    print(f"Stub OpenAI server listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import asyncio
+import threading
+from contextvars import ContextVar
+from typing import Awaitable, Callable, List, Optional
+
+# Отмена работы запроса, клиент которого отключился. Задача asyncio с
+# обработчиком отменяется сразу, но поток с crew или извлечением текста
+# остановить извне нельзя: отмена помечается в CancelScope, и код в потоках
+# проверяет ее на границах этапов (перед каждым вызовом LLM, перед
+# извлечением текста). Ресурсы запроса (временные файлы) освобождаются при
+# завершении области, в том числе при отмене.
+
+
+class RequestCancelled(Exception):
+    """
+    Работа прервана: запрос, которому она принадлежит, отменен
+    """
+
+
+class CancelScope:
+    """
+    Признак отмены и функции очистки одной единицы работы (запроса или общей
+    работы объединенных запросов). Потоки, запущенные через asyncio.to_thread,
+    получают ту же область через контекст.
+    """
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self._cleanups: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def check(self):
+        if self._cancelled.is_set():
+            raise RequestCancelled("Request was cancelled")
+
+    def add_cleanup(self, callback: Callable[[], None]):
+        with self._lock:
+            self._cleanups.append(callback)
+
+    def close(self):
+        """
+        Выполняет функции очистки в обратном порядке; ошибки очистки не прерывают остальные
+        """
+        with self._lock:
+            cleanups, self._cleanups = self._cleanups, []
+        for callback in reversed(cleanups):
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error cleaning up request resources: {str(e)}")
+
+
+current_scope: ContextVar[Optional[CancelScope]] = ContextVar("cancel_scope", default=None)
+
+
+def check_cancelled():
+    """
+    Граница этапа: прерывает работу отмененного запроса исключением RequestCancelled
+    """
+    scope = current_scope.get()
+    if scope is not None:
+        scope.check()
+
+
+def register_cleanup(callback: Callable[[], None]):
+    """
+    Выполнить callback при завершении текущей области (без области — не выполняется:
+    вызывающий код освобождает ресурс сам, как и раньше)
+    """
+    scope = current_scope.get()
+    if scope is not None:
+        scope.add_cleanup(callback)
+
+
+async def run_cancellable(func: Callable[[], Awaitable]):
+    """
+    Выполняет func() в собственной CancelScope: при отмене задачи область
+    помечается отмененной, а по завершении выполняются функции очистки
+    """
+    scope = CancelScope()
+    token = current_scope.set(scope)
+    try:
+        return await func()
+    except asyncio.CancelledError:
+        scope.cancel()
+        raise
+    finally:
+        current_scope.reset(token)
+        scope.close()
+
+
+class CancelOnDisconnectMiddleware:
+    """
+    ASGI middleware: отменяет обработку запроса, если клиент отключился до
+    окончания ответа.
+
+    После того как приложение прочитало тело запроса, от сервера может прийти
+    только http.disconnect, поэтому receive ожидается в отдельной задаче.
+    Приложение продолжает получать disconnect через свой receive (например,
+    StreamingResponse). Запросы, тело которых приложение не читает (GET),
+    не отслеживаются.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        disconnected = asyncio.Event()
+        body_received = False
+        response_complete = False
+        cancelled_by_disconnect = False
+        watcher: Optional[asyncio.Future] = None
+        app_task: Optional[asyncio.Future] = None
+
+        async def watch_disconnect():
+            nonlocal cancelled_by_disconnect
+            message = await receive()
+            if message["type"] != "http.disconnect":
+                return
+            disconnected.set()
+            if not response_complete and not app_task.done():
+                print(f"Client disconnected, cancelling {scope['method']} {scope['path']}")
+                cancelled_by_disconnect = True
+                app_task.cancel()
+
+        async def receive_wrapper():
+            nonlocal body_received, watcher
+            if body_received:
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+            elif not message.get("more_body", False):
+                body_received = True
+                watcher = asyncio.ensure_future(watch_disconnect())
+            return message
+
+        async def send_wrapper(message):
+            nonlocal response_complete
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_complete = True
+            await send(message)
+
+        app_task = asyncio.ensure_future(run_cancellable(lambda: self.app(scope, receive_wrapper, send_wrapper)))
+        try:
+            await app_task
+        except asyncio.CancelledError:
+            # Клиенту, который отключился, отвечать некому
+            if not cancelled_by_disconnect:
+                raise
+        finally:
+            if watcher is not None:
+                watcher.cancel()
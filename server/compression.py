@@ -0,0 +1,173 @@
+import gzip
+from typing import Iterable, Optional
+
+from decouple import config, Csv
+
+# brotli необязателен: без него ответы сжимаются только gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Ответы меньше этого размера не сжимаются: выигрыш меньше затрат
+COMPRESSION_MIN_SIZE = config('COMPRESSION_MIN_SIZE', default=1024, cast=int)
+GZIP_LEVEL = config('COMPRESSION_GZIP_LEVEL', default=6, cast=int)
+BROTLI_QUALITY = config('COMPRESSION_BROTLI_QUALITY', default=5, cast=int)
+COMPRESSIBLE_TYPES = config(
+    'COMPRESSION_CONTENT_TYPES',
+    default='application/json,application/vnd.qysqa+msgpack,text/',
+    cast=Csv()
+)
+
+
+def supported_encodings() -> tuple:
+    """
+    Кодировки в порядке предпочтения сервера
+    """
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Выбирает кодировку по заголовку Accept-Encoding с учетом q-значений
+
+    Returns:
+        Optional[str]: "br", "gzip" или None, если клиент не принимает ни одну
+    """
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name] = weight
+
+    best, best_weight = None, 0.0
+    for encoding in supported_encodings():
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    # mtime=0: одинаковое тело всегда дает одинаковые байты
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def encoding_etag(etag: str, encoding: str) -> str:
+    """
+    Сильный ETag сжатого представления: у каждого варианта тела свой ETag
+    """
+    if etag.startswith('"') and etag.endswith('"'):
+        return f'{etag[:-1]}.{encoding}"'
+    return etag
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Проверка If-None-Match (слабое сравнение, RFC 9110): совпадение с любым
+    из представлений (несжатым или сжатым) означает, что у клиента актуальная копия
+    """
+    base = etag.strip('"')
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        tag = tag[2:] if tag.startswith("W/") else tag
+        tag = tag.strip('"')
+        if tag == base or tag.split(".", 1)[0] == base:
+            return True
+    return False
+
+
+def is_compressible(content_type: str, types: Iterable[str] = None) -> bool:
+    content_type = content_type.split(";")[0].strip().lower()
+    return any(content_type.startswith(t.strip().lower()) for t in (types or COMPRESSIBLE_TYPES) if t.strip())
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware, сжимающее большие ответы gzip или brotli по Accept-Encoding.
+
+    Сжимаются только ответы, отправленные одним сообщением (обычные JSON
+    ответы FastAPI). Потоковые ответы (NDJSON /process-lecture/) передаются
+    как есть, чтобы клиент получал части без задержки. Ответы, у которых уже
+    есть Content-Encoding (например, предварительно сжатые результаты
+    из хранилища), не изменяются.
+    """
+
+    def __init__(self, app, minimum_size: int = None):
+        self.app = app
+        self.minimum_size = COMPRESSION_MIN_SIZE if minimum_size is None else minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode('latin-1')
+                break
+        encoding = choose_encoding(accept_encoding) if accept_encoding else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                headers = {name.lower(): value for name, value in message.get("headers", [])}
+                if (b"content-encoding" in headers
+                        or not is_compressible(headers.get(b"content-type", b"").decode('latin-1'))):
+                    passthrough = True
+                    await send(message)
+                else:
+                    # Заголовки отправляем вместе с первой частью тела, когда станет
+                    # ясно, сжимается ли ответ
+                    start_message = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            headers = list(start_message.get("headers", []))
+            if message.get("more_body", False) or len(body) < self.minimum_size:
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            compressed = compress(body, encoding)
+            headers = [
+                (name, encoding_etag(value.decode('latin-1'), encoding).encode('latin-1')
+                 if name.lower() == b"etag" else value)
+                for name, value in headers if name.lower() != b"content-length"
+            ]
+            headers += [
+                (b"content-encoding", encoding.encode('latin-1')),
+                (b"content-length", str(len(compressed)).encode('latin-1')),
+                (b"vary", b"Accept-Encoding"),
+            ]
+            await send(dict(start_message, headers=headers))
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
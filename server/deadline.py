@@ -0,0 +1,70 @@
+import asyncio
+import threading
+from contextvars import ContextVar
+from typing import Optional, Set
+
+from decouple import config
+
+# Срок ответа для долгих эндпоинтов: если полный результат не готов к сроку,
+# клиент получает упрощенный, а полный продолжает вычисляться в фоне.
+
+# Максимальный срок, который может запросить клиент, в секундах
+DEADLINE_MAX_SECONDS = config('DEADLINE_MAX_SECONDS', default=1800, cast=float)
+# Время, оставляемое до срока на сборку упрощенного результата
+DEADLINE_FALLBACK_RESERVE = config('DEADLINE_FALLBACK_RESERVE', default=2.0, cast=float)
+
+
+class PartialResults:
+    """
+    Готовые части результата (например, тесты завершенных шардов), которые
+    можно отдать, если вся работа не успевает к сроку
+    """
+    def __init__(self):
+        self._parts = []
+        self._lock = threading.Lock()
+
+    def add(self, part):
+        with self._lock:
+            self._parts.append(part)
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return list(self._parts)
+
+
+current_partial: ContextVar[Optional[PartialResults]] = ContextVar("partial_results", default=None)
+
+
+def add_partial(part):
+    """
+    Сообщает о готовой части результата (без срока у запроса — ничего не делает)
+    """
+    partial = current_partial.get()
+    if partial is not None:
+        partial.add(part)
+
+
+# Задачи, продолжающие работу после ответа клиенту: цикл событий хранит
+# только слабые ссылки на задачи
+_background: Set[asyncio.Future] = set()
+
+
+def keep_in_background(task: asyncio.Future):
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+async def wait_for_deadline(task: asyncio.Future, deadline: float) -> bool:
+    """
+    Ждет task не дольше deadline секунд за вычетом резерва на упрощенный результат.
+    Если отменяется сам запрос (клиент отключился), task отменяется тоже.
+
+    Returns:
+        bool: True, если task завершилась к сроку
+    """
+    try:
+        done, _ = await asyncio.wait({task}, timeout=max(0.0, deadline - DEADLINE_FALLBACK_RESERVE))
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    return bool(done)
@@ -0,0 +1,159 @@
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import List, Sequence
+
+from decouple import config
+from langchain_community.vectorstores import FAISS
+
+from summarizer_agent import create_embeddings, create_text_splitter
+
+# Индексы документов хранятся на диске по хэшу текста: повторный запрос
+# на тот же документ не пересчитывает эмбеддинги
+DOCUMENT_INDEX_DIR = config(
+    'DOCUMENT_INDEX_DIR',
+    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'document_indexes')
+)
+# Сколько загруженных индексов держать в памяти процесса
+DOCUMENT_INDEX_CACHE_SIZE = config('DOCUMENT_INDEX_CACHE_SIZE', default=16, cast=int)
+# Короткий документ дешевле отправить целиком, чем индексировать
+MIN_CHARS_FOR_RETRIEVAL = config('DOCUMENT_INDEX_MIN_CHARS', default=6000, cast=int)
+# Количество чанков на одну тему
+CHUNKS_PER_TOPIC = config('DOCUMENT_INDEX_CHUNKS_PER_TOPIC', default=3, cast=int)
+MAX_TOPICS = 12
+
+# Темы по умолчанию, если в тексте не нашлось заголовков разделов
+DEFAULT_TOPICS = (
+    "main concepts and definitions",
+    "key facts, dates and names",
+    "processes, causes and consequences",
+)
+
+# Заголовки разделов в ответе агента Reader: markdown (# Title),
+# выделенная строка (**Title**) или короткая строка с двоеточием (Title:)
+HEADING_PATTERNS = (
+    re.compile(r"^#{1,6}\s+(.+?)\s*#*$"),
+    re.compile(r"^\*\*(.+?)\*\*:?$"),
+    re.compile(r"^([^.!?:]{3,80}):$"),
+)
+
+_loaded_indexes: "OrderedDict[str, FAISS]" = OrderedDict()
+_loaded_indexes_lock = threading.Lock()
+
+
+def document_key(text: str) -> str:
+    """
+    Ключ индекса документа — SHA-256 его текста
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _build_index(text: str) -> FAISS:
+    documents = create_text_splitter().create_documents([text])
+    # Позиция чанка нужна, чтобы собрать найденные куски в порядке документа
+    for position, document in enumerate(documents):
+        document.metadata["position"] = position
+    return FAISS.from_documents(documents, create_embeddings())
+
+
+def get_document_index(text: str) -> FAISS:
+    """
+    Возвращает FAISS индекс чанков документа: из памяти, с диска или строит новый
+
+    Args:
+        text (str): Текст документа
+
+    Returns:
+        FAISS: Векторное хранилище чанков документа
+    """
+    key = document_key(text)
+    with _loaded_indexes_lock:
+        index = _loaded_indexes.get(key)
+        if index is not None:
+            _loaded_indexes.move_to_end(key)
+            return index
+
+    path = os.path.join(DOCUMENT_INDEX_DIR, key)
+    if os.path.isdir(path):
+        # Индекс записан этим же сервисом, поэтому десериализация docstore безопасна
+        index = FAISS.load_local(path, create_embeddings(), allow_dangerous_deserialization=True)
+    else:
+        index = _build_index(text)
+        os.makedirs(DOCUMENT_INDEX_DIR, exist_ok=True)
+        # Пишем во временный каталог и переименовываем: параллельный запрос
+        # (или другой воркер) не должен прочитать индекс наполовину
+        temp_path = tempfile.mkdtemp(dir=DOCUMENT_INDEX_DIR, prefix=".tmp_")
+        try:
+            index.save_local(temp_path)
+            os.rename(temp_path, path)
+        except OSError:
+            # Индекс уже сохранен другим процессом
+            shutil.rmtree(temp_path, ignore_errors=True)
+
+    with _loaded_indexes_lock:
+        _loaded_indexes[key] = index
+        while len(_loaded_indexes) > DOCUMENT_INDEX_CACHE_SIZE:
+            _loaded_indexes.popitem(last=False)
+    return index
+
+
+def extract_topics(text: str, limit: int = MAX_TOPICS) -> List[str]:
+    """
+    Находит заголовки разделов в структурированном тексте
+
+    Args:
+        text (str): Текст, размеченный агентом Reader
+        limit (int): Максимальное количество тем
+
+    Returns:
+        List[str]: Заголовки без повторов в порядке появления
+    """
+    topics = []
+    for line in text.splitlines():
+        line = line.strip()
+        for pattern in HEADING_PATTERNS:
+            match = pattern.match(line)
+            if match:
+                title = match.group(1).strip(" *:")
+                if title and title not in topics:
+                    topics.append(title)
+                break
+        if len(topics) >= limit:
+            break
+    return topics
+
+
+def select_relevant_chunks(text: str, topics: Sequence[str] = None, k: int = CHUNKS_PER_TOPIC) -> str:
+    """
+    Оставляет из документа только чанки, наиболее близкие к темам.
+
+    Все темы эмбеддятся одним запросом, для каждой берутся top-k чанков,
+    результаты объединяются без повторов в исходном порядке документа.
+    Короткие документы возвращаются целиком.
+
+    Args:
+        text (str): Текст документа
+        topics (Sequence[str]): Темы (заголовки разделов); по умолчанию извлекаются из текста
+        k (int): Количество чанков на тему
+
+    Returns:
+        str: Выбранные фрагменты документа
+    """
+    if len(text) <= MIN_CHARS_FOR_RETRIEVAL:
+        return text
+
+    topics = list(topics) if topics else extract_topics(text)
+    if not topics:
+        topics = list(DEFAULT_TOPICS)
+
+    index = get_document_index(text)
+    vectors = index.embedding_function.embed_documents(topics)
+    selected = {}
+    for vector in vectors:
+        for document in index.similarity_search_by_vector(vector, k=k):
+            selected[document.metadata["position"]] = document.page_content
+    return "\n\n".join(selected[position] for position in sorted(selected))
@@ -0,0 +1,283 @@
+import html
+import json
+import threading
+from collections import OrderedDict
+from html.parser import HTMLParser
+from typing import Dict, List, NamedTuple, Optional
+
+from decouple import config
+
+from compression import compress, supported_encodings
+from result_store import get_result_store
+
+# Серверная отрисовка UI JSON сводки в статический HTML — те же узлы и стили,
+# что у parser.tsx / lib.ts клиента. Клиент вставляет готовый фрагмент, и
+# первая отрисовка не ждет разбора дерева на телефоне. Стрелки между узлами
+# (links, react-archer) зависят от раскладки страницы, поэтому не рисуются:
+# узлы помечены data-node-id, источники стрелок — data-links с id целей.
+
+# Сколько отрисованных сводок держать в памяти процесса
+HTML_RENDER_CACHE_SIZE = config('HTML_RENDER_CACHE_SIZE', default=64, cast=int)
+
+# Значения из lib.ts
+BACKGROUNDS = {
+    "PRIMARY": "#5348F2",
+    "SECONDARY": "#353254",
+    "TERTIARY": "#282828",
+    "DEFAULT": "#282828",
+}
+DEFAULT_BACKGROUND = "#282828"
+FONT_COLORS = {
+    "PRIMARY": "#5348F2",
+    "DEFAULT": "#fff",
+    "SECONDARY": "#91898C",
+    "TERTIARY": "rgba(145,137,140,0.5)",
+}
+FONT_SIZES = {"BIG": "2rem", "MEDIUM": "1.5rem", "SMALL": "1rem"}
+FONT_WEIGHTS = {"BOLD": "900", "REGULAR": "600", "THIN": "100"}
+JUSTIFY_CONTENT = {
+    "SPACE_BETWEEN": "space-between",
+    "SPACE_AROUND": "space-around",
+    "CENTER": "center",
+    "STRETCH": "stretch",
+}
+ALIGN_ITEMS = {"CENTER": "center", "START": "start", "END": "end", "STRETCH": "stretch"}
+
+# Числа в этих свойствах React выводит без единиц, в остальных — с px
+UNITLESS_PROPERTIES = {"opacity", "flex", "font-weight"}
+
+# htmltext вставляется клиентом как есть (dangerouslySetInnerHTML). Здесь HTML
+# отдается с origin API, поэтому из htmltext сохраняется только разметка текста
+ALLOWED_TAGS = {
+    "b", "strong", "i", "em", "u", "s", "mark", "sub", "sup", "small", "code",
+    "br", "span",
+}
+VOID_TAGS = {"br"}
+
+
+class TextMarkupFilter(HTMLParser):
+    """
+    Оставляет из htmltext текст и теги ALLOWED_TAGS без атрибутов
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        # Содержимое script/style не является текстом
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self._skip += 1
+        elif tag in ALLOWED_TAGS and not self._skip:
+            self.parts.append(f"<{tag}>")
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in VOID_TAGS and not self._skip:
+            self.parts.append(f"<{tag}>")
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style"):
+            self._skip = max(0, self._skip - 1)
+        elif tag in ALLOWED_TAGS and tag not in VOID_TAGS and not self._skip:
+            self.parts.append(f"</{tag}>")
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(html.escape(data, quote=False))
+
+
+def text_markup(value) -> str:
+    if not isinstance(value, str):
+        return ""
+    parser = TextMarkupFilter()
+    parser.feed(value)
+    parser.close()
+    return "".join(parser.parts)
+
+
+def css_value(name: str, value) -> str:
+    if isinstance(value, bool):
+        return str(value).lower()
+    if isinstance(value, (int, float)) and name not in UNITLESS_PROPERTIES:
+        return f"{value:g}px"
+    if isinstance(value, float):
+        return f"{value:g}"
+    return str(value)
+
+
+def style_attr(style: Dict[str, object]) -> str:
+    declarations = ";".join(f"{name}:{css_value(name, value)}" for name, value in style.items()
+                            if value is not None and value != "")
+    return f' style="{html.escape(declarations)}"' if declarations else ""
+
+
+def border(node: dict, width: str = "2px") -> str:
+    border_type = node.get("borderType")
+    if not border_type or border_type == "NONE":
+        return "none"
+    color = FONT_COLORS.get(node.get("borderColor"), "")
+    return f"{width} {str(border_type).lower()} {color}".rstrip()
+
+
+def base_styles(node: dict) -> Dict[str, object]:
+    """
+    getStylesFromBaseNode из lib.ts
+    """
+    style: Dict[str, object] = {}
+    for key, name in (("width", "width"), ("height", "height")):
+        if node.get(key):
+            style[name] = node[key]
+    if node.get("background"):
+        style["background"] = BACKGROUNDS.get(node["background"], DEFAULT_BACKGROUND)
+    for key, name in (("padding", "padding"), ("margin", "margin")):
+        if node.get(key):
+            style[name] = node[key]
+    if node.get("opacity") is not None:
+        style["opacity"] = node["opacity"]
+    if node.get("borderRadius") is not None:
+        style["border-radius"] = node["borderRadius"]
+    if node.get("borderType"):
+        style["border"] = border(node)
+    if node.get("overflowX"):
+        style["overflow-x"] = "scroll" if node["overflowX"] == "scroll" else "auto"
+    if node.get("overflowY"):
+        style["overflow-y"] = "scroll" if node["overflowY"] == "scroll" else "auto"
+    for key, name in (("flex", "flex"), ("minWidth", "min-width"), ("minHeight", "min-height")):
+        if node.get(key):
+            style[name] = node[key]
+    return style
+
+
+def node_attrs(node: dict, with_links: bool = False) -> str:
+    attrs = ""
+    if node.get("id"):
+        attrs += f' data-node-id="{html.escape(str(node["id"]))}"'
+    if with_links:
+        targets = [str(link.get("toId")) for link in node.get("links") or []
+                   if isinstance(link, dict) and link.get("fromId") == node.get("id") and link.get("toId")]
+        if targets:
+            attrs += f' data-links="{html.escape(" ".join(targets))}"'
+    return attrs
+
+
+def render_node(node, parts: List[str]):
+    """
+    Дописывает HTML узла в parts (parser.tsx)
+    """
+    if not isinstance(node, dict):
+        return
+    node_type = node.get("nodeType")
+
+    if node_type == "STACK":
+        style = {"display": "flex", "flex-direction": "column" if node.get("vertical") else "row"}
+        style.update(base_styles(node))
+        if node.get("flexWrap"):
+            style["flex-wrap"] = node["flexWrap"]
+        if node.get("justifyContent"):
+            style["justify-content"] = JUSTIFY_CONTENT.get(node["justifyContent"])
+        if node.get("alignItems"):
+            style["align-items"] = ALIGN_ITEMS.get(node["alignItems"])
+        if node.get("gap"):
+            style["gap"] = f"{node['gap']}px"
+        parts.append(f"<div{node_attrs(node, with_links=True)}{style_attr(style)}>")
+        for child in node.get("children") or []:
+            render_node(child, parts)
+        parts.append("</div>")
+        return
+
+    if node_type == "TEXT":
+        style = {}
+        if node.get("fontColor"):
+            style["color"] = FONT_COLORS.get(node["fontColor"])
+        style["font-weight"] = FONT_WEIGHTS.get(node.get("fontWeight"), FONT_WEIGHTS["REGULAR"])
+        if node.get("fontSize"):
+            style["font-size"] = FONT_SIZES.get(node["fontSize"])
+        if node.get("textAlign"):
+            style["text-align"] = node["textAlign"]
+        style.update(base_styles(node))
+        parts.append(f"<p{node_attrs(node)}{style_attr(style)}>{text_markup(node.get('htmltext'))}</p>")
+        return
+
+    if node_type == "ICON_TEXT":
+        # antd <Flex gap={4}>
+        style = {"display": "flex", "flex-direction": "row", "gap": "4px"}
+        style.update(base_styles(node))
+        parts.append(f"<div{node_attrs(node)}{style_attr(style)}>")
+        parts.append(html.escape(str(node.get("icon") or ""), quote=False))
+        render_node(node.get("text"), parts)
+        parts.append("</div>")
+        return
+
+    if node_type == "TITLED_CONTAINER":
+        # antd <Flex vertical gap={8}>
+        style = {"display": "flex", "flex-direction": "column", "gap": "8px"}
+        style.update(base_styles(node))
+        parts.append(f"<div{node_attrs(node, with_links=True)}{style_attr(style)}>")
+        render_node(node.get("titleText"), parts)
+        render_node(node.get("content"), parts)
+        parts.append("</div>")
+        return
+
+    if node_type == "CENTERED_CONTAINER":
+        style = {"display": "flex", "justify-content": "center", "align-items": "center", "cursor": "pointer"}
+        style.update(base_styles(node))
+        parts.append(f"<div{node_attrs(node, with_links=True)}{style_attr(style)}>")
+        render_node(node.get("childNode"), parts)
+        parts.append("</div>")
+        return
+
+    parts.append(f"<div{node_attrs(node)}>Unknown Node Type</div>")
+
+
+def render_html(tree: dict) -> str:
+    """
+    Статический HTML фрагмент UI дерева сводки
+    """
+    parts: List[str] = []
+    render_node(tree, parts)
+    return "".join(parts)
+
+
+class RenderedTree(NamedTuple):
+    body: bytes
+    # Заранее сжатые варианты тела по кодировкам
+    encoded: Dict[str, bytes]
+
+
+_rendered: "OrderedDict[str, RenderedTree]" = OrderedDict()
+_rendered_lock = threading.Lock()
+
+
+def get_rendered_html(result_id: str, tree: dict = None) -> Optional[RenderedTree]:
+    """
+    HTML сохраненной сводки. Идентификатор результата — хэш дерева, поэтому
+    отрисовка по нему не устаревает.
+
+    Args:
+        result_id (str): Идентификатор сводки
+        tree (dict): Дерево, если оно уже загружено (при сохранении сводки)
+
+    Returns:
+        Optional[RenderedTree]: None, если результата нет или это не UI дерево
+    """
+    with _rendered_lock:
+        rendered = _rendered.get(result_id)
+        if rendered is not None:
+            _rendered.move_to_end(result_id)
+            return rendered
+
+    if tree is None:
+        found = get_result_store().get("summary", result_id)
+        if found is None:
+            return None
+        tree = json.loads(found[0].body)
+    if not isinstance(tree, dict) or "nodeType" not in tree:
+        return None
+    body = render_html(tree).encode("utf-8")
+    rendered = RenderedTree(body, {encoding: compress(body, encoding) for encoding in supported_encodings()})
+
+    with _rendered_lock:
+        _rendered[result_id] = rendered
+        while len(_rendered) > HTML_RENDER_CACHE_SIZE:
+            _rendered.popitem(last=False)
+    return rendered
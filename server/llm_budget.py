@@ -0,0 +1,276 @@
+import json
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+import httpx
+from decouple import config, Csv
+
+import metrics
+
+# Учет обращений к LLM в рамках одного запроса к API. Все вызовы моделей и
+# эмбеддингов (crew через litellm, OpenAIEmbeddings, клиент OpenAI) проходят
+# через транспорт llm_governor, который отмечает каждый вызов здесь: число
+# вызовов, токены и время по агентам crewai. Скрытые вызовы (делегирование
+# между агентами, эмбеддинги поиска) видны в заголовках ответа и метриках.
+
+# Лимиты запроса по эндпоинтам в виде "эндпоинт:значение", "default" — для
+# остальных; 0 — без ограничения
+LLM_BUDGET_CALLS = config('LLM_BUDGET_CALLS', default='default:60', cast=Csv())
+LLM_BUDGET_TOKENS = config('LLM_BUDGET_TOKENS', default='default:600000', cast=Csv())
+LLM_BUDGET_SECONDS = config('LLM_BUDGET_SECONDS', default='default:900', cast=Csv())
+
+USAGE_HEADER = "x-llm-usage"
+AGENTS_HEADER = "x-llm-agents"
+# Вызовы вне агентов crewai (эмбеддинги поиска, прямые вызовы клиента OpenAI)
+NO_AGENT = "none"
+
+# Учет текущего запроса; asyncio.to_thread копирует контекст, поэтому вызовы
+# из потоков crew попадают в учет того же запроса
+current_budget: ContextVar[Optional["RequestBudget"]] = ContextVar("current_budget", default=None)
+# Стек выполняющихся агентов: при делегировании сверху — агент-исполнитель
+_agent_stack: ContextVar[Tuple[Tuple[int, str], ...]] = ContextVar("agent_stack", default=())
+
+
+class LLMBudgetExceeded(RuntimeError):
+    """
+    Запрос исчерпал лимит вызовов, токенов или времени
+    """
+    def __init__(self, endpoint: str, limit: str, used: float, allowed: float):
+        super().__init__(f"LLM budget exceeded for {endpoint}: {limit} {used:g} of {allowed:g}")
+        self.endpoint = endpoint
+        self.limit = limit
+
+
+def _parse_limits(items) -> Dict[str, float]:
+    limits = {}
+    for item in items:
+        endpoint, _, value = item.rpartition(":")
+        limits[endpoint.strip() or "default"] = float(value)
+    return limits
+
+
+CALL_LIMITS = _parse_limits(LLM_BUDGET_CALLS)
+TOKEN_LIMITS = _parse_limits(LLM_BUDGET_TOKENS)
+SECONDS_LIMITS = _parse_limits(LLM_BUDGET_SECONDS)
+
+
+def _limit(limits: Dict[str, float], endpoint: str) -> float:
+    return limits.get(endpoint, limits.get("default", 0.0))
+
+
+def call_kind(request: httpx.Request) -> str:
+    path = request.url.path.rstrip("/")
+    if path.endswith("/embeddings"):
+        return "embeddings"
+    if path.endswith("/completions"):
+        return "chat"
+    return path.rsplit("/", 1)[-1] or "other"
+
+
+def current_agent() -> str:
+    stack = _agent_stack.get()
+    return stack[-1][1] if stack else NO_AGENT
+
+
+def response_tokens(response: Optional[httpx.Response]) -> int:
+    """
+    Токены из поля usage ответа OpenAI (для потоковых ответов — 0)
+    """
+    if response is None or response.status_code >= 400:
+        return 0
+    if "json" not in response.headers.get("content-type", ""):
+        return 0
+    try:
+        usage = json.loads(response.read()).get("usage") or {}
+    except (ValueError, AttributeError):
+        return 0
+    if "total_tokens" in usage:
+        return int(usage["total_tokens"] or 0)
+    return int(usage.get("prompt_tokens") or 0) + int(usage.get("completion_tokens") or 0)
+
+
+class RequestBudget:
+    """
+    Счетчики обращений к LLM одного запроса и проверка лимитов эндпоинта.
+
+    Эндпоинт берется из metrics.current_endpoint в момент вызова, поэтому
+    учет можно создать до того, как запрос дойдет до обработчика.
+    """
+    def __init__(self):
+        self.started = time.monotonic()
+        self.calls = 0
+        self.tokens = 0
+        self.llm_seconds = 0.0
+        # (агент, вид вызова) -> [вызовы, токены]
+        self.by_agent: Dict[Tuple[str, str], list] = {}
+        self.exceeded: Optional[LLMBudgetExceeded] = None
+        # Запрос, разбитый на независимые части (фрагменты сводки), получает
+        # лимит вызовов и токенов эндпоинта на каждую часть, а лимит времени —
+        # на каждую волну частей, выполняющихся одновременно
+        self.units = 1
+        self.waves = 1
+        self._lock = threading.Lock()
+
+    def check(self):
+        """
+        Вызывается перед каждым обращением к LLM; превышение лимита запоминается,
+        и все следующие вызовы этого запроса сразу завершаются ошибкой
+        """
+        endpoint = metrics.current_endpoint.get()
+        with self._lock:
+            if self.exceeded is None:
+                elapsed = time.monotonic() - self.started
+                for limit, used, allowed in (("calls", self.calls, _limit(CALL_LIMITS, endpoint) * self.units),
+                                             ("tokens", self.tokens, _limit(TOKEN_LIMITS, endpoint) * self.units),
+                                             ("seconds", elapsed, _limit(SECONDS_LIMITS, endpoint) * self.waves)):
+                    if allowed and used >= allowed:
+                        self.exceeded = LLMBudgetExceeded(endpoint, limit, used, allowed)
+                        metrics.LLM_BUDGET_EXCEEDED_TOTAL.inc((endpoint, limit))
+                        print(str(self.exceeded))
+                        break
+            if self.exceeded is not None:
+                raise self.exceeded
+
+    def allow_fanout(self, units: int, concurrency: int):
+        with self._lock:
+            self.units = max(1, units)
+            self.waves = max(1, -(-units // max(1, concurrency)))
+
+    def record(self, agent: str, kind: str, tokens: int, seconds: float):
+        with self._lock:
+            self.calls += 1
+            self.tokens += tokens
+            self.llm_seconds += seconds
+            entry = self.by_agent.setdefault((agent, kind), [0, 0])
+            entry[0] += 1
+            entry[1] += tokens
+
+    def headers(self) -> Dict[str, str]:
+        with self._lock:
+            usage = f"calls={self.calls}; tokens={self.tokens}; llm_seconds={self.llm_seconds:.2f}"
+            agents = ", ".join(f"{agent}:{kind}={calls}/{tokens}"
+                               for (agent, kind), (calls, tokens) in sorted(self.by_agent.items()))
+        headers = {USAGE_HEADER: usage}
+        if agents:
+            headers[AGENTS_HEADER] = agents
+        return headers
+
+
+def check_budget():
+    budget = current_budget.get()
+    if budget is not None:
+        budget.check()
+
+
+def allow_fanout(units: int, concurrency: int):
+    """
+    Расширяет лимиты текущего запроса на units частей, выполняемых не более
+    чем по concurrency одновременно
+    """
+    budget = current_budget.get()
+    if budget is not None:
+        budget.allow_fanout(units, concurrency)
+
+
+def record_call(request: httpx.Request, response: Optional[httpx.Response], seconds: float):
+    """
+    Учитывает один HTTP-вызов LLM (включая повторы) в метриках и в учете запроса
+    """
+    agent = current_agent()
+    kind = call_kind(request)
+    tokens = response_tokens(response)
+    labels = (metrics.current_endpoint.get(), agent, kind)
+    metrics.LLM_AGENT_CALLS_TOTAL.inc(labels)
+    if tokens:
+        metrics.LLM_AGENT_TOKENS_TOTAL.inc(labels, tokens)
+    budget = current_budget.get()
+    if budget is not None:
+        budget.record(agent, kind, tokens, seconds)
+
+
+def _on_agent_started(source, event):
+    stack = _agent_stack.get()
+    key = id(event.agent)
+    # Повторная попытка задачи снова сообщает о старте того же агента
+    if not stack or stack[-1][0] != key:
+        _agent_stack.set(stack + ((key, str(event.agent.role)),))
+
+
+def _on_agent_finished(source, event):
+    stack = _agent_stack.get()
+    key = id(event.agent)
+    for n in range(len(stack) - 1, -1, -1):
+        if stack[n][0] == key:
+            _agent_stack.set(stack[:n])
+            return
+
+
+_attribution_installed = False
+
+
+def install_agent_attribution():
+    """
+    Подписывается на события crewai о старте и завершении агентов, чтобы
+    вызовы LLM учитывались по агентам. Обработчики выполняются в потоке crew,
+    поэтому стек агентов у каждого crew свой.
+    """
+    global _attribution_installed
+    if _attribution_installed:
+        return
+    from crewai.utilities.events import crewai_event_bus
+    from crewai.utilities.events.agent_events import (
+        AgentExecutionCompletedEvent, AgentExecutionErrorEvent, AgentExecutionStartedEvent
+    )
+    crewai_event_bus.register_handler(AgentExecutionStartedEvent, _on_agent_started)
+    crewai_event_bus.register_handler(AgentExecutionCompletedEvent, _on_agent_finished)
+    crewai_event_bus.register_handler(AgentExecutionErrorEvent, _on_agent_finished)
+    _attribution_installed = True
+
+
+class LLMBudgetMiddleware:
+    """
+    ASGI middleware: заводит учет обращений к LLM на время запроса и добавляет
+    сводку в заголовки X-LLM-Usage и X-LLM-Agents ("агент:вид=вызовы/токены").
+
+    Если запрос превысил лимит, ошибка обработчика заменяется ответом 503 с
+    описанием лимита. Для потоковых ответов в заголовках — вызовы до начала ответа.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        budget = RequestBudget()
+        token = current_budget.set(budget)
+        replaced = False
+
+        async def send_wrapper(message):
+            nonlocal replaced
+            if message["type"] == "http.response.start":
+                headers = [(name.encode('latin-1'), value.encode('latin-1'))
+                           for name, value in budget.headers().items()]
+                if budget.exceeded is not None and message["status"] >= 500:
+                    replaced = True
+                    body = json.dumps({"detail": str(budget.exceeded)}, ensure_ascii=False).encode('utf-8')
+                    await send({
+                        "type": "http.response.start",
+                        "status": 503,
+                        "headers": headers + [(b"content-type", b"application/json"),
+                                              (b"content-length", str(len(body)).encode('latin-1'))],
+                    })
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                message["headers"] = list(message.get("headers", [])) + headers
+            elif replaced:
+                return
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_budget.reset(token)
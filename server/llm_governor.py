@@ -0,0 +1,270 @@
+import email.utils
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+import httpx
+from decouple import config
+
+import llm_budget
+import metrics
+from cancellation import check_cancelled
+
+# Все обращения к OpenAI (crew через litellm, OpenAIEmbeddings, клиент OpenAI)
+# проходят через один транспорт httpx с общим регулятором нагрузки
+LLM_INITIAL_CONCURRENCY = config('LLM_INITIAL_CONCURRENCY', default=4, cast=int)
+LLM_MIN_CONCURRENCY = config('LLM_MIN_CONCURRENCY', default=1, cast=int)
+LLM_MAX_CONCURRENCY = config('LLM_MAX_CONCURRENCY', default=32, cast=int)
+LLM_REQUESTS_PER_SECOND = config('LLM_REQUESTS_PER_SECOND', default=10.0, cast=float)
+LLM_BURST = config('LLM_BURST', default=10, cast=int)
+LLM_MAX_RETRIES = config('LLM_MAX_RETRIES', default=6, cast=int)
+LLM_BACKOFF_BASE = config('LLM_BACKOFF_BASE', default=0.5, cast=float)
+LLM_BACKOFF_MAX = config('LLM_BACKOFF_MAX', default=60.0, cast=float)
+
+# Ответы, после которых запрос повторяется
+RETRY_STATUS_CODES = frozenset({408, 409, 429, 500, 502, 503, 504})
+# Ответы, означающие перегрузку: после них уменьшается допустимый параллелизм
+OVERLOAD_STATUS_CODES = frozenset({429, 503})
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Ограничение числа одновременных запросов по схеме AIMD.
+
+    Каждый успешный ответ при полностью занятом лимите увеличивает его на
+    1/limit (примерно +1 за «окно» из limit запросов), ответ о перегрузке
+    уменьшает лимит вдвое. Как в TCP, на одно окно приходится не больше одного
+    уменьшения: ответы на запросы, отправленные до последнего уменьшения,
+    лимит не меняют — иначе пачка 429 на одновременные запросы обнулила бы его.
+    """
+    def __init__(self, initial: int = LLM_INITIAL_CONCURRENCY, minimum: int = LLM_MIN_CONCURRENCY,
+                 maximum: int = LLM_MAX_CONCURRENCY, decrease_factor: float = 0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> float:
+        """
+        Ждет свободного места; возвращает время отправки для release()
+        """
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, started: float, overloaded: bool = False):
+        with self._condition:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            if overloaded:
+                if started >= self._last_decrease:
+                    self.limit = max(self.minimum, self.limit * self.decrease_factor)
+                    self._last_decrease = time.monotonic()
+            elif saturated:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            metrics.LLM_CONCURRENCY_LIMIT.set(self.limit)
+            self._condition.notify_all()
+
+
+class TokenBucket:
+    """
+    Равномерная отправка запросов: не больше rate запросов в секунду
+    с допустимым всплеском capacity. pause() задерживает все запросы,
+    например, на время из заголовка Retry-After.
+    """
+    def __init__(self, rate: float = LLM_REQUESTS_PER_SECOND, capacity: int = LLM_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+def parse_retry_after(headers: httpx.Headers) -> Optional[float]:
+    """
+    Задержка из заголовков retry-after-ms (OpenAI) или Retry-After (секунды или дата)
+    """
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, parsed.timestamp() - time.time())
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None,
+                  base: float = LLM_BACKOFF_BASE, maximum: float = LLM_BACKOFF_MAX) -> float:
+    """
+    Экспоненциальная задержка с полным джиттером; Retry-After сервера
+    считается нижней границей, к ней добавляется небольшой джиттер,
+    чтобы повторные запросы не пришли одновременно
+    """
+    if retry_after is not None:
+        return min(maximum, retry_after + random.uniform(0, min(1.0, retry_after * 0.2 + 0.1)))
+    return random.uniform(0, min(maximum, base * (2 ** attempt)))
+
+
+class LLMGovernor:
+    """
+    Общий регулятор запросов к LLM: темп (TokenBucket), параллелизм (AIMD)
+    и повторы с учетом Retry-After
+    """
+    def __init__(self, limiter: AdaptiveConcurrencyLimiter = None, bucket: TokenBucket = None,
+                 max_retries: int = LLM_MAX_RETRIES):
+        self.limiter = limiter or AdaptiveConcurrencyLimiter()
+        self.bucket = bucket or TokenBucket()
+        self.max_retries = max_retries
+
+
+class GovernedTransport(httpx.BaseTransport):
+    """
+    Транспорт httpx, отправляющий запросы через общий регулятор процесса.
+
+    Повторяются ответы из RETRY_STATUS_CODES и сетевые ошибки; после
+    исчерпания попыток вызывающему коду возвращается последний ответ.
+    Клиенты, созданные в мастер-процессе gunicorn до fork, в рабочем
+    процессе получают новый пул соединений и новый регулятор.
+    """
+    def __init__(self):
+        self._pid = None
+        self._transport = None
+        self._lock = threading.Lock()
+
+    def _ensure_process(self) -> httpx.BaseTransport:
+        with self._lock:
+            if self._pid != os.getpid():
+                self._transport = httpx.HTTPTransport()
+                self._pid = os.getpid()
+            return self._transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        transport = self._ensure_process()
+        governor = get_governor()
+        # Тело нужно прочитать заранее, чтобы его можно было отправить повторно
+        request.read()
+        attempt = 0
+        while True:
+            # Отмененный запрос или запрос, исчерпавший свой бюджет, не ждет
+            # очереди и не отправляется
+            check_cancelled()
+            llm_budget.check_budget()
+            governor.bucket.acquire()
+            started = governor.limiter.acquire()
+            overloaded = False
+            response = None
+            try:
+                response = transport.handle_request(request)
+                overloaded = response.status_code in OVERLOAD_STATUS_CODES
+            except httpx.TransportError:
+                if attempt >= governor.max_retries:
+                    metrics.LLM_CALLS_TOTAL.inc(("transport_error",))
+                    raise
+            finally:
+                governor.limiter.release(started, overloaded)
+                llm_budget.record_call(request, response, time.monotonic() - started)
+
+            if response is not None and (response.status_code not in RETRY_STATUS_CODES
+                                         or attempt >= governor.max_retries):
+                metrics.LLM_CALLS_TOTAL.inc(("success" if response.status_code < 400 else "error",))
+                return response
+
+            retry_after = None
+            status = "network error"
+            if response is not None:
+                retry_after = parse_retry_after(response.headers)
+                status = response.status_code
+                response.read()
+                response.close()
+            delay = backoff_delay(attempt, retry_after)
+            if retry_after is not None:
+                # Сервер просит подождать: задерживаем все запросы, а не только этот
+                governor.bucket.pause(delay)
+            metrics.LLM_CALLS_TOTAL.inc(("retry",))
+            print(f"LLM request to {request.url.path} retried in {delay:.2f}s (status {status})")
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self):
+        if self._transport is not None and self._pid == os.getpid():
+            self._transport.close()
+
+
+_governor: Optional[LLMGovernor] = None
+_governor_pid: Optional[int] = None
+_governor_lock = threading.Lock()
+_http_client: Optional[httpx.Client] = None
+
+
+def get_governor() -> LLMGovernor:
+    """
+    Общий регулятор процесса (создается при первом обращении и заново после fork)
+    """
+    global _governor, _governor_pid
+    if _governor is None or _governor_pid != os.getpid():
+        with _governor_lock:
+            if _governor is None or _governor_pid != os.getpid():
+                _governor = LLMGovernor()
+                _governor_pid = os.getpid()
+    return _governor
+
+
+def get_http_client() -> httpx.Client:
+    """
+    Общий HTTP клиент для OpenAI SDK (параметр http_client), работающий через регулятор
+    """
+    global _http_client
+    if _http_client is None:
+        with _governor_lock:
+            if _http_client is None:
+                _http_client = httpx.Client(
+                    transport=GovernedTransport(),
+                    timeout=httpx.Timeout(600.0, connect=10.0),
+                )
+    return _http_client
+
+
+def install_litellm_client():
+    """
+    Направляет запросы crewai (через litellm) через общий регулятор
+    """
+    import litellm
+    litellm.client_session = get_http_client()
@@ -1,10 +1,20 @@
+import hashlib
 import os
 from decouple import config
 import json
+import sqlite3
+from typing import Dict, List, Optional, Tuple
 from crewai import Agent, Task, Crew, Process
 from crewai.tools import BaseTool
 from PyPDF2 import PdfReader
 from summarizer_agent import SummarizerAgent
+from pdf_backends import backend_chain, extract_pages
+from text_normalizer import normalize_text
+from llm_governor import install_litellm_client
+from llm_budget import install_agent_attribution
+from cancellation import check_cancelled
+from metrics import track_stage
+from text_store import file_hash, get_text_store
 
 # Configure OpenAI API key from .env file
 OPENAI_API_KEY = config('OPENAI_API_KEY', default=None)
@@ -13,9 +23,236 @@ if not OPENAI_API_KEY:
 
 os.environ["OPENAI_API_KEY"] = OPENAI_API_KEY
 
+# Переиспользование текста страниц, уже встречавшихся в других документах:
+# true, false или auto — только если основная библиотека извлечения медленная
+# (с pypdfium2 извлечь текст дешевле, чем разобрать файл PyPDF2 ради хэшей)
+PAGE_TEXT_REUSE = config('PAGE_TEXT_REUSE', default='auto')
+
+def flatten_outline(reader: PdfReader) -> List[Tuple[str, int, int]]:
+    """
+    Разворачивает оглавление PDF в список (заголовок, уровень вложенности, индекс страницы)
+    """
+    items = []
+
+    def walk(outline, level):
+        for item in outline:
+            if isinstance(item, list):
+                walk(item, level + 1)
+            else:
+                page = reader.get_destination_page_number(item)
+                if page is not None and page >= 0:
+                    items.append((str(item.title).strip(), level, page))
+
+    try:
+        walk(reader.outline, 0)
+    except Exception as e:
+        print(f"Error reading PDF outline: {str(e)}")
+    return items
+
+def resolve_pages(page_count: int, outline: List[Tuple[str, int, int]], page_start: Optional[int] = None,
+                  page_end: Optional[int] = None, section: Optional[str] = None) -> Optional[List[int]]:
+    """
+    Переводит выбор пользователя (диапазон страниц или раздел оглавления)
+    в список индексов страниц, начиная с 0
+
+    Args:
+        page_count (int): Количество страниц в документе
+        outline (list): Оглавление документа (см. flatten_outline)
+        page_start (int): Первая страница диапазона (с 1, включительно)
+        page_end (int): Последняя страница диапазона (включительно)
+        section (str): Заголовок раздела из оглавления PDF
+
+    Returns:
+        Optional[List[int]]: Индексы страниц или None, если выбран весь документ
+
+    Raises:
+        ValueError: Если диапазон вне документа или раздел не найден
+    """
+    if page_start is None and page_end is None and not section:
+        return None
+
+    total = page_count
+    if section:
+        if page_start is not None or page_end is not None:
+            raise ValueError("Укажите либо диапазон страниц, либо раздел")
+        wanted = section.strip().casefold()
+        for position, (title, level, page) in enumerate(outline):
+            if title.casefold() == wanted:
+                # Раздел заканчивается перед следующим разделом того же или более высокого уровня
+                end = total - 1
+                for next_title, next_level, next_page in outline[position + 1:]:
+                    if next_level <= level:
+                        end = max(page, next_page - 1)
+                        break
+                return list(range(page, end + 1))
+        raise ValueError(f"Раздел '{section}' не найден в оглавлении PDF")
+
+    start = (page_start or 1) - 1
+    end = (page_end or total) - 1
+    if start < 0 or end >= total or start > end:
+        raise ValueError(f"Неверный диапазон страниц {start + 1}-{end + 1}: в документе {total} страниц")
+    return list(range(start, end + 1))
+
+def pdf_metadata(reader: PdfReader) -> dict:
+    """
+    Метаданные документа, которые хранятся вместе с его текстом
+    """
+    return {"page_count": len(reader.pages), "outline": flatten_outline(reader)}
+
+def _hash_resources(resources, digest, seen: set):
+    """
+    Добавляет в digest шрифты и XObject ресурсов страницы или формы. Формы
+    (/Subtype /Form) хэшируются рекурсивно: у сканов и слайдов поток страницы
+    часто состоит из одного "/Fm0 Do", и весь текст — в форме.
+    """
+    resources = resources.get_object() if resources is not None else None
+    if not resources:
+        return
+    fonts = resources.get("/Font")
+    fonts = fonts.get_object() if fonts is not None else {}
+    for name in sorted(fonts):
+        digest.update(f"font {name}={fonts[name].get_object().get('/BaseFont')}".encode("utf-8"))
+    xobjects = resources.get("/XObject")
+    xobjects = xobjects.get_object() if xobjects is not None else {}
+    for name in sorted(xobjects):
+        reference = xobjects[name]
+        xobject = reference.get_object()
+        digest.update(f"xobject {name} {xobject.get('/Subtype')}".encode("utf-8"))
+        key = getattr(reference, "idnum", None)
+        if key is not None and key in seen:
+            # Та же форма уже учтена (или ссылается сама на себя)
+            continue
+        if key is not None:
+            seen.add(key)
+        digest.update(xobject.get_data())
+        if xobject.get("/Subtype") == "/Form":
+            _hash_resources(xobject.get("/Resources"), digest, seen)
+
+def page_content_hash(page) -> Optional[str]:
+    """
+    SHA-256 потока содержимого страницы и ее ресурсов: шрифтов и XObject
+    (форм — рекурсивно, вместе с их ресурсами).
+
+    Не зависит от остального файла, поэтому совпадает у одинаковых страниц
+    в разных документах и в разных версиях одного документа.
+
+    Returns:
+        Optional[str]: None, если содержимое не удалось разобрать — тогда текст
+        страницы не переиспользуется и не сохраняется по хэшу
+    """
+    digest = hashlib.sha256()
+    try:
+        contents = page.get_contents()
+        if contents is not None:
+            digest.update(contents.get_data())
+        _hash_resources(page.get("/Resources"), digest, set())
+    except Exception as e:
+        print(f"Error hashing page content: {str(e)}")
+        return None
+    return digest.hexdigest()
+
+def page_text_reuse_enabled() -> bool:
+    setting = PAGE_TEXT_REUSE.strip().lower()
+    if setting == "auto":
+        chain = backend_chain()
+        return bool(chain) and not chain[0].fast
+    return setting in ("true", "1", "yes", "on")
+
+def text_hash(text: str) -> str:
+    """
+    SHA-256 текста страницы — ключ фрагментов сводки, не зависящий от файла
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def extract_pdf_page_texts(pdf_path: str, pages: Optional[List[int]] = None,
+                           content_hash: Optional[str] = None) -> Dict[int, str]:
+    """
+    Извлекает текст страниц PDF, используя хранилище извлеченного текста:
+    уже извлеченные страницы документа берутся из него, новые — сохраняются.
+    Страницы, уже встречавшиеся в других документах (по хэшу содержимого
+    страницы), повторно не извлекаются (см. PAGE_TEXT_REUSE).
+
+    Args:
+        pdf_path (str): Путь к PDF файлу
+        pages (List[int]): Индексы страниц (с 0); None — все страницы
+        content_hash (str): SHA-256 файла, если уже посчитан
+
+    Returns:
+        Dict[int, str]: Текст выбранных страниц по их индексам
+    """
+    store = get_text_store()
+    content_hash = content_hash or file_hash(pdf_path)
+    metadata = None
+    try:
+        metadata = store.get_metadata(content_hash)
+        if metadata is not None:
+            page_numbers = pages if pages is not None else range(metadata["page_count"])
+            cached = store.get_pages(content_hash, page_numbers)
+            if cached is not None:
+                print(f"Text store hit for {content_hash[:12]}: {len(cached)} pages")
+                return {i: cached[i] for i in page_numbers}
+    except sqlite3.Error as e:
+        print(f"Error reading text store: {str(e)}")
+
+    # PyPDF2 разбирает файл, только если нужны метаданные нового документа
+    # или хэши страниц для переиспользования их текста
+    reader = None
+
+    def get_reader() -> PdfReader:
+        nonlocal reader
+        if reader is None:
+            check_cancelled()
+            reader = PdfReader(pdf_path)
+            print(f"PDF loaded successfully. Number of pages: {len(reader.pages)}")
+        return reader
+
+    if metadata is None:
+        metadata = pdf_metadata(get_reader())
+    page_count = metadata["page_count"]
+    page_numbers = pages if pages is not None else range(page_count)
+    page_hashes = {}
+    known = {}
+    if page_text_reuse_enabled():
+        page_hashes = {i: page_content_hash(get_reader().pages[i]) for i in page_numbers}
+        try:
+            known = store.get_page_texts(page_hash for page_hash in page_hashes.values() if page_hash)
+        except sqlite3.Error as e:
+            print(f"Error reading text store: {str(e)}")
+
+    extracted = {i: known[page_hashes[i]] for i in page_numbers if page_hashes.get(i) in known}
+    if extracted:
+        print(f"Reused text of {len(extracted)}/{len(page_hashes)} pages seen in other documents")
+    missing = [i for i in page_numbers if i not in extracted]
+    if missing:
+        check_cancelled()
+        backend, texts = extract_pages(pdf_path, missing)
+        for i in missing:
+            print(f"Page {i+1}/{page_count} extracted with {backend}: {len(texts[i])} characters")
+        extracted.update(texts)
+
+    try:
+        store.put_pages(content_hash, extracted, metadata)
+        store.put_page_texts({page_hashes[i]: extracted[i] for i in page_numbers
+                              if page_hashes.get(i) and page_hashes[i] not in known})
+    except sqlite3.Error as e:
+        print(f"Error writing text store: {str(e)}")
+    return {i: extracted[i] for i in page_numbers}
+
+def extract_pdf_pages(pdf_path: str, pages: Optional[List[int]] = None,
+                      content_hash: Optional[str] = None) -> str:
+    """
+    Текст выбранных страниц PDF одной строкой (см. extract_pdf_page_texts)
+    """
+    return "".join(extract_pdf_page_texts(pdf_path, pages, content_hash).values())
+
 class PDFReaderTool(BaseTool):
     name: str = "PDF Reader"
     description: str = "Reads the content of a PDF file and returns the text."
+    # Метка эндпоинта для метрик: инструмент может выполняться в другом потоке,
+    # где contextvar с эндпоинтом запроса недоступен
+    endpoint: Optional[str] = None
+    # Индексы выбранных страниц (с 0); None — весь документ
+    pages: Optional[List[int]] = None
 
     def _run(self, pdf_path: str) -> str:
         try:
@@ -23,15 +260,10 @@ class PDFReaderTool(BaseTool):
             print(f"File exists: {os.path.exists(pdf_path)}")
             print(f"File size: {os.path.getsize(pdf_path)} bytes")
             
-            reader = PdfReader(pdf_path)
-            print(f"PDF loaded successfully. Number of pages: {len(reader.pages)}")
-            
-            text = ""
-            for i, page in enumerate(reader.pages):
-                print(f"Processing page {i+1}/{len(reader.pages)}")
-                page_text = page.extract_text()
-                text += page_text
-                print(f"Page {i+1} extracted: {len(page_text)} characters")
+            with track_stage("extract", endpoint=self.endpoint):
+                page_texts = extract_pdf_page_texts(pdf_path, self.pages)
+            with track_stage("normalize", endpoint=self.endpoint):
+                text = normalize_text(page_texts, self.endpoint)
             
             print(f"Total text extracted: {len(text)} characters")
             return text
@@ -45,6 +277,10 @@ class PDFReaderTool(BaseTool):
             raise Exception(error_msg)
 
 def main():
+    # Запросы crew к OpenAI идут через общий регулятор (параллелизм, темп, повторы)
+    install_litellm_client()
+    install_agent_attribution()
+
     # Initialize tools and agents
     pdf_reader_tool = PDFReaderTool()
     
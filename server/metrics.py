@@ -0,0 +1,326 @@
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Tuple
+
+# Границы бакетов гистограмм в секундах: от миллисекунд (парсинг JSON)
+# до минут (выполнение crew)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Эндпоинт, в рамках которого выполняется текущий код: этапы внутри
+# инструментов и агентов берут метку отсюда
+current_endpoint: ContextVar[str] = ContextVar("current_endpoint", default="unknown")
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_float(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter:
+    """
+    Монотонный счетчик с метками
+    """
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_float(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными бакетами и метками.
+
+    Наблюдение — поиск бакета бинарным поиском и инкремент под блокировкой,
+    накопительные суммы считаются только при выдаче метрик.
+    """
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # Для каждого набора меток: [счетчики по бакетам + Inf, сумма]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, labels: Tuple[str, ...] = ()):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(labels, list(series[0]), series[1]) for labels, series in self._series.items()]
+        bounds = self.buckets + (float("inf"),)
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                le = f'le="{_format_float(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_float(total)}")
+            lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """
+    Текущее значение с метками
+    """
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, labels: Tuple[str, ...] = ()):
+        with self._lock:
+            self._values[labels] = float(value)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_float(value)}")
+        return lines
+
+
+class Registry:
+    """
+    Набор метрик, выдаваемых эндпоинтом /metrics
+    """
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    "qysqa_request_duration_seconds",
+    "Total request handling time.",
+    ("endpoint", "outcome"),
+))
+REQUESTS_TOTAL = REGISTRY.register(Counter(
+    "qysqa_requests_total",
+    "Handled requests.",
+    ("endpoint", "outcome"),
+))
+STAGE_DURATION = REGISTRY.register(Histogram(
+    "qysqa_stage_duration_seconds",
+    "Duration of a pipeline stage (download, extract, crew tasks, json parsing, upload).",
+    ("endpoint", "stage", "outcome"),
+))
+STAGES_TOTAL = REGISTRY.register(Counter(
+    "qysqa_stage_total",
+    "Executed pipeline stages.",
+    ("endpoint", "stage", "outcome"),
+))
+
+SINGLE_FLIGHT_TOTAL = REGISTRY.register(Counter(
+    "qysqa_single_flight_total",
+    "Requests by role in request coalescing (leader does the work, follower awaits it).",
+    ("endpoint", "role"),
+))
+
+LLM_CALLS_TOTAL = REGISTRY.register(Counter(
+    "qysqa_llm_calls_total",
+    "HTTP calls to the LLM provider by result (success, error, retry, transport_error).",
+    ("outcome",),
+))
+LLM_CONCURRENCY_LIMIT = REGISTRY.register(Gauge(
+    "qysqa_llm_concurrency_limit",
+    "Current adaptive limit of concurrent LLM calls.",
+))
+LLM_AGENT_CALLS_TOTAL = REGISTRY.register(Counter(
+    "qysqa_llm_agent_calls_total",
+    "HTTP calls to the LLM provider (including retries) by endpoint, crewai agent and kind (chat, embeddings).",
+    ("endpoint", "agent", "kind"),
+))
+LLM_AGENT_TOKENS_TOTAL = REGISTRY.register(Counter(
+    "qysqa_llm_agent_tokens_total",
+    "Tokens reported in the usage of LLM responses by endpoint, crewai agent and kind.",
+    ("endpoint", "agent", "kind"),
+))
+LLM_BUDGET_EXCEEDED_TOTAL = REGISTRY.register(Counter(
+    "qysqa_llm_budget_exceeded_total",
+    "Requests stopped by the per-request LLM budget by exceeded limit (calls, tokens, seconds).",
+    ("endpoint", "limit"),
+))
+
+PDF_EXTRACT_TOTAL = REGISTRY.register(Counter(
+    "qysqa_pdf_extract_total",
+    "PDF text extractions by backend and result (success, error, garbled).",
+    ("backend", "outcome"),
+))
+
+PROMPT_TOKENS_TOTAL = REGISTRY.register(Counter(
+    "qysqa_prompt_tokens_total",
+    "Tokens of document text before (extracted) and after (normalized) text normalization.",
+    ("endpoint", "stage"),
+))
+
+DEADLINE_RESULTS_TOTAL = REGISTRY.register(Counter(
+    "qysqa_deadline_results_total",
+    "Requests with a deadline by response (full result in time or degraded result with a background job).",
+    ("endpoint", "outcome"),
+))
+
+SUMMARY_FRAGMENTS_TOTAL = REGISTRY.register(Counter(
+    "qysqa_summary_fragments_total",
+    "Summary fragments of page groups by source (reused from cache or generated by the LLM).",
+    ("outcome",),
+))
+
+
+# Дополнительные получатели сырых замеров этапов (например, бенчмарки,
+# которым нужны точные перцентили, а не бакеты гистограммы)
+_stage_listeners = []
+
+
+def add_stage_listener(listener):
+    """
+    Регистрирует функцию listener(endpoint, stage, outcome, seconds)
+    """
+    _stage_listeners.append(listener)
+
+
+def remove_stage_listener(listener):
+    _stage_listeners.remove(listener)
+
+
+def observe_stage(stage: str, seconds: float, outcome: str = "success", endpoint: str = None):
+    """
+    Записывает длительность этапа в гистограмму и счетчик
+    """
+    labels = (endpoint or current_endpoint.get(), stage, outcome)
+    STAGE_DURATION.observe(seconds, labels)
+    STAGES_TOTAL.inc(labels)
+    if _stage_listeners:
+        for listener in _stage_listeners:
+            listener(*labels, seconds)
+
+
+@contextmanager
+def track_stage(stage: str, endpoint: str = None):
+    """
+    Замеряет этап конвейера; исключение внутри блока записывается с outcome="error"
+    """
+    start_time = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "success"
+    finally:
+        observe_stage(stage, time.perf_counter() - start_time, outcome, endpoint)
+
+
+@contextmanager
+def track_request(endpoint: str):
+    """
+    Замеряет обработку запроса целиком и задает метку эндпоинта для вложенных этапов
+    """
+    token = current_endpoint.set(endpoint)
+    start_time = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "success"
+    except Exception as e:
+        # Ошибки клиента (HTTPException с кодом 4xx) считаем отдельно от сбоев сервера
+        status_code = getattr(e, "status_code", 500)
+        if status_code < 500:
+            outcome = "client_error"
+        raise
+    finally:
+        labels = (endpoint, outcome)
+        REQUEST_DURATION.observe(time.perf_counter() - start_time, labels)
+        REQUESTS_TOTAL.inc(labels)
+        current_endpoint.reset(token)
+
+
+class CrewTaskTimer:
+    """
+    Замеряет длительность каждой задачи последовательного crew.
+
+    Callback задачи вызывается по ее завершении, поэтому длительность задачи —
+    время от завершения предыдущей задачи (или от старта crew) до текущей.
+    """
+    def __init__(self, endpoint: str = None):
+        self.endpoint = endpoint or current_endpoint.get()
+        self._last = None
+
+    def start(self):
+        self._last = time.perf_counter()
+
+    def callback(self, stage: str):
+        def on_task_complete(output):
+            now = time.perf_counter()
+            if self._last is not None:
+                observe_stage(stage, now - self._last, "success", self.endpoint)
+            self._last = now
+        return on_task_complete
+
+
+def instrument_endpoint(endpoint: str):
+    """
+    Декоратор async-эндпоинта FastAPI: оборачивает вызов в track_request.
+    functools.wraps сохраняет сигнатуру, по которой FastAPI разбирает параметры.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with track_request(endpoint):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
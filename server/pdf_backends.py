@@ -0,0 +1,181 @@
+import importlib.util
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Tuple
+
+from decouple import config, Csv
+
+import metrics
+from cancellation import check_cancelled
+
+# Извлечение текста страниц PDF разными библиотеками. Все библиотеки, кроме
+# PyPDF2, необязательны: недоступные просто пропускаются.
+
+# Имя библиотеки или "auto" — первая доступная из PDF_BACKEND_ORDER.
+# Порядок по умолчанию — по скорости (см. benchmarks/bench_pdf_backends.py)
+PDF_BACKEND = config('PDF_BACKEND', default='auto')
+PDF_BACKEND_ORDER = config('PDF_BACKEND_ORDER', default='pypdfium2,pypdf,pypdf2,pdfminer', cast=Csv())
+# Доля нераспознанных символов (U+FFFD, "(cid:N)"), при которой текст документа
+# считается испорченным и извлекается следующей библиотекой
+PDF_BACKEND_MAX_GARBAGE = config('PDF_BACKEND_MAX_GARBAGE', default=0.05, cast=float)
+
+
+class PDFBackend(ABC):
+    """
+    Извлечение текста страниц PDF одной библиотекой
+    """
+    name = ""
+    # Модуль, по наличию которого определяется доступность библиотеки
+    module = ""
+    # Библиотека на C: извлечь текст дешевле, чем разобрать файл PyPDF2 ради хэшей страниц
+    fast = False
+
+    def available(self) -> bool:
+        return importlib.util.find_spec(self.module) is not None
+
+    @abstractmethod
+    def extract(self, pdf_path: str, pages: List[int]) -> Dict[int, str]:
+        """
+        Текст страниц по их индексам (с 0)
+        """
+
+
+class PyPDF2Backend(PDFBackend):
+    name = "pypdf2"
+    module = "PyPDF2"
+
+    def extract(self, pdf_path: str, pages: List[int]) -> Dict[int, str]:
+        from PyPDF2 import PdfReader
+        reader = PdfReader(pdf_path)
+        return {i: reader.pages[i].extract_text() for i in pages}
+
+
+class PypdfBackend(PDFBackend):
+    name = "pypdf"
+    module = "pypdf"
+
+    def extract(self, pdf_path: str, pages: List[int]) -> Dict[int, str]:
+        from pypdf import PdfReader
+        reader = PdfReader(pdf_path)
+        return {i: reader.pages[i].extract_text() for i in pages}
+
+
+class PdfminerBackend(PDFBackend):
+    name = "pdfminer"
+    module = "pdfminer"
+
+    def extract(self, pdf_path: str, pages: List[int]) -> Dict[int, str]:
+        from pdfminer.high_level import extract_pages
+        from pdfminer.layout import LTTextContainer
+        # extract_pages отдает выбранные страницы по возрастанию индекса
+        ordered = sorted(set(pages))
+        texts = {}
+        for i, layout in zip(ordered, extract_pages(pdf_path, page_numbers=ordered)):
+            texts[i] = "".join(element.get_text() for element in layout if isinstance(element, LTTextContainer))
+        return {i: texts[i] for i in pages}
+
+
+class Pypdfium2Backend(PDFBackend):
+    name = "pypdfium2"
+    module = "pypdfium2"
+    fast = True
+    # PDFium не потокобезопасен: в процессе одновременно обрабатывается один документ
+    _lock = threading.Lock()
+
+    def extract(self, pdf_path: str, pages: List[int]) -> Dict[int, str]:
+        import pypdfium2
+        texts = {}
+        with self._lock:
+            document = pypdfium2.PdfDocument(pdf_path)
+            try:
+                for i in pages:
+                    page = document[i]
+                    text_page = page.get_textpage()
+                    # PDFium разделяет строки \r\n, остальные библиотеки — \n
+                    texts[i] = text_page.get_text_range().replace("\r\n", "\n")
+                    text_page.close()
+                    page.close()
+            finally:
+                document.close()
+        return texts
+
+
+BACKENDS: Dict[str, PDFBackend] = {
+    backend.name: backend for backend in (Pypdfium2Backend(), PypdfBackend(), PyPDF2Backend(), PdfminerBackend())
+}
+
+
+def backend_chain() -> List[PDFBackend]:
+    """
+    Библиотеки в порядке попыток: выбранная в PDF_BACKEND (или первая доступная
+    при "auto"), затем остальные доступные из PDF_BACKEND_ORDER как запасные
+    """
+    names = [name.strip().lower() for name in PDF_BACKEND_ORDER if name.strip().lower() in BACKENDS]
+    preferred = PDF_BACKEND.strip().lower()
+    if preferred != "auto":
+        if preferred not in BACKENDS:
+            raise ValueError(f"Unknown PDF_BACKEND '{PDF_BACKEND}', expected auto or one of {', '.join(BACKENDS)}")
+        names = [preferred] + [name for name in names if name != preferred]
+    return [BACKENDS[name] for name in names if BACKENDS[name].available()]
+
+
+def garbage_ratio(text: str) -> float:
+    """
+    Доля символов текста, которые библиотека не смогла распознать
+    """
+    if not text:
+        return 0.0
+    garbage = text.count("\ufffd") + 6 * text.count("(cid:")
+    return garbage / len(text)
+
+
+def extract_pages(pdf_path: str, pages: List[int]) -> Tuple[str, Dict[int, str]]:
+    """
+    Извлекает текст страниц первой подходящей библиотекой.
+
+    Если библиотека падает на документе или возвращает испорченный текст,
+    документ извлекается следующей; испорченный текст все же возвращается,
+    если лучше не справилась ни одна.
+
+    Args:
+        pdf_path (str): Путь к PDF файлу
+        pages (List[int]): Индексы страниц (с 0)
+
+    Returns:
+        Tuple[str, Dict[int, str]]: Имя библиотеки и текст страниц по индексам
+    """
+    chain = backend_chain()
+    if not chain:
+        raise RuntimeError("No PDF extraction backend is installed")
+    fallback = None
+    last_error = None
+    for backend in chain:
+        check_cancelled()
+        try:
+            texts = backend.extract(pdf_path, pages)
+        except Exception as e:
+            print(f"PDF backend {backend.name} failed on {pdf_path}: {str(e)}")
+            metrics.PDF_EXTRACT_TOTAL.inc((backend.name, "error"))
+            last_error = e
+            continue
+        ratio = garbage_ratio("".join(texts.values()))
+        if ratio > PDF_BACKEND_MAX_GARBAGE:
+            print(f"PDF backend {backend.name}: {ratio:.0%} unrecognized characters in {pdf_path}, trying next")
+            metrics.PDF_EXTRACT_TOTAL.inc((backend.name, "garbled"))
+            if fallback is None or ratio < fallback[0]:
+                fallback = (ratio, backend.name, texts)
+            continue
+        metrics.PDF_EXTRACT_TOTAL.inc((backend.name, "success"))
+        return backend.name, texts
+    if fallback is not None:
+        return fallback[1], fallback[2]
+    raise last_error
+
+
+def extract_text(pdf_path: str) -> str:
+    """
+    Текст всего документа одной строкой (без хранилища извлеченного текста)
+    """
+    from PyPDF2 import PdfReader
+    _, texts = extract_pages(pdf_path, list(range(len(PdfReader(pdf_path).pages))))
+    return "".join(texts.values())
@@ -1,17 +1,13 @@
 import os
 from crewai import Agent, Task, Crew, Process
 from crewai.tools import BaseTool
-from PyPDF2 import PdfReader
+from pdf_backends import extract_text
 
 class PDFReaderTool(BaseTool):
     name: str = "PDF Reader"
     description: str = "Reads the content of a PDF file and returns the text."
 
     def _run(self, pdf_path: str) -> str:
-        reader = PdfReader(pdf_path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text()
-        return text
+        return extract_text(pdf_path)
 
 pdf_reader_tool = PDFReaderTool() 
\ No newline at end of file
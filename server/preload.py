@@ -0,0 +1,60 @@
+import importlib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Тяжелые модули, импорт которых занимает секунды и сотни мегабайт
+HEAVY_MODULES = [
+    "crewai",
+    "crewai.tools",
+    "langchain_community.vectorstores",
+    "langchain_openai",
+    "faiss",
+    "PyPDF2",
+    "boto3",
+    "openai",
+]
+
+
+def preload():
+    """
+    Загружает тяжелые модули и данные только для чтения до fork рабочих процессов.
+
+    Все, что загружено здесь, рабочие процессы получают через copy-on-write
+    вместо повторного импорта и повторного построения базы знаний в каждом из них.
+    """
+    start_time = time.perf_counter()
+    for module_name in HEAVY_MODULES:
+        importlib.import_module(module_name)
+
+    import summarizer_agent
+    summarizer_agent.load_format_guide()
+    try:
+        summarizer_agent.get_knowledge_base()
+        # Контекст форматирования нужен каждому запросу: воркеры получат его из кэша
+        summarizer_agent.get_relevant_contexts(summarizer_agent.FORMATTING_QUERIES)
+    except Exception as e:
+        # Без доступа к OpenAI мастер все равно должен запуститься:
+        # база знаний будет построена лениво в каждом воркере при первом запросе
+        logger.warning(f"Knowledge base preload failed, it will be built lazily: {e}")
+
+    # Приложение импортируется последним: оно использует уже загруженные модули
+    import api
+    import request_logging
+    # api при импорте запускает поток слушателя логов запросов; поток не
+    # переживает fork, поэтому в мастере его останавливаем, а в воркерах
+    # запускаем заново (after_fork)
+    request_logging.shutdown_queue_logging()
+    logger.info(f"Preload completed in {time.perf_counter() - start_time:.2f} seconds")
+    return api.app
+
+
+def after_fork():
+    """
+    Сбрасывает состояние, которое нельзя делить между процессами
+    """
+    import request_logging
+    import summarizer_agent
+    request_logging.setup_queue_logging()
+    summarizer_agent.reset_embeddings_client()
@@ -0,0 +1,254 @@
+import hmac
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Set
+
+from decouple import config
+
+# Профилирование работающего процесса по запросу: выборочный профиль CPU в
+# формате collapsed stacks (flamegraph.pl, speedscope, inferno) и снимки
+# tracemalloc с разницей между ними. Пока профиль не запрошен, ничего не
+# работает: семплер — отдельный поток только на время профиля, tracemalloc
+# включается явно, middleware профиля запроса подключается только при заданном
+# токене.
+
+# Токен доступа к /debug/*; пустой — профилирование выключено
+PROFILING_TOKEN = config('PROFILING_TOKEN', default='')
+PROFILING_TOKEN_HEADER = "x-profiling-token"
+# Заголовок запроса, включающий профиль CPU одного вызова
+PROFILE_REQUEST_HEADER = "x-profile"
+PROFILE_LOCATION_HEADER = "x-profile-location"
+# Максимальная длительность профиля CPU, секунд
+PROFILING_MAX_SECONDS = config('PROFILING_MAX_SECONDS', default=60, cast=float)
+PROFILING_DEFAULT_INTERVAL = config('PROFILING_DEFAULT_INTERVAL', default=0.005, cast=float)
+# Сколько профилей отдельных запросов хранить в памяти
+PROFILING_KEEP = config('PROFILING_KEEP', default=20, cast=int)
+# Глубина стека, сохраняемая tracemalloc для каждого выделения
+PROFILING_TRACEMALLOC_FRAMES = config('PROFILING_TRACEMALLOC_FRAMES', default=25, cast=int)
+
+# Ожидание в простаивающих потоках (пул asyncio.to_thread, цикл событий):
+# такие выборки не показывают работу и только размывают профиль
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+    # Поток QueueListener логирования (request_logging.setup_queue_logging)
+    ("handlers.py", "dequeue"),
+}
+
+
+def profiling_enabled() -> bool:
+    return bool(PROFILING_TOKEN)
+
+
+def check_token(token: Optional[str]) -> bool:
+    # compare_digest на str принимает только ASCII, поэтому сравниваются байты
+    return (profiling_enabled() and token is not None
+            and hmac.compare_digest(token.encode("utf-8"), PROFILING_TOKEN.encode("utf-8")))
+
+
+class ProfilerBusy(RuntimeError):
+    """
+    Профиль CPU уже снимается
+    """
+
+
+def frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """
+    Выборочный профилировщик: отдельный поток с интервалом interval читает
+    стеки всех потоков интерпретатора (sys._current_frames) и считает
+    одинаковые стеки. Работу в C-расширениях (разбор PDF, ожидание сети)
+    видно по вызвавшей ее функции Python.
+    """
+    def __init__(self, interval: float = PROFILING_DEFAULT_INTERVAL, exclude: Set[int] = frozenset()):
+        self.interval = interval
+        # Потоки, которые не попадают в профиль (например, ожидающий его окончания)
+        self.exclude = exclude
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> str:
+        self._stop.set()
+        self._thread.join()
+        return self.collapsed()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own or ident in self.exclude:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        """
+        Стеки в формате collapsed: "поток;корень;...;лист число_выборок"
+        """
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+_cpu_lock = threading.Lock()
+
+
+def profile_cpu(seconds: float, interval: float = PROFILING_DEFAULT_INTERVAL) -> str:
+    """
+    Профиль CPU всего процесса за seconds секунд (выполняется в потоке)
+    """
+    if not _cpu_lock.acquire(blocking=False):
+        raise ProfilerBusy("CPU profile is already running")
+    try:
+        sampler = StackSampler(interval, exclude={threading.get_ident()})
+        sampler.start()
+        time.sleep(seconds)
+        return sampler.stop()
+    finally:
+        _cpu_lock.release()
+
+
+_request_profiles: "OrderedDict[str, str]" = OrderedDict()
+_request_profiles_lock = threading.Lock()
+
+
+def get_request_profile(profile_id: str) -> Optional[str]:
+    with _request_profiles_lock:
+        return _request_profiles.get(profile_id)
+
+
+def _keep_request_profile(profile_id: str, collapsed: str):
+    with _request_profiles_lock:
+        _request_profiles[profile_id] = collapsed
+        while len(_request_profiles) > PROFILING_KEEP:
+            _request_profiles.popitem(last=False)
+
+
+class RequestProfilingMiddleware:
+    """
+    ASGI middleware: запрос с заголовками X-Profile: cpu и X-Profiling-Token
+    выполняется под семплером, а ответ получает X-Profile-Location с адресом
+    профиля (доступен после окончания ответа).
+
+    Семплер видит все потоки процесса, поэтому на загруженном воркере в профиль
+    попадают и параллельные запросы. Подключается, только если задан PROFILING_TOKEN.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope["headers"]}
+        if headers.get(PROFILE_REQUEST_HEADER) != "cpu" or not check_token(headers.get(PROFILING_TOKEN_HEADER)):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex
+        sampler = StackSampler()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (PROFILE_LOCATION_HEADER.encode('latin-1'), f"/debug/profiles/{profile_id}".encode('latin-1'))
+                ]
+            await send(message)
+
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _keep_request_profile(profile_id, sampler.stop())
+            print(f"Request profile {profile_id}: {sampler.samples} samples for {scope['method']} {scope['path']}")
+
+
+class MemoryTracer:
+    """
+    Включение tracemalloc и снимки памяти: каждый снимок сравнивается с
+    предыдущим, так что по двум вызовам видно, где растет память
+    """
+    def __init__(self):
+        self._previous: Optional[tracemalloc.Snapshot] = None
+        self._previous_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILING_TRACEMALLOC_FRAMES)
+            print(f"tracemalloc started ({PROFILING_TRACEMALLOC_FRAMES} frames)")
+
+    def stop(self):
+        with self._lock:
+            self._previous = None
+            self._previous_at = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            print("tracemalloc stopped")
+
+    def snapshot(self, limit: int = 20, group_by: str = "lineno") -> Dict:
+        """
+        Крупнейшие места выделения памяти и их изменение с предыдущего снимка
+        """
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            previous, previous_at = self._previous, self._previous_at
+            self._previous, self._previous_at = snapshot, time.time()
+
+        top: List[Dict] = []
+        if previous is not None:
+            for stat in snapshot.compare_to(previous, group_by)[:limit]:
+                top.append({
+                    "location": str(stat.traceback[0]) if stat.traceback else "",
+                    "size_kb": round(stat.size / 1024, 1),
+                    "count": stat.count,
+                    "size_diff_kb": round(stat.size_diff / 1024, 1),
+                    "count_diff": stat.count_diff,
+                })
+        else:
+            for stat in snapshot.statistics(group_by)[:limit]:
+                top.append({
+                    "location": str(stat.traceback[0]) if stat.traceback else "",
+                    "size_kb": round(stat.size / 1024, 1),
+                    "count": stat.count,
+                })
+        return {
+            "traced_kb": round(current / 1024, 1),
+            "peak_kb": round(peak / 1024, 1),
+            "compared_to": previous_at,
+            "top": top,
+        }
+
+
+memory_tracer = MemoryTracer()
@@ -0,0 +1,172 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import re
+import time
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+from typing import Iterable, Optional
+
+from decouple import config, Csv
+
+# Логгер для записей о запросах: отдельный от логгера приложения,
+# чтобы его можно было перевести на неблокирующую очередь
+logger = logging.getLogger("request_log")
+
+REQUEST_ID_HEADER = "x-request-id"
+# Идентификатор от клиента принимаем только короткий и из безопасных символов,
+# иначе генерируем свой: один клиент не должен раздувать каждую строку лога
+MAX_REQUEST_ID_LENGTH = 128
+REQUEST_ID_PATTERN = re.compile(rb"^[A-Za-z0-9._:\-]+$")
+
+# Настройки по умолчанию (переопределяются через .env)
+DEFAULT_BODY_LIMIT = config('REQUEST_LOG_BODY_LIMIT', default=1024, cast=int)
+DEFAULT_SAMPLE_RATE = config('REQUEST_LOG_SAMPLE_RATE', default=1.0, cast=float)
+DEFAULT_HEADER_ALLOWLIST = config(
+    'REQUEST_LOG_HEADERS',
+    default='content-type,content-length,user-agent',
+    cast=Csv()
+)
+
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[QueueHandler] = None
+_atexit_registered = False
+
+
+def setup_queue_logging(handlers: Iterable[logging.Handler] = None) -> QueueListener:
+    """
+    Переводит логгер запросов на очередь: запись в очередь не блокирует
+    обработчик запроса, а форматирование и вывод выполняются в отдельном потоке.
+
+    Args:
+        handlers: Обработчики, которые будут писать записи (по умолчанию stderr)
+
+    Поток слушателя не переживает fork: при предзагрузке приложения в мастере
+    gunicorn его нужно остановить до fork и запустить заново в каждом воркере
+    (см. preload.py).
+
+    Returns:
+        QueueListener: Запущенный слушатель очереди
+    """
+    global _listener, _queue_handler, _atexit_registered
+    if _listener is not None:
+        return _listener
+
+    if handlers is None:
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(logging.Formatter('%(message)s'))
+        handlers = [stream_handler]
+
+    log_queue = queue.SimpleQueue()
+    _queue_handler = QueueHandler(log_queue)
+    logger.addHandler(_queue_handler)
+    logger.setLevel(logging.INFO)
+    # Записи не должны дублироваться через корневой логгер
+    logger.propagate = False
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    # Дописываем оставшиеся записи при завершении процесса
+    if not _atexit_registered:
+        atexit.register(shutdown_queue_logging)
+        _atexit_registered = True
+    return _listener
+
+
+def shutdown_queue_logging():
+    """
+    Останавливает слушатель очереди, дописывая накопленные записи, и снимает
+    обработчик очереди с логгера, чтобы setup_queue_logging можно было вызвать снова
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _queue_handler is not None:
+        logger.removeHandler(_queue_handler)
+        _queue_handler = None
+
+
+class RequestLoggingMiddleware:
+    """
+    ASGI middleware для логирования запросов с минимальными накладными расходами.
+
+    Тело запроса не считывается заранее: первые ``body_limit`` байт копируются
+    по мере того, как приложение само читает тело. Заголовки фильтруются по
+    списку разрешенных, а каждая запись — одна строка JSON с идентификатором
+    запроса и длительностью. Детали (заголовки и тело) пишутся только для
+    доли запросов ``sample_rate``; строка со статусом и временем пишется всегда.
+    """
+
+    def __init__(self, app, body_limit: int = None, sample_rate: float = None,
+                 header_allowlist: Iterable[str] = None):
+        self.app = app
+        self.body_limit = DEFAULT_BODY_LIMIT if body_limit is None else body_limit
+        self.sample_rate = DEFAULT_SAMPLE_RATE if sample_rate is None else sample_rate
+        allowlist = DEFAULT_HEADER_ALLOWLIST if header_allowlist is None else header_allowlist
+        self.header_allowlist = frozenset(h.strip().lower().encode('latin-1') for h in allowlist if h.strip())
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        sampled = self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+        request_id = None
+        headers = {}
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                if len(value) <= MAX_REQUEST_ID_LENGTH and REQUEST_ID_PATTERN.match(value):
+                    request_id = value.decode('latin-1')
+            # Сам идентификатор пишется отдельным полем request_id
+            elif sampled and name in self.header_allowlist:
+                headers[name.decode('latin-1')] = value.decode('latin-1')
+        if request_id is None:
+            request_id = uuid.uuid4().hex
+        scope.setdefault("state", {})["request_id"] = request_id
+
+        body_parts = []
+        body_size = 0
+        status_code = 500
+
+        async def receive_wrapper():
+            nonlocal body_size
+            message = await receive()
+            if sampled and message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                if body_size < self.body_limit:
+                    body_parts.append(chunk[:self.body_limit - body_size])
+                body_size += len(chunk)
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (REQUEST_ID_HEADER.encode('latin-1'), request_id.encode('latin-1'))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper if sampled else receive, send_wrapper)
+        finally:
+            record = {
+                "request_id": request_id,
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status_code,
+                "duration_ms": round((time.perf_counter() - start_time) * 1000, 3),
+            }
+            if sampled:
+                record["headers"] = headers
+                if body_parts:
+                    record["body"] = b"".join(body_parts).decode('utf-8', errors='replace')
+                    record["body_size"] = body_size
+                    record["body_truncated"] = body_size > self.body_limit
+            logger.info(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
@@ -0,0 +1,292 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, NamedTuple, Optional
+
+from decouple import config
+
+from compression import compress, supported_encodings
+
+# Готовые результаты (UI JSON конспектов и тесты) для повторной загрузки
+# через GET /results/{kind}/{result_id}
+RESULT_STORE_PATH = config(
+    'RESULT_STORE_PATH',
+    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'result_store.sqlite3')
+)
+RESULT_STORE_MAX_MB = config('RESULT_STORE_MAX_MB', default=256, cast=int)
+
+RESULT_KINDS = ("summary", "test")
+# Сколько хранятся записи о фоновых вычислениях (см. deadline.py)
+RESULT_JOB_TTL = config('RESULT_JOB_TTL', default=86400, cast=int)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    kind TEXT NOT NULL,
+    result_id TEXT NOT NULL,
+    body BLOB NOT NULL,
+    gzip BLOB,
+    br BLOB,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (kind, result_id)
+);
+CREATE TABLE IF NOT EXISTS versions (
+    source TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    result_id TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (source, kind)
+);
+CREATE TABLE IF NOT EXISTS fragments (
+    fragment_key TEXT PRIMARY KEY,
+    body BLOB NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    result_id TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    finished REAL
+);
+"""
+
+
+class StoredResult(NamedTuple):
+    kind: str
+    result_id: str
+    # Сериализованный JSON, ровно те байты, что отдаются клиенту без сжатия
+    body: bytes
+    # Предыдущая версия результата для того же документа (если она отличается)
+    previous_id: Optional[str] = None
+
+    @property
+    def etag(self) -> str:
+        # Идентификатор — хэш тела, поэтому ETag сильный: другое тело — другой id
+        return f'"{self.result_id}"'
+
+    @property
+    def location(self) -> str:
+        return f"/results/{self.kind}/{self.result_id}"
+
+
+class ResultJob(NamedTuple):
+    job_id: str
+    kind: str
+    # Идентификатор готового результата (None, пока вычисление идет или если оно не удалось)
+    result_id: Optional[str]
+    error: Optional[str]
+    finished: Optional[float]
+
+    @property
+    def location(self) -> str:
+        return f"/jobs/{self.job_id}"
+
+
+def serialize_result(data) -> bytes:
+    """
+    Сериализация как у JSONResponse FastAPI: тот же ответ, что и раньше, байт в байт
+    """
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+class ResultStore:
+    """
+    Результаты, адресуемые хэшем содержимого, вместе с заранее сжатыми
+    вариантами: повторная отдача не тратит CPU на сериализацию и сжатие.
+    """
+    def __init__(self, path: str = RESULT_STORE_PATH, max_bytes: int = RESULT_STORE_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # Отдельное соединение на операцию: безопасно для потоков и после fork
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def put(self, kind: str, data) -> StoredResult:
+        """
+        Сохраняет результат и возвращает его идентификатор и ETag
+        """
+        body = serialize_result(data)
+        result_id = hashlib.sha256(body).hexdigest()[:32]
+        encoded = {encoding: compress(body, encoding) for encoding in supported_encodings()}
+        size = len(body) + sum(len(value) for value in encoded.values())
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO results (kind, result_id, body, gzip, br, size, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (kind, result_id, body, encoded.get("gzip"), encoded.get("br"), size, time.time())
+            )
+            self._evict(connection)
+        return StoredResult(kind, result_id, body)
+
+    def get(self, kind: str, result_id: str, encoding: str = None) -> Optional[tuple]:
+        """
+        Возвращает (StoredResult, тело в кодировке encoding или None, если такого варианта нет)
+        """
+        column = encoding if encoding in ("gzip", "br") else "body"
+        with self._connect() as connection:
+            row = connection.execute(
+                f"SELECT body, {column} FROM results WHERE kind = ? AND result_id = ?", (kind, result_id)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE results SET last_access = ? WHERE kind = ? AND result_id = ?",
+                (time.time(), kind, result_id)
+            )
+        body, encoded = row
+        return StoredResult(kind, result_id, body), (encoded if column != "body" else None)
+
+    def latest_version(self, source: str, kind: str) -> Optional[str]:
+        """
+        Последний результат, полученный для источника (S3 ключ документа и выборка страниц)
+        """
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT v.result_id FROM versions v JOIN results r "
+                "ON r.kind = v.kind AND r.result_id = v.result_id "
+                "WHERE v.source = ? AND v.kind = ?", (source, kind)
+            ).fetchone()
+        return row[0] if row else None
+
+    def latest_results(self) -> Iterator[tuple]:
+        """
+        (источник, вид, идентификатор, тело) последних версий всех документов
+        """
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT v.source, v.kind, v.result_id, r.body FROM versions v JOIN results r "
+                "ON r.kind = v.kind AND r.result_id = v.result_id"
+            ).fetchall()
+        yield from rows
+
+    def set_latest_version(self, source: str, kind: str, result_id: str):
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO versions (source, kind, result_id, created) VALUES (?, ?, ?, ?)",
+                (source, kind, result_id, time.time())
+            )
+
+    def get_fragments(self, fragment_keys: Iterable[str]) -> Dict[str, dict]:
+        """
+        Фрагменты сводки (UI JSON групп страниц) по ключам из summary_fragments.py
+        """
+        fragment_keys = list(set(fragment_keys))
+        if not fragment_keys:
+            return {}
+        placeholders = ','.join('?' * len(fragment_keys))
+        with self._connect() as connection:
+            rows = connection.execute(
+                f"SELECT fragment_key, body FROM fragments WHERE fragment_key IN ({placeholders})", fragment_keys
+            ).fetchall()
+            connection.execute(
+                f"UPDATE fragments SET last_access = ? WHERE fragment_key IN ({placeholders})",
+                (time.time(), *fragment_keys)
+            )
+        return {fragment_key: json.loads(body) for fragment_key, body in rows}
+
+    def put_fragment(self, fragment_key: str, data):
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO fragments (fragment_key, body, last_access) VALUES (?, ?, ?)",
+                (fragment_key, serialize_result(data), time.time())
+            )
+            self._evict(connection)
+
+    def create_job(self, kind: str) -> ResultJob:
+        """
+        Запись о результате, который еще вычисляется в фоне. Хранилище общее для
+        воркеров, поэтому статус можно запросить у любого из них.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute("DELETE FROM jobs WHERE created < ?", (now - RESULT_JOB_TTL,))
+            connection.execute("INSERT INTO jobs (job_id, kind, created) VALUES (?, ?, ?)", (job_id, kind, now))
+        return ResultJob(job_id, kind, None, None, None)
+
+    def finish_job(self, job_id: str, result_id: Optional[str] = None, error: Optional[str] = None):
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET result_id = ?, error = ?, finished = ? WHERE job_id = ?",
+                (result_id, error, time.time(), job_id)
+            )
+
+    def get_job(self, job_id: str) -> Optional[ResultJob]:
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT job_id, kind, result_id, error, finished FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return ResultJob(*row) if row is not None else None
+
+    def exists(self, kind: str, result_id: str) -> bool:
+        with self._connect() as connection:
+            return connection.execute(
+                "SELECT 1 FROM results WHERE kind = ? AND result_id = ?", (kind, result_id)
+            ).fetchone() is not None
+
+    def existing(self, keys: Iterable[tuple]) -> set:
+        """
+        Какие из пар (вид, идентификатор) еще есть в хранилище
+        """
+        keys = list(set(keys))
+        if not keys:
+            return set()
+        placeholders = ','.join('(?, ?)' for _ in keys)
+        with self._connect() as connection:
+            rows = connection.execute(
+                f"SELECT kind, result_id FROM results WHERE (kind, result_id) IN (VALUES {placeholders})",
+                [value for key in keys for value in key]
+            ).fetchall()
+        return {tuple(row) for row in rows}
+
+    def _evict(self, connection: sqlite3.Connection):
+        # Результаты и фрагменты сводок делят один бюджет и удаляются по давности обращения
+        total = connection.execute(
+            "SELECT (SELECT COALESCE(SUM(size), 0) FROM results) "
+            "+ (SELECT COALESCE(SUM(LENGTH(body)), 0) FROM fragments)"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for kind, key, size, _ in connection.execute(
+            "SELECT kind, result_id, size, last_access FROM results "
+            "UNION ALL SELECT NULL, fragment_key, LENGTH(body), last_access FROM fragments "
+            "ORDER BY last_access"
+        ).fetchall():
+            if kind is None:
+                connection.execute("DELETE FROM fragments WHERE fragment_key = ?", (key,))
+                print(f"Result store: evicted fragment {key} ({size} bytes)")
+            else:
+                connection.execute("DELETE FROM results WHERE kind = ? AND result_id = ?", (kind, key))
+                connection.execute("DELETE FROM versions WHERE kind = ? AND result_id = ?", (kind, key))
+                print(f"Result store: evicted {kind}/{key} ({size} bytes)")
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+_result_store: Optional[ResultStore] = None
+
+
+def get_result_store() -> ResultStore:
+    """
+    Общее хранилище результатов процесса (создается при первом обращении)
+    """
+    global _result_store
+    if _result_store is None:
+        _result_store = ResultStore()
+    return _result_store
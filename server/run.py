@@ -1,17 +1,115 @@
+import argparse
+import multiprocessing
+
 import uvicorn
 from uvicorn.config import Config
+from decouple import config
 
-if __name__ == "__main__":
+# Настройки таймаутов общие для dev и production режимов
+TIMEOUT_KEEP_ALIVE = 300        # Увеличиваем таймаут keep-alive до 300 секунд
+TIMEOUT_GRACEFUL_SHUTDOWN = 330 # Увеличиваем таймаут graceful shutdown до 330 секунд
+H11_MAX_INCOMPLETE_EVENT_SIZE = 65536  # Увеличиваем максимальный размер буфера для HTTP событий
+WS_PING_INTERVAL = 300.0        # Увеличиваем интервал пинга WebSocket до 300 секунд
+WS_PING_TIMEOUT = 300.0         # Увеличиваем таймаут пинга WebSocket до 300 секунд
+# Crew и разбор PDF выполняются в потоках (asyncio.to_thread), цикл событий
+# воркера не блокируется на время работы с LLM и продолжает отвечать мастеру.
+# Таймаут покрывает только синхронные шаги в цикле событий (хранилища SQLite,
+# сериализация результатов) с запасом и не зависит от длительности запросов
+WORKER_TIMEOUT = 120
+
+
+def run_dev(host: str, port: int):
     config = Config(
         "api:app",
-        host="0.0.0.0",
-        port=8000,
+        host=host,
+        port=port,
         reload=True,
-        timeout_keep_alive=300,        # Увеличиваем таймаут keep-alive до 300 секунд
-        timeout_graceful_shutdown=330, # Увеличиваем таймаут graceful shutdown до 120 секунд
-        h11_max_incomplete_event_size=65536,  # Увеличиваем максимальный размер буфера для HTTP событий
-        ws_ping_interval=300.0,         # Увеличиваем интервал пинга WebSocket до 30 секунд
-        ws_ping_timeout=300.0,          # Увеличиваем таймаут пинга WebSocket до 30 секунд
+        timeout_keep_alive=TIMEOUT_KEEP_ALIVE,
+        timeout_graceful_shutdown=TIMEOUT_GRACEFUL_SHUTDOWN,
+        h11_max_incomplete_event_size=H11_MAX_INCOMPLETE_EVENT_SIZE,
+        ws_ping_interval=WS_PING_INTERVAL,
+        ws_ping_timeout=WS_PING_TIMEOUT,
     )
     server = uvicorn.Server(config)
-    server.run() 
\ No newline at end of file
+    server.run()
+
+
+def run_prod(host: str, port: int, workers: int, max_requests: int, max_requests_jitter: int,
+             graceful_timeout: int, worker_timeout: int):
+    """
+    Production режим: gunicorn мастер-процесс с uvicorn воркерами.
+
+    Приложение и тяжелые зависимости загружаются в мастере до fork (preload_app),
+    воркеры перезапускаются после max_requests запросов, а при остановке
+    дорабатывают текущие запросы в течение graceful_timeout секунд. Воркер, не
+    отвечающий мастеру дольше worker_timeout секунд, считается зависшим и перезапускается.
+    """
+    from gunicorn.app.base import BaseApplication
+    from uvicorn.workers import UvicornWorker
+    import preload
+
+    class QysqaUvicornWorker(UvicornWorker):
+        CONFIG_KWARGS = {
+            "loop": "auto",
+            "http": "auto",
+            "timeout_graceful_shutdown": graceful_timeout,
+            "h11_max_incomplete_event_size": H11_MAX_INCOMPLETE_EVENT_SIZE,
+            "ws_ping_interval": WS_PING_INTERVAL,
+            "ws_ping_timeout": WS_PING_TIMEOUT,
+        }
+
+    class ProductionApplication(BaseApplication):
+        def __init__(self, options: dict):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return preload.preload()
+
+    def post_fork(server, worker):
+        preload.after_fork()
+
+    ProductionApplication({
+        "bind": f"{host}:{port}",
+        "workers": workers,
+        "worker_class": QysqaUvicornWorker,
+        "preload_app": True,
+        "max_requests": max_requests,
+        "max_requests_jitter": max_requests_jitter,
+        "graceful_timeout": graceful_timeout,
+        # Воркер с остановившимся циклом событий перезапускается через worker_timeout
+        "timeout": worker_timeout,
+        "keepalive": TIMEOUT_KEEP_ALIVE,
+        "post_fork": post_fork,
+    }).run()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Запуск API сервера")
+    parser.add_argument("--prod", action="store_true",
+                        help="production режим: несколько воркеров с предзагрузкой до fork")
+    parser.add_argument("--host", default=config('HOST', default="0.0.0.0"))
+    parser.add_argument("--port", type=int, default=config('PORT', default=8000, cast=int))
+    parser.add_argument("--workers", type=int,
+                        default=config('WEB_CONCURRENCY', default=multiprocessing.cpu_count(), cast=int))
+    parser.add_argument("--max-requests", type=int,
+                        default=config('MAX_REQUESTS', default=500, cast=int),
+                        help="перезапуск воркера после N запросов (0 — без перезапуска)")
+    parser.add_argument("--max-requests-jitter", type=int,
+                        default=config('MAX_REQUESTS_JITTER', default=50, cast=int))
+    parser.add_argument("--graceful-timeout", type=int,
+                        default=config('GRACEFUL_TIMEOUT', default=TIMEOUT_GRACEFUL_SHUTDOWN, cast=int))
+    parser.add_argument("--worker-timeout", type=int,
+                        default=config('WORKER_TIMEOUT', default=WORKER_TIMEOUT, cast=int),
+                        help="через сколько секунд без ответа воркер считается зависшим")
+    args = parser.parse_args()
+
+    if args.prod:
+        run_prod(args.host, args.port, args.workers, args.max_requests,
+                 args.max_requests_jitter, args.graceful_timeout, args.worker_timeout)
+    else:
+        run_dev(args.host, args.port)
@@ -0,0 +1,257 @@
+import html
+import json
+import os
+import re
+import sqlite3
+from contextlib import contextmanager
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from decouple import config
+
+from result_store import get_result_store
+
+# Полнотекстовый поиск по сохраненным сводкам и тестам: какой лекции
+# посвящена тема. Индекс — таблица SQLite FTS5, одна строка на текстовый
+# узел UI JSON (заголовки разделов, htmltext) и на вопрос теста (вопрос и
+# варианты ответов). Для каждого документа индексируется последняя версия
+# результата.
+SEARCH_INDEX_PATH = config(
+    'SEARCH_INDEX_PATH',
+    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'search_index.sqlite3')
+)
+SEARCH_MAX_RESULTS = config('SEARCH_MAX_RESULTS', default=50, cast=int)
+# Сколько совпавших узлов возвращается для одного документа
+SEARCH_MATCHES_PER_RESULT = config('SEARCH_MATCHES_PER_RESULT', default=5, cast=int)
+
+# unicode61 приводит к нижнему регистру кириллицу, включая казахские буквы
+# (ә, ғ, қ, ң, ө, ұ, ү, һ, і), и убирает диакритику латиницы. Стеммеров для
+# русского и казахского в SQLite нет, поэтому слова запроса ищутся по
+# префиксу: «алгоритм» находит «алгоритмы», «қазақ» — «қазақстан».
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS search_nodes USING fts5(
+    text,
+    kind UNINDEXED,
+    result_id UNINDEXED,
+    source UNINDEXED,
+    node_id UNINDEXED,
+    field UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+TAG = re.compile(r"<[^>]+>")
+WORD = re.compile(r"\w+")
+# Разметка совпадений во фрагментах текста. Индексируется текст без тегов, но
+# в нем может быть экранированная разметка («&lt;b&gt;» в htmltext), поэтому
+# snippet размечает совпадения символами из области частного использования,
+# а в HTML они заменяются уже после экранирования фрагмента
+MATCH_START = "<mark>"
+MATCH_END = "</mark>"
+SNIPPET_START = "\ue000"
+SNIPPET_END = "\ue001"
+
+
+class SearchMatch(NamedTuple):
+    # id узла UI JSON или JSON Pointer вопроса теста ("/questionCreateRequests/3")
+    node_id: str
+    # title, text, question или variant
+    field: str
+    snippet: str
+
+
+class SearchResult(NamedTuple):
+    kind: str
+    result_id: str
+    # Документ, по которому построен результат (S3 ключ и выбранные страницы)
+    source: str
+    matches: List[SearchMatch]
+
+    @property
+    def location(self) -> str:
+        return f"/results/{self.kind}/{self.result_id}"
+
+
+def normalize(text: str) -> str:
+    # «ё» и «е» в русских текстах взаимозаменяемы, а unicode61 их различает
+    return text.replace("ё", "е").replace("Ё", "Е")
+
+
+def plain_text(value) -> str:
+    if not isinstance(value, str):
+        return ""
+    text = html.unescape(TAG.sub(" ", value)).replace(SNIPPET_START, "").replace(SNIPPET_END, "")
+    return normalize(" ".join(text.split()))
+
+
+def summary_rows(node) -> Iterator[Tuple[str, str, str]]:
+    """
+    (id узла, поле, текст) для текстовых узлов UI JSON. Заголовок раздела
+    индексируется под id раздела (TITLED_CONTAINER), крупный текст — как заголовок.
+    """
+    if isinstance(node, list):
+        for child in node:
+            yield from summary_rows(child)
+        return
+    if not isinstance(node, dict):
+        return
+    node_type = node.get("nodeType")
+    if node_type == "TITLED_CONTAINER":
+        title = node.get("titleText")
+        if isinstance(title, dict):
+            yield node.get("id", ""), "title", plain_text(title.get("htmltext"))
+        yield from summary_rows(node.get("content"))
+        return
+    if node_type == "TEXT":
+        field = "title" if node.get("fontSize") == "BIG" else "text"
+        yield node.get("id", ""), field, plain_text(node.get("htmltext"))
+        return
+    for key, value in node.items():
+        if isinstance(value, (dict, list)):
+            yield from summary_rows(value)
+
+
+def test_rows(test: dict) -> Iterator[Tuple[str, str, str]]:
+    """
+    (JSON Pointer, поле, текст) для названия теста, вопросов и вариантов ответов
+    """
+    if not isinstance(test, dict):
+        return
+    yield "", "title", plain_text(" ".join(str(test.get(key) or "") for key in ("title", "description")))
+    for i, request in enumerate(test.get("questionCreateRequests") or []):
+        question = (request or {}).get("questionCreate") or {}
+        pointer = f"/questionCreateRequests/{i}"
+        yield pointer, "question", plain_text(question.get("question"))
+        variants = [variant.get("text") for variant in question.get("variants") or [] if isinstance(variant, dict)]
+        yield pointer, "variant", plain_text(" ".join(str(text or "") for text in variants))
+
+
+def snippet_html(snippet: str) -> str:
+    return html.escape(snippet, quote=False).replace(SNIPPET_START, MATCH_START).replace(SNIPPET_END, MATCH_END)
+
+
+def match_query(query: str) -> Optional[str]:
+    """
+    Запрос FTS5 из слов пользователя: все слова по префиксу (операторы FTS5 не
+    передаются). None — в запросе нет слов.
+    """
+    words = WORD.findall(normalize(query))
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+class SearchIndex:
+    """
+    Индекс FTS5 текстов сводок и тестов. Отдельное соединение на операцию,
+    как в остальных хранилищах.
+    """
+    def __init__(self, path: str = SEARCH_INDEX_PATH):
+        self.path = path
+        with self._connect() as connection:
+            self.created = connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'search_nodes'"
+            ).fetchone() is None
+            connection.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def index_result(self, kind: str, result_id: str, source: str, data):
+        """
+        Индексирует результат, заменяя предыдущую версию того же документа
+        """
+        rows = summary_rows(data) if kind == "summary" else test_rows(data)
+        values = [(text, kind, result_id, source, node_id, field) for node_id, field, text in rows if text]
+        with self._connect() as connection:
+            if source:
+                connection.execute("DELETE FROM search_nodes WHERE source = ? AND kind = ?", (source, kind))
+            else:
+                connection.execute("DELETE FROM search_nodes WHERE result_id = ? AND kind = ?", (result_id, kind))
+            connection.executemany(
+                "INSERT INTO search_nodes (text, kind, result_id, source, node_id, field) VALUES (?, ?, ?, ?, ?, ?)",
+                values
+            )
+
+    def search(self, query: str, kind: Optional[str] = None, limit: int = 20) -> List[SearchResult]:
+        """
+        Документы, в узлах которых есть все слова запроса, в порядке релевантности (BM25)
+        лучшего совпавшего узла
+        """
+        expression = match_query(query)
+        if expression is None:
+            return []
+        sql = ("SELECT kind, result_id, source, node_id, field, "
+               f"snippet(search_nodes, 0, '{SNIPPET_START}', '{SNIPPET_END}', '…', 16) "
+               "FROM search_nodes WHERE search_nodes MATCH ?")
+        params = [expression]
+        if kind:
+            sql += " AND kind = ?"
+            params.append(kind)
+        sql += " ORDER BY bm25(search_nodes) LIMIT ?"
+        params.append(limit * SEARCH_MATCHES_PER_RESULT)
+        with self._connect() as connection:
+            rows = connection.execute(sql, params).fetchall()
+
+        # Результаты, вытесненные из хранилища, в выдачу не попадают, а их
+        # строки удаляются из индекса
+        found = {(row[0], row[1]) for row in rows}
+        present = get_result_store().existing(found)
+        if found - present:
+            self.remove_results(found - present)
+
+        results = {}
+        for row_kind, result_id, source, node_id, field, snippet in rows:
+            key = (row_kind, result_id)
+            if key not in present:
+                continue
+            if key not in results:
+                if len(results) >= limit:
+                    continue
+                results[key] = SearchResult(row_kind, result_id, source, [])
+            matches = results[key].matches
+            if len(matches) < SEARCH_MATCHES_PER_RESULT:
+                matches.append(SearchMatch(node_id, field, snippet_html(snippet)))
+        return list(results.values())
+
+    def remove_results(self, keys):
+        """
+        Удаляет из индекса строки результатов (вид, идентификатор)
+        """
+        with self._connect() as connection:
+            connection.executemany("DELETE FROM search_nodes WHERE kind = ? AND result_id = ?", list(keys))
+
+    def index_stored_results(self, store) -> int:
+        """
+        Индексирует последние версии результатов из хранилища (сохраненные до появления индекса)
+        """
+        count = 0
+        for source, kind, result_id, body in store.latest_results():
+            try:
+                self.index_result(kind, result_id, source, json.loads(body))
+                count += 1
+            except (ValueError, sqlite3.Error) as e:
+                print(f"Error indexing {kind}/{result_id}: {str(e)}")
+        return count
+
+
+_search_index: Optional[SearchIndex] = None
+
+
+def get_search_index() -> SearchIndex:
+    """
+    Общий индекс процесса (создается при первом обращении; новый индекс
+    заполняется результатами, уже лежащими в хранилище)
+    """
+    global _search_index
+    if _search_index is None:
+        index = SearchIndex()
+        if index.created:
+            print(f"Search index created, indexed {index.index_stored_results(get_result_store())} stored results")
+        _search_index = index
+    return _search_index
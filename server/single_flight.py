@@ -0,0 +1,72 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable
+
+from decouple import config
+
+# Что делать с ожидающими дубликатами, если запрос-лидер отменен
+# (клиент отключился, воркер останавливается):
+#   wait   — общая работа продолжается, дубликаты получают результат
+#   cancel — общая работа отменяется вместе с лидером, дубликаты получают ошибку
+# Если отменены все ожидающие запросы, общая работа отменяется при любой политике.
+CANCEL_POLICY_WAIT = "wait"
+CANCEL_POLICY_CANCEL = "cancel"
+DEFAULT_CANCEL_POLICY = config('SINGLE_FLIGHT_CANCEL_POLICY', default=CANCEL_POLICY_WAIT)
+
+
+class LeaderCancelledError(Exception):
+    """
+    Общая работа отменена вместе с запросом-лидером (политика cancel)
+    """
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых одновременных запросов.
+
+    Первый запрос с данным ключом (лидер) выполняет работу, остальные
+    запросы с тем же ключом, пришедшие до ее завершения, ждут тот же результат
+    (или то же исключение). После завершения ключ освобождается: результат
+    не кэшируется. Работа, результат которой больше никто не ждет, отменяется.
+    """
+    def __init__(self, cancel_policy: str = DEFAULT_CANCEL_POLICY):
+        if cancel_policy not in (CANCEL_POLICY_WAIT, CANCEL_POLICY_CANCEL):
+            raise ValueError(f"Unknown single-flight cancel policy: {cancel_policy}")
+        self.cancel_policy = cancel_policy
+        self._tasks: Dict[Hashable, asyncio.Future] = {}
+        # Число запросов, ожидающих каждую общую работу
+        self._waiters: Dict[asyncio.Future, int] = {}
+
+    async def run(self, key: Hashable, func: Callable[[], Awaitable], on_join: Callable[[bool], None] = None):
+        """
+        Выполняет func() один раз для всех одновременных вызовов с ключом key
+
+        Args:
+            key: Ключ запроса (документ и параметры эндпоинта)
+            func: Функция, возвращающая корутину с работой
+            on_join: Вызывается с is_leader=True/False при входе запроса
+
+        Returns:
+            Результат func()
+        """
+        task = self._tasks.get(key)
+        is_leader = task is None
+        if is_leader:
+            task = self._tasks[key] = asyncio.ensure_future(func())
+            task.add_done_callback(lambda done: self._tasks.pop(key) if self._tasks.get(key) is done else None)
+        if on_join is not None:
+            on_join(is_leader)
+
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            # shield: отмена одного ожидающего запроса не отменяет общую работу
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if task.cancelled() and not is_leader:
+                raise LeaderCancelledError("Request was cancelled together with the identical leading request")
+            if (is_leader and self.cancel_policy == CANCEL_POLICY_CANCEL) or self._waiters[task] == 1:
+                task.cancel()
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
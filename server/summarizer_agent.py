@@ -1,5 +1,5 @@
 from crewai import Agent
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Sequence, Tuple
 import json
 import re
 import uuid
@@ -9,6 +9,18 @@ from langchain_openai import OpenAIEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
 import os
+import threading
+from collections import OrderedDict
+
+from llm_governor import get_http_client
+
+class NodeType(str, Enum):
+    TEXT = "TEXT"
+    ICON_TEXT = "ICON_TEXT"
+    TITLED_CONTAINER = "TITLED_CONTAINER"
+    CENTERED_CONTAINER = "CENTERED_CONTAINER"
+    IMAGE = "IMAGE"
+    STACK = "STACK"
 
 class FontSize(str, Enum):
     BIG = "BIG"
@@ -79,29 +91,125 @@ class Icon(str, Enum):
     LEAF = "🌿"
     PRAY = "🙏"
 
-class SummarizerAgent:
-    def __init__(self):
-        # Загружаем и подготавливаем базу знаний
-        with open('json_format.md', 'r', encoding='utf-8') as f:
-            format_guide = f.read()
-
-        # Создаем текстовый сплиттер
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
-        )
-
-        # Разбиваем документ на чанки
-        texts = text_splitter.create_documents([format_guide])
+FORMAT_GUIDE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'json_format.md')
+
+# База знаний по формату JSON только читается, поэтому она общая для всех
+# экземпляров SummarizerAgent и строится один раз на процесс (или в мастер-процессе
+# до fork, см. preload.py)
+_format_guide = None
+_knowledge_base = None
+_knowledge_base_lock = threading.Lock()
+
+# Запросы к базе знаний, которые выполняются для каждого документа
+FORMATTING_QUERIES = (
+    "layout and styling properties",
+    "text formatting and attributes",
+    "container specifications",
+)
+
+# Результаты поиска по базе знаний: (запрос, k) -> контекст. База знаний не
+# меняется в течение жизни процесса, поэтому результаты можно не пересчитывать
+MAX_CONTEXT_CACHE_SIZE = 256
+_context_cache: "OrderedDict[Tuple[str, int], str]" = OrderedDict()
+_context_cache_lock = threading.Lock()
+
+def create_embeddings() -> OpenAIEmbeddings:
+    """
+    Создает клиент эмбеддингов с явным указанием API ключа
+    """
+    return OpenAIEmbeddings(
+        model="text-embedding-ada-002",
+        openai_api_key=os.getenv("OPENAI_API_KEY"),
+        # Повторы и ограничение нагрузки выполняет общий регулятор
+        http_client=get_http_client(),
+        max_retries=0
+    )
+
+def create_text_splitter() -> RecursiveCharacterTextSplitter:
+    """
+    Создает сплиттер, которым документы режутся на чанки для FAISS
+    """
+    return RecursiveCharacterTextSplitter(
+        chunk_size=1000,
+        chunk_overlap=200,
+        length_function=len,
+    )
+
+def load_format_guide() -> str:
+    """
+    Возвращает текст json_format.md (читается с диска один раз)
+    """
+    global _format_guide
+    if _format_guide is None:
+        with open(FORMAT_GUIDE_PATH, 'r', encoding='utf-8') as f:
+            _format_guide = f.read()
+    return _format_guide
+
+def get_knowledge_base() -> FAISS:
+    """
+    Возвращает общее векторное хранилище базы знаний, создавая его при первом обращении
+    """
+    global _knowledge_base
+    if _knowledge_base is None:
+        with _knowledge_base_lock:
+            if _knowledge_base is None:
+                # Разбиваем документ на чанки
+                texts = create_text_splitter().create_documents([load_format_guide()])
+
+                # Создаем векторное хранилище
+                _knowledge_base = FAISS.from_documents(texts, create_embeddings())
+    return _knowledge_base
+
+def get_relevant_contexts(queries: Sequence[str], k: int = 3) -> List[str]:
+    """
+    Возвращает контекст из базы знаний для нескольких запросов сразу.
+
+    Запросы, которых еще нет в кэше, эмбеддятся одним обращением к API
+    (embed_documents), после чего поиск в FAISS выполняется по готовым векторам.
+
+    Args:
+        queries: Тексты запросов
+        k: Количество чанков на запрос
+
+    Returns:
+        List[str]: Контекст для каждого запроса в том же порядке
+    """
+    contexts = {}
+    with _context_cache_lock:
+        for query in dict.fromkeys(queries):
+            context = _context_cache.get((query, k))
+            if context is not None:
+                _context_cache.move_to_end((query, k))
+                contexts[query] = context
+
+    missing = [query for query in dict.fromkeys(queries) if query not in contexts]
+    if missing:
+        knowledge_base = get_knowledge_base()
+        vectors = knowledge_base.embedding_function.embed_documents(missing)
+        for query, vector in zip(missing, vectors):
+            relevant_docs = knowledge_base.similarity_search_by_vector(vector, k=k)
+            contexts[query] = "\n".join(doc.page_content for doc in relevant_docs)
+        with _context_cache_lock:
+            for query in missing:
+                _context_cache[(query, k)] = contexts[query]
+            while len(_context_cache) > MAX_CONTEXT_CACHE_SIZE:
+                _context_cache.popitem(last=False)
+
+    return [contexts[query] for query in queries]
+
+def reset_embeddings_client():
+    """
+    Пересоздает HTTP клиент эмбеддингов у общей базы знаний.
+
+    Вызывается в рабочем процессе после fork: соединения из пула, открытые
+    в мастер-процессе при построении индекса, нельзя делить между процессами.
+    Сам индекс FAISS остается общим (copy-on-write).
+    """
+    if _knowledge_base is not None:
+        _knowledge_base.embedding_function = create_embeddings()
 
-        # Создаем векторное хранилище с явным указанием API ключа
-        embeddings = OpenAIEmbeddings(
-            model="text-embedding-ada-002",
-            openai_api_key=os.getenv("OPENAI_API_KEY")
-        )
-        self.knowledge_base = FAISS.from_documents(texts, embeddings)
-            
+class SummarizerAgent:
+    def __init__(self, verbose: bool = True):
         self.agent = Agent(
             role='UI Content Generator',
             goal='Generate well-structured UI content in JSON format based on the provided text. Use the following format: ',
@@ -209,13 +317,18 @@ Defines text alignment options:
 * The `@JsonTypeInfo` and `@JsonSubTypes` annotations are used to handle serialization and deserialization of polymorphic objects, allowing for different types of `BaseNode` (such as `Stack`, `Text`, `IconText`, etc.) to be recognized and properly mapped when working with JSON.
 ''',
             allow_delegation=False,
-            verbose=True
+            verbose=verbose
         )
 
+    @property
+    def knowledge_base(self) -> FAISS:
+        # Общая база знаний вместо построения эмбеддингов на каждый запрос. Берется
+        # при обращении: локальной сборке UI JSON (generate_ui_json) она не нужна
+        return get_knowledge_base()
+
     def get_relevant_context(self, query: str) -> str:
         # Получаем релевантные куски из базы знаний
-        relevant_docs = self.knowledge_base.similarity_search(query, k=3)
-        return "\n".join(doc.page_content for doc in relevant_docs)
+        return get_relevant_contexts([query])[0]
 
     def generate_unique_id(self) -> str:
         return str(uuid.uuid4())
@@ -463,9 +576,7 @@ Defines text alignment options:
         Обрабатывает контент с использованием RAG для определения структуры и форматирования.
         """
         # Получаем контекст для разных аспектов форматирования
-        layout_context = self.get_relevant_context("layout and styling properties")
-        text_formatting = self.get_relevant_context("text formatting and attributes")
-        container_specs = self.get_relevant_context("container specifications")
+        layout_context, text_formatting, container_specs = get_relevant_contexts(FORMATTING_QUERIES)
 
         # Используем полученный контекст для принятия решений о форматировании
         # Это поможет нам генерировать JSON в точном соответствии с документацией
@@ -504,6 +615,3 @@ Defines text alignment options:
         with open(output_file, 'w', encoding='utf-8') as f:
             json.dump(ui_json, f, ensure_ascii=False, indent=2)
         return output_file
-
-# Create instance
-summarizer_agent = SummarizerAgent() 
\ No newline at end of file
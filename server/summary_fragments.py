@@ -0,0 +1,93 @@
+import hashlib
+from typing import Dict, List
+
+from decouple import config
+
+# Сводка по частям: страницы делятся на группы, сводка каждой группы (фрагмент)
+# сохраняется по хэшу текста ее страниц. При повторной обработке того же или
+# измененного документа LLM получает только новые группы, остальные берутся
+# из хранилища результатов и склеиваются в одно UI дерево.
+
+# Средний и максимальный размер группы страниц
+SUMMARY_FRAGMENT_PAGES = config('SUMMARY_FRAGMENT_PAGES', default=3, cast=int)
+SUMMARY_FRAGMENT_MAX_PAGES = config('SUMMARY_FRAGMENT_MAX_PAGES', default=6, cast=int)
+# Меняется вместе с промптом или моделью сводки, чтобы не склеивать фрагменты разных версий
+SUMMARY_FRAGMENT_VERSION = config('SUMMARY_FRAGMENT_VERSION', default='1')
+# Сколько фрагментов генерируется одновременно: каждый фрагмент — crew в
+# потоке пула asyncio.to_thread, который нужен и остальным запросам
+SUMMARY_FRAGMENT_CONCURRENCY = config('SUMMARY_FRAGMENT_CONCURRENCY', default=4, cast=int)
+
+
+def group_pages(page_keys: List[str]) -> List[List[int]]:
+    """
+    Делит страницы на группы по их содержимому.
+
+    Группа заканчивается на странице, хэш которой делится на SUMMARY_FRAGMENT_PAGES
+    (или по достижении SUMMARY_FRAGMENT_MAX_PAGES). Границы зависят только от самих
+    страниц, а не от их номеров, поэтому вставка или удаление слайда меняет одну
+    группу, а не сдвигает все последующие.
+
+    Args:
+        page_keys (List[str]): Хэши текста страниц (hex) в порядке следования
+
+    Returns:
+        List[List[int]]: Позиции страниц в page_keys по группам
+    """
+    groups: List[List[int]] = []
+    current: List[int] = []
+    for position, page_key in enumerate(page_keys):
+        current.append(position)
+        if int(page_key[:8], 16) % SUMMARY_FRAGMENT_PAGES == 0 or len(current) >= SUMMARY_FRAGMENT_MAX_PAGES:
+            groups.append(current)
+            current = []
+    if current:
+        groups.append(current)
+    return groups
+
+
+def fragment_key(page_keys: List[str]) -> str:
+    """
+    Ключ фрагмента: хэши текста страниц группы и версия фрагментов
+    """
+    digest = hashlib.sha256(f"v{SUMMARY_FRAGMENT_VERSION}".encode("utf-8"))
+    for page_key in page_keys:
+        digest.update(page_key.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _rename_duplicate_ids(value, seen: Dict[str, int]):
+    if isinstance(value, dict):
+        node_id = value.get("id")
+        if isinstance(node_id, str):
+            if node_id in seen:
+                base = node_id
+                while node_id in seen:
+                    seen[base] += 1
+                    node_id = f"{base}-{seen[base]}"
+                value["id"] = node_id
+            seen[node_id] = 0
+        for item in value.values():
+            _rename_duplicate_ids(item, seen)
+    elif isinstance(value, list):
+        for item in value:
+            _rename_duplicate_ids(item, seen)
+
+
+def stitch_fragments(fragments: List[dict]) -> dict:
+    """
+    Склеивает фрагменты в одно UI дерево: корневой STACK с фрагментами по порядку.
+
+    Фрагменты генерировались независимо, поэтому повторяющиеся id (LLM часто
+    называет корни одинаково) получают суффикс — id в дереве должны быть уникальны.
+    Фрагменты изменяются на месте.
+    """
+    seen: Dict[str, int] = {"main-stack": 0}
+    for fragment in fragments:
+        _rename_duplicate_ids(fragment, seen)
+    return {
+        "nodeType": "STACK",
+        "id": "main-stack",
+        "vertical": True,
+        "gap": 32,
+        "children": fragments,
+    }
@@ -20,7 +20,7 @@ class TestQuestion:
         }
 
 class TestGeneratorAgent:
-    def __init__(self):
+    def __init__(self, verbose: bool = True):
         self.agent = Agent(
             role='Test Generator',
             goal='Generate multiple-choice test questions based on the provided content',
@@ -29,7 +29,7 @@ class TestGeneratorAgent:
             understanding of key concepts. Each question should have 4 options with only one correct answer.
             The incorrect options should be plausible but clearly wrong upon careful consideration.""",
             allow_delegation=False,
-            verbose=True
+            verbose=verbose
         )
 
     def generate_test_json(self, content: str, num_questions: int = 5) -> Dict[str, Any]:
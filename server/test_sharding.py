@@ -0,0 +1,158 @@
+import math
+import re
+from typing import Dict, List, NamedTuple, Sequence
+
+from decouple import config, Csv
+
+from document_index import HEADING_PATTERNS
+
+# Большие тесты генерируются по частям: документ делится на разделы, каждая
+# часть (шард) получает вопросы пропорционально длине своих разделов и
+# генерируется отдельным crew параллельно с остальными. Результаты
+# объединяются с удалением повторяющихся вопросов.
+
+# Сколько вопросов генерирует один шард и сколько шардов запускается максимум
+TEST_SHARD_QUESTIONS = config('TEST_SHARD_QUESTIONS', default=10, cast=int)
+TEST_MAX_SHARDS = config('TEST_MAX_SHARDS', default=8, cast=int)
+TEST_MAX_QUESTIONS = config('TEST_MAX_QUESTIONS', default=200, cast=int)
+# Доли уровней сложности вопросов (уровень:доля)
+TEST_LEVEL_MIX = config('TEST_LEVEL_MIX', default='EASY:0.3,MEDIUM:0.5,HARD:0.2', cast=Csv())
+# Запас вопросов сверх квоты шарда: часть отсеется как повторы
+TEST_SHARD_OVERSHOOT = config('TEST_SHARD_OVERSHOOT', default=0.2, cast=float)
+# Вопросы с такой долей общих слов считаются повтором
+TEST_DEDUP_SIMILARITY = config('TEST_DEDUP_SIMILARITY', default=0.8, cast=float)
+
+WORD = re.compile(r"\w+")
+
+
+class TestShard(NamedTuple):
+    # Текст разделов документа, по которым генерируются вопросы шарда
+    text: str
+    # Сколько вопросов шарда войдет в тест
+    quota: int
+    # Сколько вопросов каждого уровня запросить у LLM (с запасом)
+    levels: Dict[str, int]
+
+    @property
+    def requested(self) -> int:
+        return sum(self.levels.values())
+
+
+def level_mix() -> Dict[str, float]:
+    mix = {}
+    for item in TEST_LEVEL_MIX:
+        level, _, share = item.partition(":")
+        mix[level.strip().upper()] = float(share or 0)
+    return mix
+
+
+def allocate(total: int, weights: Sequence[float]) -> List[int]:
+    """
+    Делит total на целые части пропорционально весам (метод наибольших остатков)
+    """
+    weight_sum = sum(weights)
+    if not weights or weight_sum <= 0:
+        return [total // max(len(weights), 1)] * len(weights)
+    exact = [total * weight / weight_sum for weight in weights]
+    parts = [math.floor(value) for value in exact]
+    by_remainder = sorted(range(len(weights)), key=lambda i: exact[i] - parts[i], reverse=True)
+    for i in by_remainder[:total - sum(parts)]:
+        parts[i] += 1
+    return parts
+
+
+def split_sections(text: str) -> List[str]:
+    """
+    Разделы структурированного текста (по заголовкам, как в document_index),
+    а если заголовков нет — абзацы
+    """
+    sections: List[List[str]] = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not sections or (stripped and any(pattern.match(stripped) for pattern in HEADING_PATTERNS)):
+            sections.append([])
+        sections[-1].append(line)
+    result = ["\n".join(lines).strip() for lines in sections]
+    result = [section for section in result if section]
+    if len(result) <= 1:
+        result = [paragraph.strip() for paragraph in re.split(r"\n\s*\n", text) if paragraph.strip()]
+    return result
+
+
+def _group_sections(sections: List[str], count: int) -> List[str]:
+    # Соседние разделы объединяются в count групп примерно равной длины
+    total = sum(len(section) for section in sections)
+    groups: List[List[str]] = [[]]
+    filled = 0
+    for section in sections:
+        boundary = total * len(groups) / count
+        if groups[-1] and len(groups) < count and filled + len(section) / 2 > boundary:
+            groups.append([])
+        groups[-1].append(section)
+        filled += len(section)
+    return ["\n\n".join(group) for group in groups]
+
+
+def plan_shards(text: str, num_questions: int) -> List[TestShard]:
+    """
+    Делит генерацию num_questions вопросов на шарды по разделам документа.
+
+    Число вопросов шарда пропорционально длине его текста, уровни сложности
+    распределяются по TEST_LEVEL_MIX внутри каждого шарда.
+    """
+    sections = split_sections(text) or [text]
+    count = max(1, min(math.ceil(num_questions / TEST_SHARD_QUESTIONS), TEST_MAX_SHARDS, len(sections)))
+    texts = _group_sections(sections, count)
+    mix = level_mix()
+    shards = []
+    for shard_text, quota in zip(texts, allocate(num_questions, [len(item) for item in texts])):
+        if quota <= 0:
+            continue
+        requested = quota + math.ceil(quota * TEST_SHARD_OVERSHOOT)
+        levels = dict(zip(mix, allocate(requested, list(mix.values()))))
+        shards.append(TestShard(shard_text, quota, {level: n for level, n in levels.items() if n}))
+    return shards
+
+
+def _question_words(request: dict) -> frozenset:
+    question = (request.get("questionCreate") or {}).get("question") or ""
+    return frozenset(WORD.findall(question.casefold()))
+
+
+def is_duplicate(words: frozenset, seen: List[frozenset]) -> bool:
+    for other in seen:
+        union = len(words | other)
+        if union and len(words & other) / union >= TEST_DEDUP_SIMILARITY:
+            return True
+    return False
+
+
+def merge_tests(tests: List[dict], shards: List[TestShard], num_questions: int) -> dict:
+    """
+    Объединяет тесты шардов в один: повторяющиеся вопросы удаляются, из каждого
+    шарда берется не больше его квоты, недостающие вопросы добираются из запаса
+    других шардов.
+    """
+    seen: List[frozenset] = []
+    unique: List[List[dict]] = []
+    duplicates = 0
+    for test in tests:
+        kept = []
+        for request in test.get("questionCreateRequests") or []:
+            words = _question_words(request)
+            if not words or is_duplicate(words, seen):
+                duplicates += 1
+                continue
+            seen.append(words)
+            kept.append(request)
+        unique.append(kept)
+
+    selected = [kept[:shard.quota] for kept, shard in zip(unique, shards)]
+    spare = [request for kept, shard in zip(unique, shards) for request in kept[shard.quota:]]
+    questions = [request for kept in selected for request in kept]
+    questions += spare[:max(0, num_questions - len(questions))]
+    print(f"Merged {len(tests)} test shards: {len(questions)} questions, {duplicates} duplicates removed")
+
+    merged = {key: value for key, value in tests[0].items() if key != "questionCreateRequests"}
+    merged["questionCreateRequests"] = questions[:num_questions]
+    return merged
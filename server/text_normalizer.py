@@ -0,0 +1,189 @@
+import re
+from collections import Counter
+from typing import Dict, List, NamedTuple
+
+from decouple import config
+
+import metrics
+
+# Очистка текста PDF перед отправкой в LLM: колонтитулы, номера страниц и
+# баннеры курса повторяются на каждом слайде, а переносы и рваные пробелы
+# PyPDF2 стоят токенов, не добавляя смысла.
+NORMALIZE_TEXT = config('NORMALIZE_TEXT', default=True, cast=bool)
+# Строка считается колонтитулом, если (с точностью до цифр) встречается
+# в начале или конце стольких страниц документа
+NORMALIZER_REPEAT_RATIO = config('NORMALIZER_REPEAT_RATIO', default=0.5, cast=float)
+NORMALIZER_MIN_PAGES = config('NORMALIZER_MIN_PAGES', default=3, cast=int)
+# Сколько первых и последних строк страницы проверяется на повторы
+NORMALIZER_EDGE_LINES = config('NORMALIZER_EDGE_LINES', default=3, cast=int)
+
+PAGE_NUMBER = re.compile(r"^(?:page|стр\.?|страница|слайд|slide)?\s*(\d{1,4})(?:\s*(?:/|of|из)\s*\d{1,4})?$", re.IGNORECASE)
+# Ключ строки-номера после замены цифр (см. _line_key): такие строки
+# убираются только как номера страниц, а не как повторяющиеся колонтитулы
+PAGE_NUMBER_KEY = re.compile(r"^(?:page|стр\.?|страница|слайд|slide)?\s*#(?:\s*(?:/|of|из)\s*#)?$")
+# Перенос перед строчной буквой любого алфавита (в том числе казахскими ә, і, ң, ғ, ү, ұ, қ, ө, һ)
+HYPHENATION = re.compile(r"(\w)[-\u00ad]\n[ \t]*(?=([^\W\d_]))")
+SPACES = re.compile(r"[ \t\u00a0\u2000-\u200b]+")
+BLANK_LINES = re.compile(r"\n{3,}")
+
+
+class NormalizationStats(NamedTuple):
+    tokens_before: int
+    tokens_after: int
+    removed_lines: int
+
+    @property
+    def saved_ratio(self) -> float:
+        return 1 - self.tokens_after / self.tokens_before if self.tokens_before else 0.0
+
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Число токенов по tiktoken (cl100k_base); без него или без доступа к кэшу
+    кодировок — оценка по 4 символа на токен
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"Token counting falls back to an estimate: {str(e)}")
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def _line_key(line: str) -> str:
+    # Номера страниц и даты в колонтитулах меняются от страницы к странице
+    return re.sub(r"\d+", "#", SPACES.sub(" ", line).strip().casefold())
+
+
+def _split_lines(text: str) -> List[str]:
+    return text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+
+
+def _edge_positions(lines: List[str]) -> Dict[tuple, int]:
+    """
+    Первые и последние непустые строки страницы — там, где печатаются колонтитулы:
+    позиция от края ("top", k) или ("bottom", k) -> индекс строки
+    """
+    content = [n for n, line in enumerate(lines) if line.strip()]
+    positions = {}
+    for k, n in enumerate(content[:NORMALIZER_EDGE_LINES]):
+        positions[("top", k)] = n
+    for k, n in enumerate(reversed(content[-NORMALIZER_EDGE_LINES:])):
+        positions[("bottom", k)] = n
+    return positions
+
+
+def _edge_indexes(lines: List[str]) -> set:
+    return set(_edge_positions(lines).values())
+
+
+def page_number_lines(pages: List[str]) -> List[set]:
+    """
+    Индексы строк с номерами страниц для каждой страницы.
+
+    Номер страниц — строка-число в одной и той же позиции от края на большинстве
+    страниц, причем числа растут от страницы к странице. Одиночные числа (год,
+    ответ, номер пункта) так не выглядят и остаются в тексте.
+    """
+    found = [set() for _ in pages]
+    if len(pages) < NORMALIZER_MIN_PAGES:
+        return found
+    # Позиция от края -> [(номер страницы в документе, индекс строки, число)]
+    candidates: Dict[tuple, list] = {}
+    for page, text in enumerate(pages):
+        lines = _split_lines(text)
+        for position, n in _edge_positions(lines).items():
+            match = PAGE_NUMBER.match(SPACES.sub(" ", lines[n]).strip())
+            if match:
+                candidates.setdefault(position, []).append((page, n, int(match.group(1))))
+    threshold = max(2, NORMALIZER_REPEAT_RATIO * len(pages))
+    for entries in candidates.values():
+        numbers = [number for _, _, number in entries]
+        if len(entries) >= threshold and all(a < b for a, b in zip(numbers, numbers[1:])):
+            for page, n, _ in entries:
+                found[page].add(n)
+    return found
+
+
+def repeated_lines(pages: List[str]) -> set:
+    """
+    Ключи строк, повторяющихся в начале или конце большинства страниц
+    """
+    if len(pages) < NORMALIZER_MIN_PAGES:
+        return set()
+    counts = Counter()
+    for text in pages:
+        lines = _split_lines(text)
+        counts.update({_line_key(lines[n]) for n in _edge_indexes(lines)})
+    threshold = max(2, NORMALIZER_REPEAT_RATIO * len(pages))
+    return {key for key, count in counts.items()
+            if key and count >= threshold and not PAGE_NUMBER_KEY.match(key)}
+
+
+def _join_hyphenation(match: re.Match) -> str:
+    # Дефис перед заглавной буквой — не перенос, а, например, «Алматы-\nАстана»
+    return match.group(1) if match.group(2).islower() else match.group(0)
+
+
+def _clean_page(text: str, boilerplate: set, page_numbers: set) -> tuple:
+    lines = _split_lines(text)
+    edges = _edge_indexes(lines)
+    kept = []
+    removed = 0
+    for n, line in enumerate(lines):
+        stripped = SPACES.sub(" ", line).strip()
+        if n in page_numbers or (n in edges and _line_key(line) in boilerplate):
+            removed += 1
+            continue
+        kept.append(stripped)
+    text = HYPHENATION.sub(_join_hyphenation, "\n".join(kept))
+    return BLANK_LINES.sub("\n\n", text).strip() + "\n", removed
+
+
+def normalize_pages(pages: Dict[int, str], endpoint: str = None) -> Dict[int, str]:
+    """
+    Убирает из текста страниц повторяющиеся колонтитулы и номера страниц,
+    склеивает переносы и схлопывает пробелы.
+
+    Args:
+        pages (Dict[int, str]): Текст страниц по индексам (в порядке документа)
+        endpoint (str): Метка эндпоинта для метрики сэкономленных токенов
+
+    Returns:
+        Dict[int, str]: Очищенный текст страниц (без изменений при NORMALIZE_TEXT=False)
+    """
+    if not NORMALIZE_TEXT or not pages:
+        return pages
+    texts = list(pages.values())
+    boilerplate = repeated_lines(texts)
+    numbers = page_number_lines(texts)
+    normalized = {}
+    removed = 0
+    for (i, text), page_numbers in zip(pages.items(), numbers):
+        normalized[i], page_removed = _clean_page(text, boilerplate, page_numbers)
+        removed += page_removed
+
+    stats = NormalizationStats(
+        count_tokens("".join(pages.values())), count_tokens("".join(normalized.values())), removed
+    )
+    print(f"Text normalized: {stats.tokens_before} -> {stats.tokens_after} tokens "
+          f"({stats.saved_ratio:.1%} saved, {stats.removed_lines} boilerplate lines removed)")
+    labels = (endpoint or metrics.current_endpoint.get(),)
+    metrics.PROMPT_TOKENS_TOTAL.inc(labels + ("extracted",), stats.tokens_before)
+    metrics.PROMPT_TOKENS_TOTAL.inc(labels + ("normalized",), stats.tokens_after)
+    return normalized
+
+
+def normalize_text(pages: Dict[int, str], endpoint: str = None) -> str:
+    """
+    Очищенный текст страниц одной строкой
+    """
+    return "".join(normalize_pages(pages, endpoint).values())
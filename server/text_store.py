@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional
+
+from decouple import config
+
+# Хранилище извлеченного текста PDF, общее для эндпоинтов, CLI и воркеров:
+# SQLite допускает одновременный доступ из нескольких процессов
+TEXT_STORE_PATH = config(
+    'TEXT_STORE_PATH',
+    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'text_store.sqlite3')
+)
+# Предельный размер сжатого текста в хранилище; при превышении удаляются
+# документы, к которым дольше всего не обращались
+TEXT_STORE_MAX_MB = config('TEXT_STORE_MAX_MB', default=256, cast=int)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    content_hash TEXT PRIMARY KEY,
+    metadata TEXT NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0,
+    last_access REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    content_hash TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    text BLOB NOT NULL,
+    PRIMARY KEY (content_hash, page)
+);
+CREATE TABLE IF NOT EXISTS aliases (
+    alias TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS page_texts (
+    page_hash TEXT PRIMARY KEY,
+    text BLOB NOT NULL,
+    last_access REAL NOT NULL
+);
+"""
+
+
+def file_hash(path: str) -> str:
+    """
+    SHA-256 содержимого файла
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class TextStore:
+    """
+    Постраничный текст PDF документов, сжатый zlib и индексированный по хэшу содержимого.
+
+    Кроме текста страниц хранятся метаданные документа (количество страниц,
+    оглавление) и псевдонимы — например, S3 ключ с ETag, — чтобы найти
+    документ без скачивания файла.
+    """
+    def __init__(self, path: str = TEXT_STORE_PATH, max_bytes: int = TEXT_STORE_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # Отдельное соединение на операцию: безопасно для потоков и после fork
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get_metadata(self, content_hash: str) -> Optional[dict]:
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT metadata FROM documents WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE documents SET last_access = ? WHERE content_hash = ?", (time.time(), content_hash)
+            )
+        return json.loads(row[0])
+
+    def get_pages(self, content_hash: str, pages: Iterable[int]) -> Optional[Dict[int, str]]:
+        """
+        Возвращает текст запрошенных страниц или None, если хотя бы одной нет в хранилище
+        """
+        pages = list(pages)
+        with self._connect() as connection:
+            rows = connection.execute(
+                f"SELECT page, text FROM pages WHERE content_hash = ? AND page IN ({','.join('?' * len(pages))})",
+                (content_hash, *pages)
+            ).fetchall()
+            if len(rows) < len(set(pages)):
+                return None
+            connection.execute(
+                "UPDATE documents SET last_access = ? WHERE content_hash = ?", (time.time(), content_hash)
+            )
+        return {page: zlib.decompress(text).decode('utf-8') for page, text in rows}
+
+    def put_pages(self, content_hash: str, pages: Dict[int, str], metadata: dict):
+        """
+        Сохраняет текст страниц (дополняя уже сохраненные) и метаданные документа
+        """
+        compressed = [(content_hash, page, zlib.compress(text.encode('utf-8'), 6)) for page, text in pages.items()]
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO pages (content_hash, page, text) VALUES (?, ?, ?)", compressed
+            )
+            size = connection.execute(
+                "SELECT COALESCE(SUM(LENGTH(text)), 0) FROM pages WHERE content_hash = ?", (content_hash,)
+            ).fetchone()[0]
+            connection.execute(
+                "INSERT OR REPLACE INTO documents (content_hash, metadata, size, last_access) VALUES (?, ?, ?, ?)",
+                (content_hash, json.dumps(metadata, ensure_ascii=False), size, time.time())
+            )
+            self._evict(connection)
+
+    def get_page_texts(self, page_hashes: Iterable[str]) -> Dict[str, str]:
+        """
+        Текст страниц по хэшу их содержимого — общий для всех документов
+        (одинаковые слайды в разных PDF и версиях одного PDF)
+        """
+        page_hashes = list(set(page_hashes))
+        if not page_hashes:
+            return {}
+        placeholders = ','.join('?' * len(page_hashes))
+        with self._connect() as connection:
+            rows = connection.execute(
+                f"SELECT page_hash, text FROM page_texts WHERE page_hash IN ({placeholders})", page_hashes
+            ).fetchall()
+            connection.execute(
+                f"UPDATE page_texts SET last_access = ? WHERE page_hash IN ({placeholders})",
+                (time.time(), *page_hashes)
+            )
+        return {page_hash: zlib.decompress(text).decode('utf-8') for page_hash, text in rows}
+
+    def put_page_texts(self, texts: Dict[str, str]):
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO page_texts (page_hash, text, last_access) VALUES (?, ?, ?)",
+                [(page_hash, zlib.compress(text.encode('utf-8'), 6), now) for page_hash, text in texts.items()]
+            )
+            self._evict_page_texts(connection)
+
+    def resolve_alias(self, alias: str) -> Optional[str]:
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT content_hash FROM aliases WHERE alias = ?", (alias,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def add_alias(self, alias: str, content_hash: str):
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO aliases (alias, content_hash) VALUES (?, ?)", (alias, content_hash)
+            )
+
+    def _evict(self, connection: sqlite3.Connection):
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM documents").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for content_hash, size in connection.execute(
+            "SELECT content_hash, size FROM documents ORDER BY last_access"
+        ).fetchall():
+            connection.execute("DELETE FROM pages WHERE content_hash = ?", (content_hash,))
+            connection.execute("DELETE FROM aliases WHERE content_hash = ?", (content_hash,))
+            connection.execute("DELETE FROM documents WHERE content_hash = ?", (content_hash,))
+            print(f"Text store: evicted {content_hash} ({size} bytes)")
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def _evict_page_texts(self, connection: sqlite3.Connection):
+        # Текст по хэшу страницы дублирует текст документов, поэтому у него
+        # отдельный бюджет того же размера
+        total = connection.execute("SELECT COALESCE(SUM(LENGTH(text)), 0) FROM page_texts").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for page_hash, size in connection.execute(
+            "SELECT page_hash, LENGTH(text) FROM page_texts ORDER BY last_access"
+        ).fetchall():
+            connection.execute("DELETE FROM page_texts WHERE page_hash = ?", (page_hash,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+_text_store: Optional[TextStore] = None
+
+
+def get_text_store() -> TextStore:
+    """
+    Общее хранилище текста процесса (создается при первом обращении)
+    """
+    global _text_store
+    if _text_store is None:
+        _text_store = TextStore()
+    return _text_store
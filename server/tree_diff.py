@@ -0,0 +1,262 @@
+import copy
+import hashlib
+import json
+from typing import Dict, List, Optional
+
+# Diff двух версий UI дерева (STACK / TITLED_CONTAINER / ICON_TEXT / TEXT)
+# в виде JSON Patch (RFC 6902). Узлы в списках детей сопоставляются по id,
+# затем по содержимому без учета id (LLM генерирует id заново при каждом
+# запуске), затем по типу узла в порядке следования — чтобы правка одного
+# слова давала одну операцию replace, а не замену всего раздела.
+
+
+def _pointer(path: List) -> str:
+    return "".join("/" + str(part).replace("~", "~0").replace("/", "~1") for part in path)
+
+
+def _is_node(value) -> bool:
+    return isinstance(value, dict) and "nodeType" in value
+
+
+def _strip_ids(value):
+    if isinstance(value, dict):
+        return {key: _strip_ids(item) for key, item in value.items() if key != "id"}
+    if isinstance(value, list):
+        return [_strip_ids(item) for item in value]
+    return value
+
+
+def content_signature(node: dict) -> str:
+    """
+    Хэш содержимого узла без учета id (своих и потомков)
+    """
+    canonical = json.dumps(_strip_ids(node), ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def _size(value) -> int:
+    return len(json.dumps(value, ensure_ascii=False, separators=(",", ":")))
+
+
+def _match_nodes(old: List[dict], new: List[dict]) -> Dict[int, int]:
+    """
+    Сопоставление элементов списков: индекс в new -> индекс в old
+    """
+    matches: Dict[int, int] = {}
+    used = set()
+
+    old_by_id = {}
+    for index, node in enumerate(old):
+        node_id = node.get("id")
+        if isinstance(node_id, str):
+            old_by_id.setdefault(node_id, index)
+    for index, node in enumerate(new):
+        old_index = old_by_id.get(node.get("id"))
+        if old_index is not None and old_index not in used:
+            matches[index] = old_index
+            used.add(old_index)
+
+    old_by_content: Dict[str, List[int]] = {}
+    for index, node in enumerate(old):
+        if index not in used:
+            old_by_content.setdefault(content_signature(node), []).append(index)
+    for index, node in enumerate(new):
+        if index in matches:
+            continue
+        candidates = old_by_content.get(content_signature(node))
+        if candidates:
+            old_index = candidates.pop(0)
+            matches[index] = old_index
+            used.add(old_index)
+
+    # Оставшиеся узлы одного типа сопоставляются по порядку между соседними
+    # уже сопоставленными узлами — это измененные версии тех же узлов
+    previous_old = -1
+    pending_new = []
+    for index in list(range(len(new))) + [None]:
+        if index is not None and index not in matches:
+            pending_new.append(index)
+            continue
+        next_old = matches[index] if index is not None else len(old)
+        gap_old = [i for i in range(previous_old + 1, next_old) if i not in used]
+        for new_index in pending_new:
+            for position, old_index in enumerate(gap_old):
+                if old[old_index].get("nodeType") == new[new_index].get("nodeType"):
+                    matches[new_index] = old_index
+                    used.add(old_index)
+                    del gap_old[position]
+                    break
+        pending_new = []
+        if index is not None:
+            previous_old = max(previous_old, next_old)
+    return matches
+
+
+def _diff_node_list(old: List, new: List, path: List, ops: List[dict]):
+    matches = _match_nodes(old, new)
+    matched_old = set(matches.values())
+
+    # Сначала удаляем несопоставленные элементы (с конца, чтобы не сдвигать индексы)
+    for old_index in range(len(old) - 1, -1, -1):
+        if old_index not in matched_old:
+            ops.append({"op": "remove", "path": _pointer(path + [old_index])})
+    # Текущее содержимое списка: индексы в old (None — добавленный элемент)
+    working: List[Optional[int]] = [i for i in range(len(old)) if i in matched_old]
+
+    for new_index, value in enumerate(new):
+        old_index = matches.get(new_index)
+        if old_index is None:
+            ops.append({"op": "add", "path": _pointer(path + [new_index]), "value": value})
+            working.insert(new_index, None)
+            continue
+        position = working.index(old_index)
+        if position != new_index:
+            ops.append({"op": "move", "from": _pointer(path + [position]),
+                        "path": _pointer(path + [new_index])})
+            working.insert(new_index, working.pop(position))
+        _diff_value(old[old_index], value, path + [new_index], ops)
+
+
+def _diff_value(old, new, path: List, ops: List[dict]):
+    if old == new:
+        return
+    if _is_node(old) and _is_node(new) and old.get("nodeType") != new.get("nodeType"):
+        ops.append({"op": "replace", "path": _pointer(path), "value": new})
+        return
+    if isinstance(old, dict) and isinstance(new, dict):
+        child_ops: List[dict] = []
+        for key in old:
+            if key not in new:
+                child_ops.append({"op": "remove", "path": _pointer(path + [key])})
+        for key, value in new.items():
+            if key not in old:
+                child_ops.append({"op": "add", "path": _pointer(path + [key]), "value": value})
+            else:
+                _diff_value(old[key], value, path + [key], child_ops)
+        # Если узел изменился почти целиком, одна замена короче набора операций
+        if path and _size(child_ops) >= _size(new):
+            ops.append({"op": "replace", "path": _pointer(path), "value": new})
+        else:
+            ops.extend(child_ops)
+        return
+    if (isinstance(old, list) and isinstance(new, list)
+            and all(_is_node(item) for item in old) and all(_is_node(item) for item in new)):
+        child_ops = []
+        _diff_node_list(old, new, path, child_ops)
+        if path and _size(child_ops) >= _size(new):
+            ops.append({"op": "replace", "path": _pointer(path), "value": new})
+        else:
+            ops.extend(child_ops)
+        return
+    ops.append({"op": "replace", "path": _pointer(path), "value": new})
+
+
+def _collect_ids(value, ids: set):
+    if isinstance(value, dict):
+        if isinstance(value.get("id"), str):
+            ids.add(value["id"])
+        for item in value.values():
+            _collect_ids(item, ids)
+    elif isinstance(value, list):
+        for item in value:
+            _collect_ids(item, ids)
+
+
+def _stabilize(old, new, new_ids: set):
+    if _is_node(old) and _is_node(new):
+        if old.get("nodeType") != new.get("nodeType"):
+            return
+        old_id, new_id = old.get("id"), new.get("id")
+        if isinstance(old_id, str) and old_id != new_id and old_id not in new_ids:
+            new_ids.discard(new_id)
+            new_ids.add(old_id)
+            new["id"] = old_id
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key, value in new.items():
+            if key in old and key != "id":
+                _stabilize(old[key], value, new_ids)
+    elif (isinstance(old, list) and isinstance(new, list)
+          and all(_is_node(item) for item in old) and all(_is_node(item) for item in new)):
+        for new_index, old_index in _match_nodes(old, new).items():
+            _stabilize(old[old_index], new[new_index], new_ids)
+
+
+def stabilize_ids(old, new):
+    """
+    Переносит id узлов предыдущей версии на сопоставленные узлы новой (на месте).
+
+    LLM генерирует id заново при каждом запуске; без переноса diff содержал бы
+    замену каждого id, а клиент перерисовывал бы все узлы (id — ключи React).
+    """
+    new_ids: set = set()
+    _collect_ids(new, new_ids)
+    _stabilize(old, new, new_ids)
+    return new
+
+
+def diff_trees(old, new) -> List[dict]:
+    """
+    JSON Patch (RFC 6902), превращающий old в new
+
+    Args:
+        old: Предыдущая версия UI дерева или теста
+        new: Новая версия
+
+    Returns:
+        List[dict]: Операции add / remove / replace / move
+    """
+    ops: List[dict] = []
+    _diff_value(old, new, [], ops)
+    return ops
+
+
+def _parse_pointer(pointer: str) -> List[str]:
+    if not pointer:
+        return []
+    return [part.replace("~1", "/").replace("~0", "~") for part in pointer[1:].split("/")]
+
+
+def _resolve(document, parts: List[str]):
+    target = document
+    for part in parts:
+        target = target[int(part)] if isinstance(target, list) else target[part]
+    return target
+
+
+def apply_patch(document, ops: List[dict]):
+    """
+    Применяет JSON Patch (операции add / remove / replace / move) к копии документа
+    """
+    document = copy.deepcopy(document)
+    for op in ops:
+        parts = _parse_pointer(op["path"])
+        if not parts:
+            if op["op"] in ("add", "replace"):
+                document = copy.deepcopy(op["value"])
+                continue
+            raise ValueError(f"Unsupported root operation: {op['op']}")
+        if op["op"] == "move":
+            from_parts = _parse_pointer(op["from"])
+            parent = _resolve(document, from_parts[:-1])
+            value = parent.pop(int(from_parts[-1])) if isinstance(parent, list) else parent.pop(from_parts[-1])
+            op = {"op": "add", "path": op["path"], "value": value}
+        parent = _resolve(document, parts[:-1])
+        key = parts[-1]
+        if isinstance(parent, list):
+            index = len(parent) if key == "-" else int(key)
+            if op["op"] == "add":
+                parent.insert(index, copy.deepcopy(op["value"]))
+            elif op["op"] == "remove":
+                del parent[index]
+            elif op["op"] == "replace":
+                parent[index] = copy.deepcopy(op["value"])
+            else:
+                raise ValueError(f"Unsupported operation: {op['op']}")
+        else:
+            if op["op"] in ("add", "replace"):
+                parent[key] = copy.deepcopy(op["value"])
+            elif op["op"] == "remove":
+                del parent[key]
+            else:
+                raise ValueError(f"Unsupported operation: {op['op']}")
+    return document
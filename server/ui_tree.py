@@ -0,0 +1,143 @@
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from decouple import config
+
+from result_store import get_result_store
+
+# Сколько уровней потомков раскрывать по умолчанию и максимум за один запрос
+UI_TREE_DEFAULT_DEPTH = config('UI_TREE_DEFAULT_DEPTH', default=1, cast=int)
+UI_TREE_MAX_DEPTH = config('UI_TREE_MAX_DEPTH', default=8, cast=int)
+# Сколько элементов списка детей отдавать за раз
+UI_TREE_PAGE_SIZE = config('UI_TREE_PAGE_SIZE', default=50, cast=int)
+UI_TREE_MAX_PAGE_SIZE = 500
+# Маленькие поддеревья (заголовок TITLED_CONTAINER, ICON_TEXT) отдаются целиком:
+# отдельный запрос за ними дороже, чем их размер
+UI_TREE_INLINE_NODES = config('UI_TREE_INLINE_NODES', default=4, cast=int)
+# Сколько разобранных деревьев держать в памяти процесса
+UI_TREE_CACHE_SIZE = config('UI_TREE_CACHE_SIZE', default=32, cast=int)
+
+
+def is_node(value) -> bool:
+    return isinstance(value, dict) and "nodeType" in value
+
+
+def _child_lists(node: dict):
+    for key, value in node.items():
+        if is_node(value):
+            yield key, [value]
+        elif isinstance(value, list) and any(is_node(item) for item in value):
+            yield key, [item for item in value if is_node(item)]
+
+
+class TreeIndex:
+    """
+    Индекс UI дерева: узлы по id, родители и размеры поддеревьев.
+
+    Узлы без id или с повторным id нельзя запросить отдельно, поэтому
+    при выдаче они всегда включаются в родителя целиком.
+    """
+    def __init__(self, tree: dict):
+        self.root = tree
+        self.nodes: Dict[str, dict] = {}
+        self.parents: Dict[str, Optional[str]] = {}
+        # Размер поддерева по id() объекта узла (узлы без id тоже учитываются)
+        self.sizes: Dict[int, int] = {}
+
+        # Обход без рекурсии: глубина дерева задается LLM и не ограничена
+        stack = [(tree, None, False)]
+        while stack:
+            node, parent_id, visited = stack.pop()
+            if visited:
+                self.sizes[id(node)] = 1 + sum(
+                    self.sizes[id(child)] for _, children in _child_lists(node) for child in children
+                )
+                continue
+            node_id = node.get("id")
+            if isinstance(node_id, str) and node_id not in self.nodes:
+                self.nodes[node_id] = node
+                self.parents[node_id] = parent_id
+                parent_id = node_id
+            stack.append((node, parent_id, True))
+            for _, children in _child_lists(node):
+                for child in children:
+                    stack.append((child, parent_id, False))
+
+    def addressable(self, node: dict) -> bool:
+        node_id = node.get("id")
+        return isinstance(node_id, str) and self.nodes.get(node_id) is node
+
+    def path(self, node_id: str) -> List[str]:
+        """
+        id предков узла от корня
+        """
+        path = []
+        parent_id = self.parents.get(node_id)
+        while parent_id is not None:
+            path.append(parent_id)
+            parent_id = self.parents.get(parent_id)
+        return path[::-1]
+
+    def view(self, node: dict, depth: int, offset: int = 0, limit: int = UI_TREE_PAGE_SIZE) -> dict:
+        """
+        Копия узла с потомками до глубины depth.
+
+        Более глубокие узлы заменяются заглушкой {"nodeType", "id", "truncated": true,
+        "descendants": N}, которую можно запросить по id. Списки детей режутся
+        до limit элементов (у самого узла — начиная с offset), полная длина
+        списка передается в поле "<ключ>Total".
+        """
+        result = {}
+        for key, value in node.items():
+            if is_node(value):
+                result[key] = self._child_view(value, depth, limit)
+            elif isinstance(value, list) and any(is_node(item) for item in value):
+                page = value[offset:offset + limit]
+                result[key] = [self._child_view(item, depth, limit) if is_node(item) else item for item in page]
+                if len(page) < len(value):
+                    result[f"{key}Total"] = len(value)
+            else:
+                result[key] = value
+        return result
+
+    def _child_view(self, child: dict, depth: int, limit: int) -> dict:
+        size = self.sizes[id(child)]
+        if size <= UI_TREE_INLINE_NODES or not self.addressable(child):
+            return child
+        if depth <= 0:
+            return {"nodeType": child["nodeType"], "id": child["id"], "truncated": True, "descendants": size - 1}
+        return self.view(child, depth - 1, 0, limit)
+
+
+_indexes: "OrderedDict[str, TreeIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_tree_index(result_id: str) -> Optional[TreeIndex]:
+    """
+    Индекс сохраненной сводки (из памяти или из хранилища результатов)
+
+    Returns:
+        Optional[TreeIndex]: None, если результата нет или это не UI дерево
+    """
+    with _indexes_lock:
+        index = _indexes.get(result_id)
+        if index is not None:
+            _indexes.move_to_end(result_id)
+            return index
+
+    found = get_result_store().get("summary", result_id)
+    if found is None:
+        return None
+    tree = json.loads(found[0].body)
+    if not is_node(tree):
+        return None
+    index = TreeIndex(tree)
+
+    with _indexes_lock:
+        _indexes[result_id] = index
+        while len(_indexes) > UI_TREE_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
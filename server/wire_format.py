@@ -0,0 +1,118 @@
+import hashlib
+import json
+from typing import Optional
+
+import msgpack
+
+from summarizer_agent import (
+    AlignItems, Background, BorderType, FlexWrap, FontColor, FontSize, FontWeight,
+    Icon, JustifyContent, NodeType, TextAlign,
+)
+
+# Компактный формат результатов: MessagePack, в котором известные ключи
+# заменены номерами, а строки перечислений — ext-значениями с номером.
+# Таблицы только дополняются в конец: номер ключа или значения не меняется,
+# а версия формата (хэш таблиц) передается в media type.
+MSGPACK_MEDIA_TYPE = "application/vnd.qysqa+msgpack"
+JSON_MEDIA_TYPE = "application/json"
+
+# Ключи узлов UI дерева (типы из parser/types.ts фронтенда) и тестов
+INTERNED_KEYS = (
+    "nodeType", "id", "htmltext", "text", "icon", "fontSize", "textAlign", "fontColor",
+    "fontWeight", "gap", "children", "vertical", "background", "content", "titleText",
+    "divided", "isDivided", "padding", "margin", "borderRadius", "borderColor", "borderType",
+    "justifyContent", "alignItems", "flexWrap", "width", "height", "minWidth", "minHeight",
+    "overflowX", "overflowY", "flex", "opacity", "links", "fromId", "toId", "childNode", "url",
+    "title", "description", "language", "showQuestions", "questionCreateRequests",
+    "questionCreate", "question", "level", "durationInSeconds", "variants", "correct",
+    "correctVariantIndex", "quiz", "matchWith", "terms", "definitions", "correctMatches",
+    "termIndex", "definitionIndex",
+)
+
+# Значения перечислений summarizer_agent.py (повторы между перечислениями
+# хранятся один раз)
+INTERNED_ENUMS = (NodeType, FontSize, TextAlign, FontColor, FontWeight, Background, BorderType,
+                  JustifyContent, AlignItems, FlexWrap, Icon)
+INTERNED_VALUES = tuple(dict.fromkeys(member.value for enum in INTERNED_ENUMS for member in enum))
+
+# Код ext-типа MessagePack для ссылки на INTERNED_VALUES (номер — 1 или 2 байта big-endian)
+VALUE_EXT_CODE = 1
+
+WIRE_FORMAT_VERSION = hashlib.sha256(
+    json.dumps([INTERNED_KEYS, INTERNED_VALUES], ensure_ascii=False).encode("utf-8")
+).hexdigest()[:8]
+
+_key_numbers = {key: number for number, key in enumerate(INTERNED_KEYS)}
+_value_refs = {
+    value: msgpack.ExtType(VALUE_EXT_CODE, number.to_bytes(1 if number < 256 else 2, "big"))
+    for number, value in enumerate(INTERNED_VALUES)
+}
+
+
+def wire_tables() -> dict:
+    """
+    Таблицы для декодера на клиенте (GET /wire-format)
+    """
+    return {
+        "mediaType": MSGPACK_MEDIA_TYPE,
+        "version": WIRE_FORMAT_VERSION,
+        "keys": list(INTERNED_KEYS),
+        "values": list(INTERNED_VALUES),
+        "valueExtCode": VALUE_EXT_CODE,
+    }
+
+
+def msgpack_media_type() -> str:
+    return f"{MSGPACK_MEDIA_TYPE}; v={WIRE_FORMAT_VERSION}"
+
+
+def _intern(value):
+    if isinstance(value, str):
+        return _value_refs.get(value, value)
+    if isinstance(value, dict):
+        return {_key_numbers.get(key, key): _intern(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_intern(item) for item in value]
+    return value
+
+
+def _restore_ext(code: int, data: bytes):
+    if code == VALUE_EXT_CODE:
+        return INTERNED_VALUES[int.from_bytes(data, "big")]
+    return msgpack.ExtType(code, data)
+
+
+def _restore_keys(pairs):
+    return {INTERNED_KEYS[key] if isinstance(key, int) else key: value for key, value in pairs}
+
+
+def encode_msgpack(data) -> bytes:
+    return msgpack.packb(_intern(data), use_bin_type=True)
+
+
+def decode_msgpack(payload: bytes):
+    return msgpack.unpackb(payload, raw=False, strict_map_key=False,
+                           ext_hook=_restore_ext, object_pairs_hook=_restore_keys)
+
+
+def accepts_msgpack(accept: Optional[str]) -> bool:
+    """
+    Выбирает MessagePack, только если клиент явно предпочитает его JSON
+    (по умолчанию, в том числе для */*, остается JSON)
+    """
+    if not accept:
+        return False
+    weights = {}
+    for part in accept.split(","):
+        media_type, *params = [item.strip() for item in part.split(";")]
+        weight = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    weight = float(param[2:])
+                except ValueError:
+                    weight = 0.0
+        weights[media_type.lower()] = weight
+    msgpack_weight = weights.get(MSGPACK_MEDIA_TYPE, 0.0)
+    json_weight = max(weights.get(JSON_MEDIA_TYPE, 0.0), weights.get("application/*", 0.0), weights.get("*/*", 0.0))
+    return msgpack_weight > 0 and msgpack_weight >= json_weight